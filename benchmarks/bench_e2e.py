@@ -0,0 +1,151 @@
+"""Wall time and round trips of mhi commands, end to end, against tests/imapsim.py
+
+    python benchmarks/bench_e2e.py [--messages N] [--folders N] [--rtt MS]
+                                   [--latency MS] [--bandwidth KB/s] [--rc LINE]...
+                                   [--update]
+
+Runs folders, scan (with an empty and then a warm scan cache), pick,
+show, next, refile and rmm in a throwaway HOME against a simulated
+server, and prints how long each took, how many round trips it made, how
+many IMAP commands it sent and how many bytes it was sent.  Each --rc
+adds a line to the .mhirc, to compare settings (say 'status_sessions = 2').
+
+Round trips are counted by mhi itself, as --stats counts them (see
+mhi/imapstats.py).  The server's count, reads it had to wait for the
+client for plus one per connection, is shown beside it for comparison
+only: whether a pipelined command reaches it in time to share a read
+depends on timing.
+
+Round trips are what a slow link makes expensive, and unlike wall time
+they don't depend on the machine, so with the default mailbox on an
+unthrottled link they're checked against ROUNDTRIPS_FILE; any command
+making more than it recorded fails the run.  --update records the
+current counts instead.  For those runs fetch windows grow as if every
+one came back at once, since how they really grow depends on how fast
+the machine is.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests'))
+
+from imapsim import Simulator, synthetic_folders  # noqa: E402 pylint: disable=wrong-import-position
+
+from mhi import imapstats  # noqa: E402 pylint: disable=wrong-import-position
+from mhi import main as mhi  # noqa: E402 pylint: disable=wrong-import-position
+
+ROUNDTRIPS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'e2e_roundtrips.json')
+
+DEFAULTS = {'messages': 2000, 'folders': 20, 'rtt': 0, 'latency': 0, 'bandwidth': 0}
+
+STEPS = [
+    ('folders', 'folders'),
+    ('scan', 'scan +INBOX'),
+    ('scan (cached)', 'scan +INBOX'),
+    ('pick', 'pick from alice +INBOX'),
+    ('show', 'show +INBOX 10'),
+    ('next', 'next'),
+    ('refile', 'refile 20 +Archive'),
+    ('rmm', 'rmm +INBOX 30'),
+]
+
+
+class SteadySizer(mhi.WindowSizer):
+    """A WindowSizer that ignores how long windows take, so that the round
+    trips a command makes don't depend on how fast the machine is"""
+
+    def update(self, count, elapsed, nbytes):
+        super().update(count, 0, nbytes)
+
+
+def run(sim, args):
+    '''(seconds, round trips, server stats, output) for one mhi command'''
+    sim.reset_stats()
+    out = io.StringIO()
+    recorder = imapstats.start()
+    start = time.monotonic()
+    with contextlib.redirect_stdout(out):
+        try:
+            mhi._cmd_dispatch(['mhi'] + args.split())
+        except SystemExit:
+            pass
+        finally:
+            imapstats.stop(report=False)
+    return time.monotonic() - start, recorder.round_trips, sim.stats, out.getvalue()
+
+
+def benchmark(sim, home, rc=()):
+    '''{step: (seconds, round trips, server stats)} for STEPS, with the
+    lines rc added to the .mhirc'''
+    host, port = sim.start()
+    with open(os.path.join(home, '.mhirc'), 'w') as f:
+        f.write(f'connection = imap://user:secret@{host}:{port}\n')
+        f.writelines(line + '\n' for line in rc)
+    os.environ['HOME'] = home
+    results = {}
+    try:
+        for name, args in STEPS:
+            elapsed, trips, stats, _ = run(sim, args)
+            results[name] = (elapsed, trips, stats)
+    finally:
+        sim.stop()
+    return results
+
+
+def over_budget(results, budget):
+    '''the steps that made more round trips than budget allows'''
+    return [(name, trips, budget[name]) for name, (_, trips, _) in results.items() if name in budget and trips > budget[name]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='time mhi commands against a simulated IMAP server')
+    parser.add_argument('--messages', type=int, default=DEFAULTS['messages'], help='messages in INBOX')
+    parser.add_argument('--folders', type=int, default=DEFAULTS['folders'], help='extra folders, of 100 messages each')
+    parser.add_argument('--rtt', type=float, default=0, help='milliseconds added per round trip')
+    parser.add_argument('--latency', type=float, default=0, help='milliseconds added per command')
+    parser.add_argument('--bandwidth', type=float, default=0, help='KB/s the server sends at')
+    parser.add_argument('--rc', action='append', default=[], help='a line to add to the .mhirc')
+    parser.add_argument('--update', action='store_true', help=f'record round trips in {os.path.basename(ROUNDTRIPS_FILE)}')
+    opts = parser.parse_args()
+    checked = all(getattr(opts, k) == v for k, v in DEFAULTS.items()) and not opts.rc
+    if checked or opts.update:
+        mhi.WindowSizer = SteadySizer
+
+    folders = synthetic_folders(opts.messages, opts.folders)
+    folders['Archive'] = 100
+    sim = Simulator(folders, rtt=opts.rtt / 1000, latency=opts.latency / 1000, bandwidth=opts.bandwidth * 1024)
+    print(f"{opts.messages} messages in INBOX, {len(folders) - 1} more folders, rtt {opts.rtt:g}ms, latency {opts.latency:g}ms")
+    with tempfile.TemporaryDirectory() as home:
+        results = benchmark(sim, home, opts.rc)
+    print(f"{'command':<14} {'seconds':>8} {'trips':>6} {'server':>6} {'cmds':>5} {'received':>10}  commands sent")
+    for name, (elapsed, trips, stats) in results.items():
+        sent = ' '.join(f'{c}x{n}' if n > 1 else c for c, n in sorted(stats['commands'].items()))
+        print(f"{name:<14} {elapsed:8.3f} {trips:6} {stats['round_trips']:6} {sum(stats['commands'].values()):5} {stats['bytes_out']:10}  {sent}")
+
+    trips = {name: trips for name, (_, trips, _) in results.items()}
+    if opts.update:
+        with open(ROUNDTRIPS_FILE, 'w') as f:
+            json.dump(trips, f, indent=2)
+            f.write('\n')
+        print(f"Recorded round trips in {ROUNDTRIPS_FILE}")
+    elif not checked:
+        print("Not the default mailbox, link and settings, so round trips aren't checked.")
+    else:
+        with open(ROUNDTRIPS_FILE) as f:
+            budget = json.load(f)
+        over = over_budget(results, budget)
+        for name, made, allowed in over:
+            print(f"{name}: {made} round trips, up from {allowed}")
+        if over:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
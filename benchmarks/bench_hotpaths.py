@@ -0,0 +1,168 @@
+"""Microbenchmarks of the pure-Python hot paths, against a stored baseline
+
+    python benchmarks/bench_hotpaths.py [--update] [--tolerance T] [-k substring]
+
+Times the response parser (response.fetch_responses and parse),
+_consolidate, msgset_from, _checkMsgset and scan's row formatting on
+inputs recorded from tests/imapsim.py as the run starts: 500 envelopes
+(the non-ASCII ones arrive as literals), a SEARCH answer of 100,000
+message numbers, and the long msgset that turns into.  Everything runs
+offline.
+
+Timings are recorded in units of a fixed pure-Python loop timed on the
+same machine alongside each benchmark, so a baseline recorded on one
+machine means something on another.  They're kept per Python version in
+BASELINE_FILE (the units still shift by half or more between Python
+versions); more than its tolerance over the baseline, on RETRIES more
+tries too, fails the run.  --tolerance raises every benchmark's tolerance
+to at least T: CI runs with --tolerance 1, failing only what takes twice
+its baseline every time, since a shared runner keeps pace with the
+calibration loop less steadily than a quiet machine does.  A Python
+version with no baseline of its own is only reported on.  --update records the median of
+three runs, so that the baseline is a typical run rather than a lucky one.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests'))
+
+from imapsim import Simulator  # noqa: E402 pylint: disable=wrong-import-position
+
+from mhi import main as mhi  # noqa: E402 pylint: disable=wrong-import-position
+from mhi import scan  # noqa: E402 pylint: disable=wrong-import-position
+from mhi.response import decoded, fetch_responses, parse  # noqa: E402 pylint: disable=wrong-import-position
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'hotpaths_baseline.json')
+
+# how far over its baseline a benchmark may go: msgset_from is nothing but
+# str.replace on a long string, which keeps pace with the calibration loop
+# least well from one process to the next
+TOLERANCE = 0.5
+TOLERANCES = {'msgset_from': 1.0}
+RETRIES = 3
+
+# seconds each timing should take, roughly, and how many to take the best of
+TARGET = 0.1
+REPEAT = 5
+
+
+def record_inputs():
+    '''{name: data} recorded from a simulated server, as imaplib hands it over'''
+    import imaplib
+
+    with Simulator({'INBOX': 500, 'Big': 111112}) as sim:
+        S = imaplib.IMAP4(*sim.server.sockets[0].getsockname()[:2])
+        S.login('user', 'secret')
+        S.select('INBOX')
+        envelopes = S.uid('FETCH', '1:*', '(UID ENVELOPE FLAGS)')[1]
+        S.select('Big')
+        search = S.search(None, 'SEEN')[1]
+        S.logout()
+    return {'envelopes': envelopes, 'search': search}
+
+
+def benchmarks(inputs):
+    '''{name: function to time}'''
+    envelopes = inputs['envelopes']
+    rows = [(n, decoded(items['ENVELOPE'][:4]), items['FLAGS']) for n, items in fetch_responses(envelopes)]
+    numbers = [n for response in parse(inputs['search']) for n in response]
+    consolidated = mhi._consolidate(numbers)
+    msgset = mhi.msgset_from([consolidated])
+
+    return {
+        'fetch_responses 500 envelopes': lambda: list(fetch_responses(envelopes)),
+        'parse 100k SEARCH': lambda: list(parse(inputs['search'])),
+        '_consolidate 100k': lambda: mhi._consolidate(numbers),
+        f'msgset_from {len(consolidated) // 1024}K msgset': lambda: mhi.msgset_from([consolidated]),
+        f'_checkMsgset {len(msgset) // 1024}K msgset': lambda: mhi._checkMsgset(msgset),
+        '_scan_row 500 rows': lambda: [scan._scan_row(n, 7, envelope, flags) for n, envelope, flags in rows],
+    }
+
+
+def tolerance(name, least=0):
+    return max(least, TOLERANCES.get(name.split()[0], TOLERANCE))
+
+
+def calibration():
+    '''a fixed bit of pure Python to measure the others by'''
+    total = 0
+    for i in range(20000):
+        total += len(str(i)) * (i % 7)
+    return total
+
+
+def best(f):
+    '''the fastest of REPEAT timings of f, in seconds per call'''
+    number = max(1, int(TARGET / max(timeit.timeit(f, number=1), 1e-6)))
+    return min(timeit.repeat(f, number=number, repeat=REPEAT)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description="time mhi's pure-Python hot paths against a baseline")
+    parser.add_argument('--update', action='store_true', help=f'record this run in {os.path.basename(BASELINE_FILE)}')
+    parser.add_argument('--tolerance', type=float, default=0, help='allow every benchmark at least this much over its baseline')
+    parser.add_argument('-k', default='', help='only benchmarks with this in their name')
+    opts = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as home:
+        os.environ['HOME'] = home
+        mhi.init_config()
+        mhi.state['folder'] = 'INBOX'
+        suite = {name: f for name, f in benchmarks(record_inputs()).items() if opts.k in name}
+
+        # calibrated next to each benchmark, so the machine speeding up or
+        # slowing down part way through doesn't show as a change
+        def timed(f):
+            return best(f) / best(calibration)
+
+        results = {name: timed(f) for name, f in suite.items()}
+        unit = best(calibration)
+
+        version = f'{sys.version_info[0]}.{sys.version_info[1]}'
+        baselines = {}
+        if os.path.exists(BASELINE_FILE):
+            with open(BASELINE_FILE) as f:
+                baselines = json.load(f)
+        baseline = baselines.get(version, {})
+        # a noisy neighbour can make anything look slow once
+        for name in results:
+            if opts.update:
+                results[name] = statistics.median([results[name], timed(suite[name]), timed(suite[name])])
+            else:
+                for _ in range(RETRIES):
+                    if name not in baseline or results[name] <= baseline[name] * (1 + tolerance(name, opts.tolerance)):
+                        break
+                    results[name] = min(results[name], timed(suite[name]))
+
+    if baseline:
+        print(f"Python {version}; a unit is {unit * 1e3:.2f}ms here; allowed {max(TOLERANCE, opts.tolerance):.0%} over the baseline (see TOLERANCES)")
+    else:
+        print(f"Python {version}; a unit is {unit * 1e3:.2f}ms here; no baseline for this version, so nothing is checked")
+    print(f"{'benchmark':<36} {'ms':>9} {'units':>9} {'baseline':>9} {'change':>8}")
+    slower = []
+    for name, units in results.items():
+        was = baseline.get(name)
+        change = f'{units / was - 1:+8.0%}' if was else f"{'new':>8}"
+        print(f"{name:<36} {units * unit * 1e3:9.3f} {units:9.3f} {was or 0:9.3f} {change}")
+        if was and units > was * (1 + tolerance(name, opts.tolerance)):
+            slower.append(name)
+
+    if opts.update:
+        baselines[version] = {**baselines.get(version, {}), **{name: round(units, 4) for name, units in results.items()}}
+        with open(BASELINE_FILE, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"Recorded as the Python {version} baseline in {BASELINE_FILE}")
+    elif slower:
+        print(f"Slower than the baseline: {', '.join(slower)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
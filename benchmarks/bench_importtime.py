@@ -0,0 +1,97 @@
+"""How long mhi takes to get as far as running a command, import-wise
+
+    python benchmarks/bench_importtime.py [runs]
+
+Every mh-style command is a process of its own, so this is paid by every
+one of them.  For each of COMMANDS, a fresh process imports mhi.main,
+loads the config, looks the command up with _command() (which imports
+its module) and imports what any command that talks to the server goes
+on to need: imaplib (and with it ssl and socket), the response parser,
+imapext and the state store's sqlite3.  Nothing is actually connected to.
+
+Prints the best of several runs for each command, and the modules that
+took longest for the slowest one.  The budget that's enforced is what
+gets imported, not milliseconds, which on a shared CI runner say more
+about the runner than about mhi: looking up any of COMMANDS, before it
+connects, mustn't import any of HEAVY, and the run fails if it does.
+The .pyc files are written before anything is timed, even if
+PYTHONDONTWRITEBYTECODE is set, since an installed mhi has them.
+"""
+
+import os
+import re
+import subprocess
+import sys
+import tempfile
+
+COMMANDS = ('folders', 'scan', 'show', 'pick', 'refile', 'watch')
+
+# what a command needs once it connects, beyond its own module
+CONNECTING = ('imaplib', 'mhi.response', 'mhi.imapext', 'sqlite3')
+
+# what only talking to the server, or to a cache, calls for: about half of
+# a connecting command's start-up, so not to be paid any earlier
+HEAVY = ('imaplib', 'ssl', 'socket', 'sqlite3', 'email', 'multiprocessing')
+
+_line = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)')
+
+_code = '''
+import sys
+import time
+start = time.perf_counter()
+from importlib import import_module
+from mhi import main as mhi
+mhi.init_config()
+mhi._command({name!r})
+print(sorted(m for m in {heavy!r} if m in sys.modules))
+for m in {connecting!r}:
+    import_module(m)
+print(time.perf_counter() - start)
+'''
+
+
+def _run(name, home, *flags):
+    env = {k: v for k, v in os.environ.items() if k != 'PYTHONDONTWRITEBYTECODE'}
+    env['HOME'] = home
+    code = _code.format(name=name, heavy=HEAVY, connecting=CONNECTING)
+    return subprocess.run([sys.executable, *flags, '-c', code], capture_output=True, text=True, check=True, env=env)
+
+
+def startup(name, home):
+    '''(seconds from starting to import mhi to being ready to run command
+    name, the HEAVY modules that were imported before it connected)'''
+    heavy, seconds = _run(name, home).stdout.splitlines()
+    return float(seconds), heavy
+
+
+def importtime(name, home):
+    '''{module: (self us, cumulative us)} for one fresh start of command name'''
+    times = {}
+    for m in _line.finditer(_run(name, home, '-X', 'importtime').stderr):
+        times.setdefault(m.group(4), (int(m.group(1)), int(m.group(2))))
+    return times
+
+
+def main():
+    runs = int(sys.argv[1]) if sys.argv[1:] else 10
+    with tempfile.TemporaryDirectory() as home:
+        # leaves the .pyc files written
+        heavy = {name: startup(name, home)[1] for name in COMMANDS}
+        best = {name: min(startup(name, home)[0] for _ in range(runs)) * 1000 for name in COMMANDS}
+        slowest = max(best, key=best.get)
+        breakdown = importtime(slowest, home)
+    print(f"mhi ready to run a command (best of {runs}):")
+    for name, ms in best.items():
+        print(f"  {ms:6.1f}ms  {name}")
+    print(f"slowest modules for {slowest}:")
+    for module, (own, _) in sorted(breakdown.items(), key=lambda i: -i[1][0])[:10]:
+        print(f"  {own / 1000:6.2f}ms  {module}")
+    over = {name: modules for name, modules in heavy.items() if modules != '[]'}
+    for name, modules in over.items():
+        print(f"Looking up {name} imports {modules}, before it has connected.")
+    if over:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+"""A local, compressed cache of what show (and repl) fetch of messages
+
+A message's content never changes while its folder's UIDVALIDITY stays
+the same, so whatever is fetched of it (the structure, the header, text
+parts, attachments, the whole RFC822) can be kept and reused for good.
+Each fetched item is stored once, zlib-compressed, under the SHA-256 of
+its content in ~/.mhi/bodies.db; (folder, UIDVALIDITY, UID, item) rows
+point at it, so a message refiled or copied to another folder isn't
+stored twice.
+
+Messages can also be fetched ahead of being shown (see _prefetch() in
+show.py), with BODY.PEEK so the server doesn't mark them \\Seen.  Those are
+noted as peeked, so that the first time one is shown from here it still
+gets marked \\Seen.
+
+The cache is kept under a size budget (message_cache in .mhirc, in MB)
+by throwing out the least recently used content first.  `mhi cache
+stats` shows how full it is and `mhi cache prune` trims it.
+"""
+
+import hashlib
+import time
+import zlib
+
+from . import main as mhi
+from .statestore import connect
+
+# bump this whenever what's stored changes shape
+VERSION = 3
+
+# megabytes of compressed content to keep
+BUDGET_MB = 100
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    data BLOB,
+    compressed INTEGER,
+    raw INTEGER,
+    used REAL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS blobs_used ON blobs (used);
+CREATE TABLE IF NOT EXISTS items (
+    folder TEXT,
+    uidvalidity INTEGER,
+    uid INTEGER,
+    item TEXT,
+    hash TEXT,
+    PRIMARY KEY (folder, uidvalidity, uid, item)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS items_hash ON items (hash);
+CREATE TABLE IF NOT EXISTS peeked (
+    folder TEXT,
+    uidvalidity INTEGER,
+    uid INTEGER,
+    PRIMARY KEY (folder, uidvalidity, uid)
+) WITHOUT ROWID;
+'''
+
+
+class BodyCache:
+    """Fetched message items, by (folder, UIDVALIDITY, UID, item name)"""
+
+    def __init__(self, db, budget):
+        self.db = db
+        self.budget = budget
+
+    def get(self, folder, uidvalidity, uid, names):
+        '''{name: bytes} for the items of a message, or None unless all of names are cached'''
+        rows = self.db.execute(
+            f'SELECT item, hash, data FROM items JOIN blobs USING (hash) '
+            f'WHERE folder = ? AND uidvalidity = ? AND uid = ? AND item IN ({",".join("?" * len(names))})',
+            (folder, uidvalidity, uid, *names),
+        ).fetchall()
+        if len(rows) != len(set(names)):
+            return None
+        self.db.executemany('UPDATE blobs SET used = ? WHERE hash = ?', ((time.time(), h) for _, h, _ in rows))
+        self.db.commit()
+        return {item: zlib.decompress(data) for item, _, data in rows}
+
+    def put(self, folder, uidvalidity, uid, items, peeked=False):
+        '''store {name: bytes} fetched for a message, then trim to the budget;
+        peeked means the message was fetched without being marked \\Seen'''
+        now = time.time()
+        if peeked:
+            self.db.execute('INSERT OR IGNORE INTO peeked VALUES (?, ?, ?)', (folder, uidvalidity, uid))
+        else:
+            self.unpeek(folder, uidvalidity, [uid])
+        for name, content in items.items():
+            content = bytes(content)
+            digest = hashlib.sha256(content).hexdigest()
+            if not self.db.execute('SELECT 1 FROM blobs WHERE hash = ?', (digest,)).fetchone():
+                data = zlib.compress(content)
+                self.db.execute('INSERT INTO blobs VALUES (?, ?, ?, ?, ?)', (digest, data, len(data), len(content), now))
+            self.db.execute('INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?)', (folder, uidvalidity, uid, name, digest))
+        self.db.commit()
+        self.trim(self.budget)
+
+    def peeked(self, folder, uidvalidity, uids):
+        '''which of uids were put() as peeked and haven't been unpeek()ed since'''
+        rows = self.db.execute('SELECT uid FROM peeked WHERE folder = ? AND uidvalidity = ?', (folder, uidvalidity))
+        return sorted({uid for (uid,) in rows} & set(uids))
+
+    def unpeek(self, folder, uidvalidity, uids):
+        self.db.executemany('DELETE FROM peeked WHERE folder = ? AND uidvalidity = ? AND uid = ?', ((folder, uidvalidity, u) for u in uids))
+        self.db.commit()
+
+    def size(self):
+        return self.db.execute('SELECT coalesce(sum(compressed), 0) FROM blobs').fetchone()[0]
+
+    def trim(self, budget):
+        '''throw out the least recently used content until at most budget
+        bytes are left; returns how many bytes were freed'''
+        excess = self.size() - budget
+        freed = 0
+        if excess <= 0:
+            return 0
+        doomed = []
+        for digest, size in self.db.execute('SELECT hash, compressed FROM blobs ORDER BY used'):
+            if freed >= excess:
+                break
+            doomed.append((digest,))
+            freed += size
+        self.db.executemany('DELETE FROM items WHERE hash = ?', doomed)
+        self.db.executemany('DELETE FROM blobs WHERE hash = ?', doomed)
+        self.db.commit()
+        mhi._debug(lambda: f"message cache: threw out {len(doomed)} items, {freed} bytes")
+        return freed
+
+    def stats(self):
+        '''{name: value} describing what's in the cache'''
+        blobs, compressed, raw, oldest = self.db.execute(
+            'SELECT count(*), coalesce(sum(compressed), 0), coalesce(sum(raw), 0), min(used) FROM blobs'
+        ).fetchone()
+        messages, folders = self.db.execute('SELECT count(DISTINCT folder || uidvalidity || ":" || uid), count(DISTINCT folder) FROM items').fetchone()
+        return {
+            'messages': messages,
+            'folders': folders,
+            'items': blobs,
+            'compressed': compressed,
+            'raw': raw,
+            'budget': self.budget,
+            'oldest': oldest,
+        }
+
+
+def budget():
+    '''the cache's size budget in bytes, from .mhirc; 0 means no cache'''
+    return int(float(mhi.config.get('message_cache', BUDGET_MB)) * 1024 * 1024)
+
+
+def open_bodies():
+    '''the BodyCache, or None if message_cache is 0'''
+    if budget() <= 0:
+        return None
+    db = connect('bodies.db')
+    if db.execute('PRAGMA user_version').fetchone()[0] != VERSION:
+        db.executescript('DROP TABLE IF EXISTS blobs; DROP TABLE IF EXISTS items; DROP TABLE IF EXISTS peeked;')
+        db.execute(f'PRAGMA user_version = {VERSION}')
+    db.executescript(SCHEMA)
+    return BodyCache(db, budget())
+
+
+def cache(args):
+    '''Usage: cache stats|prune [<megabytes>]
+
+    Show what's in the local message cache, or throw out the least
+    recently used things in it until it's within its budget (the
+    message_cache setting) or the size given.
+    '''
+    from .mimeparts import human_size
+
+    if not args or args[0] not in ('stats', 'prune') or len(args) > 2 or (args[0] == 'stats' and len(args) > 1):
+        raise mhi.UsageError()
+    bodies = open_bodies()
+    if bodies is None:
+        print("The message cache is turned off (message_cache is 0).")
+        return
+    if args[0] == 'prune':
+        try:
+            keep = int(float(args[1]) * 1024 * 1024) if len(args) > 1 else bodies.budget
+        except ValueError:
+            raise mhi.UsageError()
+        freed = bodies.trim(keep)
+        bodies.db.execute('VACUUM')
+        print(f"Freed {human_size(freed)}; {human_size(bodies.size())} left.")
+        return
+    stats = bodies.stats()
+    print(f"{stats['messages']} messages in {stats['folders']} folders ({stats['items']} distinct items)")
+    print(f"{human_size(stats['raw'])} compressed to {human_size(stats['compressed'])}, budget {human_size(stats['budget'])}")
+    if stats['oldest']:
+        print(f"least recently used item last used {time.strftime('%Y-%m-%d %H:%M', time.localtime(stats['oldest']))}")
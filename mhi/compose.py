@@ -0,0 +1,187 @@
+"""comp and repl: writing mail in an editor and sending it by SMTP
+
+These live apart from the rest of the commands so that only they pay
+for importing smtplib, tempfile and friends.
+"""
+
+import os
+import email
+import shutil
+import smtplib
+import tempfile
+from pathlib import Path
+
+from . import main as mhi
+
+
+def tempFileName(*args, **kwargs):
+    f = tempfile.NamedTemporaryFile(*args, **kwargs)
+    name = f.name
+    f.close()
+    return name
+
+
+def _crlf_terminate(msgfile):
+    '''convenience function to turn a \n terminated file into a \r\n terminated file'''
+    tfile = tempFileName(prefix="mhi")
+    os.rename(msgfile, tfile)
+    with open(tfile, 'r') as infile:
+        with open(msgfile, 'w') as outfile:
+            for line in infile:
+                if not line.endswith('\r\n'):
+                    line = line[:-1]  # strip existing \n (or \r?)
+                    line += '\r\n'  # add new lineending
+                outfile.write(line)
+
+
+def _edit(msgfile):
+    '''internal common code for comp/repl/dist/medit'''
+    env = os.environ
+    editor = env.get('VISUAL', env.get('EDITOR', 'editor'))
+    try:
+        fin = os.system(f"{editor} {msgfile}")
+        if Path(msgfile).exists():
+            _crlf_terminate(msgfile)
+    except Exception as e:
+        mhi._debug(lambda: f"editor exception: {e!r}")
+        return False
+    mhi._debug(lambda: f"editor result code: {fin}")
+    return fin == 0
+
+
+def _SMTPsend(msgfile):
+    ret = {'Unknown': 'SMTP problem'}
+    msg = email.message_from_file(open(msgfile, "r"))
+    fromaddr = msg.get('From', '')
+    toaddrs = msg.get_all('To', [])
+    mhi._debug(lambda: f"composing message from {fromaddr!r} to {toaddrs!r}")
+    server = smtplib.SMTP('localhost')
+    # server.set_debuglevel(1)
+    try:
+        ret = server.sendmail(fromaddr, toaddrs, msg.as_string())
+    except smtplib.SMTPRecipientsRefused:
+        print("No valid recipients. Try again.")
+    except smtplib.SMTPHeloError:
+        print("Error talking to SMTP server (No HELO).")
+    except smtplib.SMTPSenderRefused:
+        print("Error talking to SMTP server (Unacceptable FROM address).")
+    except smtplib.SMTPDataError:
+        print("Error talking to SMTP server (Data Error).")
+    server.quit()
+    for k in ret:
+        print(f"SMTP Error: {k}: {ret[k]}")
+    return len(ret.keys())
+
+
+def _get_curMessage():
+    from .show import _get_messages
+
+    folder = mhi.state['folder']
+    try:
+        msgset = mhi.state[folder + '.cur']
+    except KeyError:
+        print("Error: No current message selected.")
+        raise mhi.UsageError()
+    mhi._checkMsgset(msgset)
+    return _get_messages(folder, msgset)[0][1]
+
+
+def _template_update(msgfile):
+    def _quoted_current(_, msg):
+        result = ""
+        for part in msg.walk():
+            mhi._debug(lambda: f"PART {part.get_content_type()}:")
+            for line in part.get_payload(decode=True).split("\n"):
+                result += "> " + line + "\n"
+        return result
+
+    def __header(_, msg, header):
+        if header in msg:
+            return msg[header]
+        return f"[[Missing {header} header]]"
+
+    def _header_from(data, msg):
+        return __header(data, msg, 'from')
+
+    def _header_date(data, msg):
+        return __header(data, msg, 'date')
+
+    def _header_subject(data, msg):
+        return __header(data, msg, 'subject')
+
+    def _header_from_name(data, msg):
+        full = _header_from(data, msg)
+        left = full.find("<")
+        right = full.find(">")
+        if left > -1 and right > -1:
+            return full[:left] + full[right + 1 :]
+        return full
+
+    macros = {
+        '###QUOTED###': _quoted_current,
+        '###:FROM###': _header_from,
+        '###:DATE###': _header_date,
+        '###:SUBJECT###': _header_subject,
+        '###:FROM.NAME###': _header_from_name,
+    }
+
+    template = open(msgfile, 'r')
+    templatetext = template.readlines()
+    outfile = open(msgfile, "w")
+    curdata = _get_curMessage()
+    curmsg = email.message_from_bytes(curdata)
+    for line in templatetext:
+        changed = True
+        while changed:
+            changed = False
+            for macro, impl in macros.items():
+                if macro in line:
+                    line = line.replace(macro, impl(curdata, curmsg))
+                    changed = True
+        outfile.write(line)
+    outfile.close()
+
+
+def comp(args):
+    '''Usage: comp
+
+    Compose a new message
+    '''
+    tmpfile = tempFileName(prefix="mhi-comp-")
+    if mhi.config.get('comp_template', None):
+        shutil.copyfile(mhi.config['comp_template'], tmpfile)
+    if _edit(tmpfile):
+        # edit succeeded, wasn't aborted or anything
+        errcount = _SMTPsend(tmpfile)
+        if not errcount:
+            os.unlink(tmpfile)
+    else:
+        # 'abort - throw away session, keep - save it for later'
+        print("Session aborted.")
+        try:
+            os.unlink(tmpfile)
+        except:
+            pass
+
+
+def repl(args):
+    '''Usage: repl
+
+    Reply to the current message, quoting it
+    '''
+    tmpfile = tempFileName(prefix="mhi-repl-")
+    if mhi.config.get('repl_template', None):
+        shutil.copyfile(mhi.config['repl_template'], tmpfile)
+        _template_update(tmpfile)
+    # TODO: put quoted contents of current message into tmpfile
+    # TODO: put the author of the current message in the 'To:' field
+    # TODO: swipe MH's -cc, etc syntax for specifying who to copy
+    if _edit(tmpfile):
+        # edit succeeded, wasn't aborted or anything
+        errcount = _SMTPsend(tmpfile)
+        if not errcount:
+            os.unlink(tmpfile)
+    else:
+        # 'abort - throw away session, keep - save it for later'
+        print("Session aborted.")
+        os.unlink(tmpfile)
@@ -0,0 +1,182 @@
+"""A small agent that remembers what the connection_passwd command printed
+
+A backticked connection_passwd (`pass show mail`, a gpg decrypt, ...) can
+take most of a second to run, and used to run for every mhi command.  The
+first command that runs it now starts this agent and hands it the result;
+later commands ask the agent first.  Passwords are kept only in the
+agent's memory, for password_cache_ttl seconds (from .mhirc), keyed by a
+hash of the command that produced them.  The agent exits as soon as it
+has nothing left to remember, or when told to by `mhi forget-password`.
+
+Its socket lives in ~/.mhi/ (mode 0700) and is created mode 0600, and
+clients must also know the shared key in ~/.mhi/mhid.key.  An agent holds
+a lock on ~/.mhi/cred.lock for as long as it runs, so when two commands
+start one at once, the second finds the first still there and leaves, and
+forget-password always reaches the only agent there is.
+"""
+
+import os
+import sys
+import time
+import fcntl
+import hashlib
+import threading
+import subprocess
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+from . import main as mhi
+from .daemon import _accept, _authkey
+
+# how long a fresh agent waits for its first password before giving up
+STARTUP_GRACE = 10
+
+
+def _socket_path():
+    return str(mhi.mhi_dir() / 'cred.sock')
+
+
+def _key(cmd):
+    return hashlib.sha256(cmd.encode()).hexdigest()
+
+
+def _request(*msg):
+    '''send msg to the agent and return its reply, or None if it isn't running'''
+    address = _socket_path()
+    if not os.path.exists(address):
+        return None
+    try:
+        conn = Client(address, family='AF_UNIX', authkey=_authkey())
+    except (OSError, EOFError) as e:
+        mhi._debug(lambda: f"credential agent not reachable: {e!r}")
+        return None
+    try:
+        conn.send(msg)
+        return conn.recv()
+    except (OSError, EOFError):
+        return None
+    finally:
+        conn.close()
+
+
+def lookup(cmd):
+    '''the password cmd printed last time, if the agent still has it'''
+    return _request('get', _key(cmd))
+
+
+def remember(cmd, password, ttl):
+    '''have the agent (started if need be) keep password for ttl seconds'''
+    if _request('put', _key(cmd), password, ttl):
+        return True
+    _authkey(create=True)
+    subprocess.Popen(
+        [sys.executable, '-m', 'mhi.credagent'],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    for _ in range(50):
+        time.sleep(0.02)
+        if _request('put', _key(cmd), password, ttl):
+            return True
+    mhi._debug(lambda: "credential agent didn't start")
+    return False
+
+
+def forget():
+    '''make the agent drop every password and exit; False if none was running'''
+    return _request('forget') is not None
+
+
+def forget_password(args):
+    '''Usage: forget-password
+
+    Make the credential agent forget the connection_passwd command's output,
+    so that the next command runs it again.
+    '''
+    if args:
+        raise mhi.UsageError()
+    if forget():
+        print("Password forgotten.")
+    else:
+        print("No password was being remembered.")
+
+
+def serve(grace=STARTUP_GRACE):
+    '''Run the agent in this process until it has nothing to remember,
+    unless another agent is already running'''
+    with open(mhi.mhi_dir() / 'cred.lock', 'w') as running:
+        try:
+            fcntl.flock(running, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            mhi._debug("credential agent already running")
+            return
+        _serve(grace)
+
+
+def _serve(grace):
+    address = _socket_path()
+    if os.path.exists(address):
+        os.unlink(address)
+    passwords = {}
+    lock = threading.Lock()
+    done = threading.Event()
+    authkey = _authkey(create=True)
+    umask = os.umask(0o177)
+    try:
+        listener = Listener(address, family='AF_UNIX')
+    finally:
+        os.umask(umask)
+
+    def handle(conn):
+        try:
+            op, *args = conn.recv()
+            with lock:
+                if op == 'get':
+                    password, expires = passwords.get(args[0], (None, 0))
+                    reply = password if expires > time.time() else None
+                elif op == 'put':
+                    key, password, ttl = args
+                    passwords[key] = (password, time.time() + ttl)
+                    reply = True
+                elif op == 'forget':
+                    passwords.clear()
+                    done.set()
+                    reply = True
+                else:
+                    reply = None
+            conn.send(reply)
+        except (OSError, EOFError, ValueError):
+            pass
+        finally:
+            conn.close()
+
+    def accept_loop():
+        while not done.is_set():
+            try:
+                conn = _accept(listener, authkey)
+            except (OSError, EOFError, AuthenticationError):
+                continue
+            handle(conn)
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+    deadline = time.time() + grace
+    try:
+        while not done.wait(1):
+            now = time.time()
+            with lock:
+                for key in [k for k, (_, expires) in passwords.items() if expires <= now]:
+                    del passwords[key]
+                if passwords:
+                    deadline = now
+                elif now > deadline:
+                    break
+    finally:
+        listener.close()
+        if os.path.exists(address):
+            os.unlink(address)
+
+
+if __name__ == '__main__':
+    serve()
@@ -0,0 +1,400 @@
+"""mhid - keep authenticated IMAP sessions around between mhi commands
+
+Every mhi command is its own process, so every command used to pay for
+the TCP connect, TLS handshake, LOGIN and SELECT before doing any real
+work.  mhid is an opt-in background process that holds already logged-in
+sessions, one pool per account, and lends them to mhi commands over a
+Unix socket in ~/.mhi/.  When mhid isn't running, mhi opens its own
+session exactly as it always has.
+
+A borrowed session still gets SELECTed by each command: what SELECT
+answers (EXISTS, UIDVALIDITY) is how a command notices what changed
+since the last one, and each command CLOSEs its folder when it's done.
+
+Idle sessions are kept alive with NOOP well inside the 30 minute
+autologout window that RFC 3501 allows servers to enforce.
+
+    mhid [start|stop|status] [-f]
+
+-f keeps mhid in the foreground instead of detaching.
+"""
+
+import os
+import sys
+import time
+import types
+import pickle
+import socket
+import struct
+import imaplib
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener, answer_challenge, deliver_challenge
+
+from . import imapext
+from . import main as mhi
+
+# seconds between NOOPs on an idle session; servers may drop us after 30 minutes
+KEEPALIVE = 5 * 60
+
+# seconds a client that has connected gets to prove it knows the key
+AUTH_TIMEOUT = 5
+
+
+def _socket_path():
+    return str(mhi._mhid_socket())
+
+
+def _authkey(create=False):
+    '''The shared secret mhid and its clients use to authenticate each other'''
+    keyfile = mhi.mhi_dir() / 'mhid.key'
+    if create and not keyfile.exists():
+        fd = os.open(keyfile, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(os.urandom(32))
+    return keyfile.read_bytes()
+
+
+def _receive_timeout(conn, seconds):
+    '''make reads on conn fail with OSError after seconds of silence (0 for never)'''
+    with socket.fromfd(conn.fileno(), socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVTIMEO, struct.pack('ll', int(seconds), int(seconds % 1 * 1000000)))
+
+
+def _accept(listener, authkey):
+    '''the next connection to listener (made without an authkey) from a
+    client that knows authkey, which has AUTH_TIMEOUT seconds to show it
+    does; reads on the connection keep timing out after that'''
+    conn = listener.accept()
+    try:
+        _receive_timeout(conn, AUTH_TIMEOUT)
+        deliver_challenge(conn, authkey)
+        answer_challenge(conn, authkey)
+    except BaseException:
+        conn.close()
+        raise
+    return conn
+
+
+def _account(settings):
+    return tuple(sorted(settings.items()))
+
+
+def _connect():
+    '''connect to a running mhid, or return None if there isn't one'''
+    address = _socket_path()
+    if not os.path.exists(address):
+        return None
+    try:
+        return Client(address, family='AF_UNIX', authkey=_authkey())
+    except (OSError, EOFError, AuthenticationError) as e:
+        # including an mhid.key that's been replaced since mhid started
+        mhi._debug(lambda: f"mhid not reachable: {e!r}")
+        return None
+
+
+_errors = {
+    'abort': imaplib.IMAP4.abort,
+    'readonly': imaplib.IMAP4.readonly,
+}
+
+
+class DaemonSession:
+    """Stands in for an imaplib.IMAP4 whose connection is held by mhid
+
+    Attribute lookups and method calls are forwarded to the real session
+    in the daemon.  logout() just hands the session back.
+    """
+
+    _methods = set()
+
+    def __init__(self, conn):
+        self._conn = conn
+        self.debug = 0
+
+    def _request(self, *msg):
+        try:
+            self._conn.send(msg)
+            status, value = self._conn.recv()
+        except (OSError, EOFError) as e:
+            raise imaplib.IMAP4.abort(f'lost connection to mhid: {e}')
+        if status == 'raise':
+            errname, errmsg = value
+            raise _errors.get(errname, imaplib.IMAP4.error)(errmsg)
+        return status, value
+
+    def _call(self, name, *args, **kwargs):
+        return self._request('call', name, args, kwargs)[1]
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        if name not in self._methods:
+            status, value = self._request('getattr', name)
+            if status == 'value':
+                return value
+            self._methods.add(name)
+        return lambda *args, **kwargs: self._call(name, *args, **kwargs)
+
+    def ext(self, name, *args):
+        return self._request('ext', name, args)[1]
+
+    def logout(self):
+        self._conn.close()
+        return 'BYE', [b'Session returned to mhid']
+
+
+def attach(settings):
+    '''Borrow a session for the account described by settings from mhid.
+
+    Returns None if mhid isn't running (or won't give us a session).
+    '''
+    conn = _connect()
+    if conn is None:
+        return None
+    session = DaemonSession(conn)
+    try:
+        session._request('attach', settings)
+    except imaplib.IMAP4.error as e:
+        mhi._debug(lambda: f"mhid couldn't provide a session: {e}")
+        conn.close()
+        return None
+    return session
+
+
+class _Pooled:
+    '''A logged-in session plus what the pool needs to know about it'''
+
+    def __init__(self, session):
+        self.session = session
+        self.last_used = time.time()
+
+
+class SessionPool:
+    '''Idle logged-in sessions, by account'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.idle = {}
+
+    def checkout(self, settings):
+        account = _account(settings)
+        with self.lock:
+            idle = self.idle.get(account, [])
+            if idle:
+                return idle.pop()
+        return _Pooled(mhi.open_session(settings))
+
+    def checkin(self, settings, pooled):
+        pooled.last_used = time.time()
+        with self.lock:
+            self.idle.setdefault(_account(settings), []).append(pooled)
+
+    def keepalive(self, interval):
+        '''NOOP every session that has been idle for longer than interval'''
+        now = time.time()
+        with self.lock:
+            stale = []
+            for account, idle in self.idle.items():
+                stale.extend((account, p) for p in idle if now - p.last_used > interval)
+                idle[:] = [p for p in idle if now - p.last_used <= interval]
+        for account, pooled in stale:
+            try:
+                pooled.session.noop()
+            except (imaplib.IMAP4.error, OSError):
+                _logout(pooled.session)
+                continue
+            pooled.last_used = time.time()
+            with self.lock:
+                self.idle.setdefault(account, []).append(pooled)
+
+    def close_all(self):
+        with self.lock:
+            for idle in self.idle.values():
+                for pooled in idle:
+                    _logout(pooled.session)
+            self.idle = {}
+
+
+def _logout(session):
+    try:
+        session.logout()
+    except (imaplib.IMAP4.error, OSError):
+        pass
+
+
+def _discard(pooled):
+    '''close a session that may have been left part way through a
+    response, without waiting on it to log out'''
+    if pooled is not None:
+        try:
+            pooled.session.shutdown()
+        except OSError:
+            pass
+
+
+def _errname(e):
+    if isinstance(e, imaplib.IMAP4.readonly):
+        return 'readonly'
+    if isinstance(e, imaplib.IMAP4.abort):
+        return 'abort'
+    return 'error'
+
+
+def _reply(conn, result):
+    try:
+        conn.send(('ok', result))
+    except (pickle.PicklingError, TypeError, AttributeError) as e:
+        conn.send(('raise', ('error', f'mhid could not return {type(result).__name__}: {e}')))
+
+
+def _serve(conn, pool, shutdown):
+    '''Lend one session to one client until it hangs up'''
+    settings = pooled = None
+    broken = False
+    try:
+        while True:
+            try:
+                msg = conn.recv()
+            except (OSError, EOFError):
+                break
+            op, args = msg[0], msg[1:]
+            try:
+                if op == 'shutdown':
+                    shutdown.set()
+                    conn.send(('ok', None))
+                    break
+                if op == 'ping':
+                    conn.send(('ok', os.getpid()))
+                    continue
+                if op == 'attach':
+                    (settings,) = args
+                    pooled = pool.checkout(settings)
+                    conn.send(('ok', None))
+                    continue
+                if pooled is None:
+                    raise imaplib.IMAP4.error('no session attached')
+                if op == 'getattr':
+                    value = getattr(pooled.session, args[0])
+                    if callable(value):
+                        conn.send(('method', None))
+                    else:
+                        conn.send(('value', value))
+                elif op == 'call':
+                    name, cargs, ckwargs = args
+                    result = getattr(pooled.session, name)(*cargs, **ckwargs)
+                    _reply(conn, result)
+                elif op == 'ext':
+                    name, cargs = args
+                    result = getattr(imapext, name)(pooled.session, *cargs)
+                    if isinstance(result, types.GeneratorType):
+                        # can't stream back over the socket, so send it all at once
+                        result = list(result)
+                    _reply(conn, result)
+                else:
+                    raise imaplib.IMAP4.error(f'unknown mhid request {op!r}')
+            except (imaplib.IMAP4.error, OSError, AttributeError, TypeError) as e:
+                broken = broken or isinstance(e, (imaplib.IMAP4.abort, OSError))
+                conn.send(('raise', (_errname(e), str(e))))
+            except SystemExit:
+                if op == 'attach':
+                    conn.send(('raise', ('error', 'could not log in')))
+                    continue
+                # mhi gave up part way through, and would have exited
+                _discard(pooled)
+                pooled = None
+                conn.send(('raise', ('abort', f'mhid gave up during {op} {args[0]}; the session is closed')))
+            except Exception as e:  # pylint: disable=broad-except
+                _discard(pooled)
+                pooled = None
+                conn.send(('raise', ('abort', f'mhid: {type(e).__name__}: {e}; the session is closed')))
+    finally:
+        conn.close()
+        if pooled is not None:
+            if broken:
+                _logout(pooled.session)
+            else:
+                pool.checkin(settings, pooled)
+
+
+def serve(keepalive=KEEPALIVE):
+    '''Run mhid in the current process until asked to stop'''
+    address = _socket_path()
+    if os.path.exists(address):
+        os.unlink(address)
+    pool = SessionPool()
+    shutdown = threading.Event()
+    authkey = _authkey(create=True)
+    listener = Listener(address, family='AF_UNIX')
+    os.chmod(address, 0o600)
+
+    def accept_loop():
+        while not shutdown.is_set():
+            try:
+                conn = _accept(listener, authkey)
+                # a borrowed session may sit idle while its command works
+                _receive_timeout(conn, 0)
+            except (OSError, EOFError, AuthenticationError):
+                continue
+            threading.Thread(target=_serve, args=(conn, pool, shutdown), daemon=True).start()
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+    try:
+        while not shutdown.wait(min(keepalive, 60)):
+            pool.keepalive(keepalive)
+    finally:
+        listener.close()
+        if os.path.exists(address):
+            os.unlink(address)
+        pool.close_all()
+
+
+def _request(op):
+    conn = _connect()
+    if conn is None:
+        return None
+    try:
+        conn.send((op,))
+        return conn.recv()[1]
+    finally:
+        conn.close()
+
+
+def _daemonize():
+    if os.fork():
+        os._exit(0)
+    os.setsid()
+    if os.fork():
+        os._exit(0)
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in (0, 1, 2):
+        os.dup2(devnull, fd)
+
+
+def main():
+    args = sys.argv[1:]
+    foreground = '-f' in args
+    args = [a for a in args if a != '-f']
+    cmd = args[0] if args else 'start'
+    if cmd == 'status':
+        pid = _request('ping')
+        print(f"mhid is running (pid {pid})." if pid else "mhid is not running.")
+    elif cmd == 'stop':
+        if _request('shutdown') is None:
+            print("mhid is not running.")
+    elif cmd == 'start':
+        if _request('ping'):
+            print("mhid is already running.")
+            sys.exit(1)
+        mhi.init_config()
+        keepalive = int(mhi.config.get('daemon_keepalive', KEEPALIVE))
+        if not foreground:
+            _daemonize()
+        serve(keepalive)
+    else:
+        print(__doc__)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
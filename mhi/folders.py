@@ -0,0 +1,72 @@
+"""folder, folders and rmf: moving between, listing and removing folders"""
+
+from . import main as mhi
+
+
+@mhi.takesFolderArg
+def folder(folder, arglist):
+    '''Usage: folder [+<foldername>]
+
+    Change folders / show current folder
+    '''
+    if arglist:
+        raise mhi.UsageError()
+    if folder is None:
+        folder = mhi.state.get('folder')
+    if folder is None:
+        print("No current folder selected. Use 'folders' to get a list.")
+    with mhi.Connection() as S:
+        msgcount = mhi._selectOrCreate(S, folder)
+    mhi.state['folder'] = folder
+    # inbox+ has 64 messages  (1-64); cur=63; (others).
+    cur = mhi.state.get(folder + '.cur', 'unset')
+    print(f"Folder {mhi.folder_name(folder)} has {msgcount} messages, cur is {cur}.")
+
+
+@mhi.paged
+def folders(args):
+    '''Usage: folders
+
+    Show all folders
+    '''
+    HEADER = "FOLDER"
+    with mhi.Connection() as S:
+        stats = {f: status or (0, 0, 0) for f, status in S.folderstatuses().items()}
+    stats[HEADER] = ["# MESSAGES", "RECENT", "UNSEEN"]
+    folderlist = sorted(key for key in stats if key != HEADER)
+    totalmsgs, totalnew = 0, 0
+    for folder in [HEADER] + folderlist:
+        mhi._debug(lambda: f" folder: {folder!r}")
+        iscur = '*' if folder == mhi.state['folder'] else ' '
+        messages, recent, unseen = stats[folder]
+        cur = mhi.state.get(f'{folder}.cur', ['-', 'CUR'][folder == HEADER])
+        foldr = mhi.folder_name(folder)
+        print(f"{iscur}{foldr:>20} {cur:7} {messages:7} {recent:7} {unseen:7}")
+        if folder != HEADER:
+            totalmsgs += int(messages)
+            totalnew += int(unseen)
+    print(f"TOTAL: {totalmsgs} messages ({totalnew} new) in {len(folderlist)} folders")
+
+
+@mhi.takesFolderArg
+def rmf(folder, arglist):
+    '''Usage:  rmf +<foldername>
+    remove a folder
+    '''
+    mhi._debug(lambda: f"Folder is {folder!r}")
+    if folder is None:
+        raise mhi.UsageError()
+    with mhi.Connection() as S:
+        result, data = S.raw_select(folder)
+        mhi._debug(lambda: f" Result: {result}, {data}")
+        if result != 'OK':
+            print(f"Folder '{folder}' doesn't exist.")
+            return
+        if mhi.state['folder'] == folder:
+            mhi.state['folder'] = 'INBOX'
+        S.select(mhi.state['folder'])
+        result, data = S.raw_delete(folder)
+    if result == 'OK':
+        print(f"Folder '{folder}' deleted.")
+    else:
+        print(f"Failed to delete folder '{folder}': {data}")
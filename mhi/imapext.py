@@ -0,0 +1,194 @@
+"""IMAP commands and command patterns that imaplib doesn't provide
+
+These work on a bare imaplib session (using its internals where they
+have to), so that mhid can run them next to the sessions it holds.
+Connection._ext() is the way to call them.
+"""
+
+import imaplib
+import io
+import select
+import time
+import zlib
+
+# how many commands to have in flight before waiting for the replies
+PIPELINE_DEPTH = 64
+
+# imaplib refuses commands it doesn't know about
+imaplib.Commands.setdefault('IDLE', ('AUTH', 'SELECTED'))
+imaplib.Commands.setdefault('NOTIFY', ('AUTH', 'SELECTED'))
+imaplib.Commands.setdefault('COMPRESS', ('AUTH', 'SELECTED'))
+
+
+def quote(s):
+    '''an IMAP quoted string'''
+    return '"' + s.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def pipeline(session, name, arglists):
+    '''Send the same command once per argument list without waiting for each
+    reply, returning [(result, untagged responses)] in the same order.
+    '''
+    results = []
+    for i in range(0, len(arglists), PIPELINE_DEPTH):
+        tags = [session._command(name, *args) for args in arglists[i : i + PIPELINE_DEPTH]]
+        for tag in tags:
+            typ, dat = session._command_complete(name, tag)
+            results.append((typ, session._untagged_response(typ, dat, name)[1]))
+    return results
+
+
+def list_status(session, items):
+    '''LIST-STATUS (RFC 5819): every folder and its STATUS in one command.
+
+    Returns the untagged LIST and STATUS responses.
+    '''
+    typ, dat = session._simple_command('LIST', '""', '*', 'RETURN', f'(STATUS {items})')
+    if typ != 'OK':
+        return typ, [], []
+    lists = session._untagged_response(typ, dat, 'LIST')[1]
+    statuses = session._untagged_response(typ, dat, 'STATUS')[1]
+    return typ, lists, statuses
+
+
+def status_many(session, folders, items):
+    '''STATUS for each of folders, pipelined.  Returns the untagged STATUS responses.'''
+    statuses = []
+    for typ, dat in pipeline(session, 'STATUS', [(quote(f), items) for f in folders]):
+        if typ == 'OK':
+            statuses.extend(d for d in dat if d is not None)
+    return statuses
+
+
+def stream(session, name, *args):
+    '''Send a command and yield its untagged responses of the same name as
+    they arrive, each as the list of pieces imaplib read for it.
+    '''
+    # UID FETCH replies are plain FETCH responses, and so on
+    untagged = args[0].upper() if name == 'UID' else name
+    tag = session._command(name, *args)
+    while session.tagged_commands[tag] is None:
+        session._get_response()
+        for response in _responses(session, untagged):
+            yield response
+    typ, dat = session._command_complete(name, tag)
+    if typ != 'OK':
+        raise session.error(f'{name} command error: {typ} {dat}')
+    for response in _responses(session, untagged):
+        yield response
+
+
+def _responses(session, name):
+    '''split what has piled up in untagged_responses[name] into responses'''
+    pieces = session.untagged_responses.pop(name, [])
+    response = []
+    for piece in pieces:
+        response.append(piece)
+        if not isinstance(piece, tuple):
+            yield response
+            response = []
+
+
+def _wait(session, timeout):
+    '''True if a response can be read from session within timeout seconds'''
+    sock = getattr(session, 'sock', None)
+    if sock is None:
+        return True
+    # imaplib reads through a buffered file, which may already hold a line
+    saved = sock.gettimeout()
+    sock.setblocking(False)
+    try:
+        buffered = session.file.peek(1)
+    except OSError:
+        buffered = b''
+    finally:
+        sock.settimeout(saved)
+    if buffered or getattr(sock, 'pending', lambda: 0)():
+        return True
+    return bool(select.select([sock], [], [], timeout)[0])
+
+
+def _untagged(session):
+    '''(name, data) for each kind of untagged response that has piled up'''
+    for name in list(session.untagged_responses):
+        yield name, session.untagged_responses.pop(name)
+
+
+def idle(session, timeout):
+    '''IDLE (RFC 2177) for up to timeout seconds, yielding (name, data) for
+    the untagged responses the server sends meanwhile, as they arrive'''
+    tag = session._command('IDLE')
+    while session._get_response() is not None:
+        if session.tagged_commands[tag] is not None:
+            typ, dat = session._command_complete('IDLE', tag)
+            raise session.error(f'IDLE command error: {typ} {dat}')
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            yield from _untagged(session)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not _wait(session, remaining):
+                break
+            session._get_response()
+    finally:
+        session.send(b'DONE\r\n')
+        session._command_complete('IDLE', tag)
+    yield from _untagged(session)
+
+
+def notify(session, events):
+    '''NOTIFY SET (RFC 5465) for events in the selected folder and every other
+    personal one, which the server first sends the STATUS of; returns the
+    result'''
+    typ, _ = session._simple_command('NOTIFY', 'SET', 'STATUS', f'(selected ({events})) (personal ({events}))')
+    return typ
+
+
+class _Inflating(io.RawIOBase):
+    """The decompressed side of a COMPRESS=DEFLATE stream read from source"""
+
+    def __init__(self, source):
+        self.source = source
+        self.inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while True:
+            data = self.inflater.unconsumed_tail
+            if not data:
+                # b'' at EOF, or when a non-blocking socket has nothing yet
+                data = self.source.read1(io.DEFAULT_BUFFER_SIZE)
+                if not data:
+                    return 0
+            out = self.inflater.decompress(data, len(b))
+            if out:
+                b[: len(out)] = out
+                return len(out)
+
+    def close(self):
+        self.source.close()
+        super().close()
+
+
+def compress(session):
+    '''COMPRESS DEFLATE (RFC 4978): from here on everything sent and read on
+    session goes through zlib; returns whether the server agreed'''
+    sock = getattr(session, 'sock', None)
+    if sock is None:
+        return False
+    try:
+        typ, _ = session._simple_command('COMPRESS', 'DEFLATE')
+    except session.error:
+        return False
+    if typ != 'OK':
+        return False
+    deflater = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+
+    def send(data):
+        sock.sendall(deflater.compress(data) + deflater.flush(zlib.Z_SYNC_FLUSH))
+
+    session.send = send
+    session.file = io.BufferedReader(_Inflating(session.file))
+    return True
@@ -0,0 +1,195 @@
+"""Per-command IMAP statistics, for --stats and --trace
+
+    mhi --stats folders
+    mhi --trace=folders.jsonl folders
+
+Every session open_session() opens while recording is on (including the
+extra ones folders uses for STATUS) is watched: for each command, how
+long it took from being sent to its tagged response, how many bytes
+went each way, and how many untagged responses of each kind came back.
+
+Connecting is two round trips (the greeting, and the CAPABILITY imaplib
+asks for straight away), and every command sent when nothing else was
+outstanding on its session is another; commands pipelined behind
+another share its round trip.  Received bytes are counted after any
+COMPRESS=DEFLATE decompression, sent bytes before compression.
+
+--stats prints a summary by command to stderr when mhi exits; --trace
+writes each command as a line of JSON as it completes, for loading into
+whatever analysis tool you like (pandas.read_json(f, lines=True), jq...).
+Sessions borrowed from mhid aren't recorded.
+"""
+
+import itertools
+import json
+import sys
+import threading
+import time
+from collections import Counter
+
+from .mimeparts import human_size
+
+# the Recorder while recording is on, else None
+recorder = None
+
+
+class Recorder:
+    """Records the commands sent on the sessions it watches"""
+
+    def __init__(self, trace=None):
+        self.trace = trace
+        self.start = time.monotonic()
+        self.commands = []
+        self.round_trips = 0
+        self._sessions = itertools.count()
+        self._lock = threading.Lock()
+
+    def _finish(self, record):
+        with self._lock:
+            self.commands.append(record)
+            self.round_trips += record['round_trips']
+            if self.trace:
+                self.trace.write(json.dumps(record) + '\n')
+
+    def _record(self, session, command):
+        return {
+            'session': session,
+            'command': command,
+            'start': round(time.monotonic() - self.start, 6),
+            'seconds': 0.0,
+            'sent': 0,
+            'received': 0,
+            'responses': Counter(),
+            'result': None,
+            'round_trips': 0,
+        }
+
+    def watch(self, session, connect_time):
+        '''record what's sent and received on an imaplib session from here on'''
+        number = next(self._sessions)
+        connect = self._record(number, 'connect')
+        connect.update(start=round(connect['start'] - connect_time, 6), seconds=round(connect_time, 6), result='OK', round_trips=2)
+        self._finish(connect)
+        # commands sent and not yet completed, oldest first; what's read is theirs
+        pending = []
+        sending = []
+        command, command_complete, readline, read, append_untagged = (
+            session._command,
+            session._command_complete,
+            session.readline,
+            session.read,
+            session._append_untagged,
+        )
+
+        def watched_command(name, *args):
+            label = f'{name} {args[0]}'.upper() if name == 'UID' and args else name
+            record = self._record(number, label)
+            record['round_trips'] = int(not pending)
+            pending.append(record)
+            sending.append(record)
+            try:
+                record['tag'] = command(name, *args)
+            except Exception:
+                pending.remove(record)
+                raise
+            finally:
+                sending.remove(record)
+            return record['tag']
+
+        def received(nbytes):
+            if pending:
+                pending[0]['received'] += nbytes
+
+        def watched_readline():
+            line = readline()
+            received(len(line))
+            return line
+
+        def watched_read(size):
+            data = read(size)
+            received(len(data))
+            return data
+
+        def watched_append_untagged(typ, dat):
+            if pending:
+                pending[0]['responses'][typ] += 1
+            return append_untagged(typ, dat)
+
+        def watched_command_complete(name, tag):
+            result = 'error'
+            try:
+                typ, data = command_complete(name, tag)
+                result = typ
+                return typ, data
+            finally:
+                for record in [r for r in pending if r.get('tag') == tag]:
+                    pending.remove(record)
+                    record.update(seconds=round(time.monotonic() - self.start - record['start'], 6), result=result)
+                    del record['tag']
+                    self._finish(record)
+
+        def sender():
+            return sending[-1] if sending else pending[-1] if pending else None
+
+        session._command = watched_command
+        session.readline = watched_readline
+        session.read = watched_read
+        session._append_untagged = watched_append_untagged
+        session._command_complete = watched_command_complete
+        session._stats_sender = sender
+        self.watch_send(session)
+
+    def watch_send(self, session):
+        '''(re)count what session sends, after something (like COMPRESS) has
+        replaced session.send'''
+        send, sender = session.send, session._stats_sender
+
+        def watched_send(data):
+            record = sender()
+            if record:
+                record['sent'] += len(data)
+            return send(data)
+
+        session.send = watched_send
+
+    def summary(self):
+        '''the --stats report, as a string'''
+        commands = [c for c in self.commands if c['command'] != 'connect']
+        sessions = len(self.commands) - len(commands)
+        lines = [
+            f"IMAP: {sessions} session{'s' * (sessions != 1)}, {len(commands)} commands, {self.round_trips} round trips, "
+            f"{human_size(sum(c['sent'] for c in self.commands))} sent, {human_size(sum(c['received'] for c in self.commands))} received, "
+            f"{time.monotonic() - self.start:.3f}s in all"
+        ]
+        lines.append(f"  {'command':<14} {'count':>6} {'trips':>6} {'seconds':>8} {'slowest':>8} {'sent':>7} {'received':>8}  responses")
+        by_name = {}
+        for c in self.commands:
+            by_name.setdefault(c['command'], []).append(c)
+        for name, group in sorted(by_name.items(), key=lambda item: -sum(c['seconds'] for c in item[1])):
+            responses = sum((Counter(c['responses']) for c in group), Counter())
+            lines.append(
+                f"  {name:<14} {len(group):6} {sum(c['round_trips'] for c in group):6} {sum(c['seconds'] for c in group):8.3f} "
+                f"{max(c['seconds'] for c in group):8.3f} {human_size(sum(c['sent'] for c in group)):>7} "
+                f"{human_size(sum(c['received'] for c in group)):>8}  {' '.join(f'{k}:{v}' for k, v in sorted(responses.items()))}"
+            )
+        return '\n'.join(lines)
+
+
+def start(trace_path=None):
+    '''turn recording on, writing a trace to trace_path if given'''
+    global recorder
+    trace = open(trace_path, 'w', buffering=1) if trace_path else None
+    recorder = Recorder(trace)
+    return recorder
+
+
+def stop(report):
+    '''turn recording off, printing the summary to stderr if report'''
+    global recorder
+    done, recorder = recorder, None
+    if done is None:
+        return
+    if done.trace:
+        done.trace.close()
+    if report:
+        print(done.summary(), file=sys.stderr)
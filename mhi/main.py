@@ -3,7 +3,7 @@
 # Goal: MH-ish commands that will talk to an IMAP server
 #
 # Commands that work: folder, folders, scan, rmm, rmf, pick/search, help,
-#                     debug, refile, show, next, prev, mr
+#                     debug, refile, show, next, prev, mr, watch, cache
 #
 # Commands to make work: sort, comp, repl, dist, forw, anno
 #
@@ -22,16 +22,8 @@
 import os
 import sys
 import time
-import email
-import shutil
-import imaplib
-import smtplib
-import tempfile
-import subprocess
 from functools import wraps
-from io import StringIO
 from pathlib import Path
-from urllib import parse as urlparse
 
 from configobj import ConfigObj
 
@@ -54,149 +46,6 @@ def _debug_stdout(arg):
 _debug = _debug_noop
 
 
-def sexpr_readsexpr(s):
-    from .sexpr import SexprParser
-
-    return SexprParser(StringIO(s)).parse()
-
-
-def readlisp_readsexpr(s):
-    from .readlisp import readlisp
-
-    return readlisp(tostr(s))
-
-
-readsexpr = readlisp_readsexpr
-
-
-PickDocs = """ From RFC2060:
-      When multiple keys are specified, the result is the intersection
-      (AND function) of all the messages that match those keys.  For
-      example, the criteria DELETED FROM "SMITH" SINCE 1-Feb-1994 refers
-      to all deleted messages from Smith that were placed in the mailbox
-      since February 1, 1994.  A search key can also be a parenthesized
-      list of one or more search keys (e.g. for use with the OR and NOT
-      keys).
-
-      In all search keys that use strings, a message matches the key if
-      the string is a substring of the field.  The matching is case-
-      insensitive.
-
-      The defined search keys are as follows.  Refer to the Formal
-      Syntax section for the precise syntactic definitions of the
-      arguments.
-
-      <message set>  Messages with message sequence numbers
-                     corresponding to the specified message sequence
-                     number set
-
-      ALL            All messages in the mailbox; the default initial
-                     key for ANDing.
-
-      ANSWERED       Messages with the \\Answered flag set.
-
-      BCC <string>   Messages that contain the specified string in the
-                     envelope structure's BCC field.
-
-      BEFORE <date>  Messages whose internal date is earlier than the
-                     specified date.
-
-      BODY <string>  Messages that contain the specified string in the
-                     body of the message.
-
-      CC <string>    Messages that contain the specified string in the
-                     envelope structure's CC field.
-
-      DELETED        Messages with the \\Deleted flag set.
-
-      DRAFT          Messages with the \\Draft flag set.
-
-      FLAGGED        Messages with the \\Flagged flag set.
-
-      FROM <string>  Messages that contain the specified string in the
-                     envelope structure's FROM field.
-
-      HEADER <field-name> <string>
-                     Messages that have a header with the specified
-                     field-name (as defined in [RFC-822]) and that
-                     contains the specified string in the [RFC-822]
-                     field-body.
-
-      KEYWORD <flag> Messages with the specified keyword set.
-
-      LARGER <n>     Messages with an [RFC-822] size larger than the
-                     specified number of octets.
-
-      NEW            Messages that have the \\Recent flag set but not the
-                     \\Seen flag.  This is functionally equivalent to
-                     "(RECENT UNSEEN)".
-
-      NOT <search-key>
-                     Messages that do not match the specified search
-                     key.
-
-      OLD            Messages that do not have the \\Recent flag set.
-                     This is functionally equivalent to "NOT RECENT" (as
-                     opposed to "NOT NEW").
-
-      ON <date>      Messages whose internal date is within the
-                     specified date.
-
-      OR <search-key1> <search-key2>
-                     Messages that match either search key.
-
-      RECENT         Messages that have the \\Recent flag set.
-
-      SEEN           Messages that have the \\Seen flag set.
-
-      SENTBEFORE <date>
-                     Messages whose [RFC-822] Date: header is earlier
-                     than the specified date.
-
-      SENTON <date>  Messages whose [RFC-822] Date: header is within the
-                     specified date.
-
-      SENTSINCE <date>
-                     Messages whose [RFC-822] Date: header is within or
-                     later than the specified date.
-
-      SINCE <date>   Messages whose internal date is within or later
-                     than the specified date.
-
-      SMALLER <n>    Messages with an [RFC-822] size smaller than the
-                     specified number of octets.
-
-      SUBJECT <string>
-                     Messages that contain the specified string in the
-                     envelope structure's SUBJECT field.
-
-      TEXT <string>  Messages that contain the specified string in the
-                     header or body of the message.
-
-      TO <string>    Messages that contain the specified string in the
-                     envelope structure's TO field.
-
-      UID <message set>
-                     Messages with unique identifiers corresponding to
-                     the specified unique identifier set.
-
-      UNANSWERED     Messages that do not have the \\Answered flag set.
-
-      UNDELETED      Messages that do not have the \\Deleted flag set.
-
-      UNDRAFT        Messages that do not have the \\Draft flag set.
-
-      UNFLAGGED      Messages that do not have the \\Flagged flag set.
-
-      UNKEYWORD <flag>
-                     Messages that do not have the specified keyword
-                     set.
-
-      UNSEEN         Messages that do not have the \\Seen flag set.
-
-"""
-
-
 class UsageError(Exception):
     pass
 
@@ -232,6 +81,8 @@ def takesFolderArg(f):
 
 
 def cmd_result(cmd):
+    import subprocess
+
     result = subprocess.run(cmd, capture_output=True, shell=True, check=True)
     _debug(lambda: f'ran command: {cmd} got result: {result.stdout}')
     stdout = tostr(result.stdout).strip()
@@ -250,50 +101,209 @@ def tostr(s):
         return str(s)
 
 
-class Connection:
-    """A wrapper around an IMAP connection"""
-
-    def __init__(self, startfolder=None):
-        schemes = {
-            'imap': imaplib.IMAP4,
-            'imaps': imaplib.IMAP4_SSL,
-            'stream': imaplib.IMAP4_stream,
-        }
-        scheme, netloc, path, _, _, _ = urlparse.urlparse(config['connection'])
-        _debug(lambda: f'scheme: {scheme} netloc: {netloc} path: {path}')
-        if netloc:
-            if '@' in netloc:
-                userpass, hostport = netloc.rsplit('@', 1)
-            else:
-                userpass, hostport = None, netloc
-            if ':' in hostport:
-                host, port = hostport.rsplit(':', 1)
-            else:
-                host = hostport
-                port = "143"
-                if scheme[-1] == 's':
-                    port = "993"
-            user = config.get('connection_user', os.environ.get('USER', ''))
-            passwd = config.get('connection_passwd', os.environ.get('MHI_PASSWD', ''))
-            if ':' in userpass:
-                user, passwd = userpass.split(':', 1)
-            elif userpass is not None:
-                user = userpass
-            if not passwd:
-                print("No password provided. Set connnetion_password or put it in the url or in MHI_PASSWD environment var")
-                sys.exit(1)
-            if passwd.startswith('`') and passwd.endswith('`'):  # shell eval it
-                cmd = passwd[1:-1]
-                passwd = cmd_result(cmd)
-            _debug(lambda: f"{scheme} connection to {user} : {passwd} @ {host}:{port}")
-            session = schemes[scheme](host, int(port))
-            session.login(user, passwd)
+def mhi_dir():
+    """~/.mhi/, where mhi keeps everything that isn't config or state"""
+    d = Path(os.environ.get('HOME', '')) / '.mhi'
+    d.mkdir(mode=0o700, exist_ok=True)
+    return d
+
+
+def _connection_settings():
+    """The parts of the config (and environment) needed to open a session"""
+    return {
+        'connection': config['connection'],
+        'connection_user': config.get('connection_user', os.environ.get('USER', '')),
+        'connection_passwd': config.get('connection_passwd', os.environ.get('MHI_PASSWD', '')),
+        'compress': config_flag('compress'),
+    }
+
+
+def open_session(settings):
+    """Open an imaplib session and log in as described by settings"""
+    import imaplib
+    from urllib import parse as urlparse
+
+    schemes = {
+        'imap': imaplib.IMAP4,
+        'imaps': imaplib.IMAP4_SSL,
+        'stream': imaplib.IMAP4_stream,
+    }
+    scheme, netloc, path, _, _, _ = urlparse.urlparse(settings['connection'])
+    _debug(lambda: f'scheme: {scheme} netloc: {netloc} path: {path}')
+    if netloc:
+        if '@' in netloc:
+            userpass, hostport = netloc.rsplit('@', 1)
         else:
-            session = schemes[scheme](path)
-        session.debug = 0 if _debug == _debug_noop else 4
-        self.session = session
+            userpass, hostport = None, netloc
+        if ':' in hostport:
+            host, port = hostport.rsplit(':', 1)
+        else:
+            host = hostport
+            port = "143"
+            if scheme[-1] == 's':
+                port = "993"
+        user = settings['connection_user']
+        passwd = settings['connection_passwd']
+        if ':' in userpass:
+            user, passwd = userpass.split(':', 1)
+        elif userpass is not None:
+            user = userpass
+        if not passwd:
+            print("No password provided. Set connnetion_password or put it in the url or in MHI_PASSWD environment var")
+            sys.exit(1)
+        if passwd.startswith('`') and passwd.endswith('`'):  # shell eval it
+            # the command and the connect/TLS handshake don't need each
+            # other, so run the command while we connect
+            from concurrent.futures import ThreadPoolExecutor
+
+            with ThreadPoolExecutor(1) as pool:
+                pending = pool.submit(_timed, _password, passwd[1:-1])
+                session, connect_time = _timed(schemes[scheme], host, int(port))
+                passwd, passwd_time = pending.result()
+            _debug(
+                lambda: f"connect took {connect_time:.3f}s, password {passwd_time:.3f}s; "
+                f"overlapping them saved {min(connect_time, passwd_time):.3f}s"
+            )
+        else:
+            session, connect_time = _timed(schemes[scheme], host, int(port))
+            _debug(lambda: f"connect took {connect_time:.3f}s")
+        _debug(lambda: f"{scheme} connection to {user} : {passwd} @ {host}:{port}")
+        _watch(session, connect_time)
+        _, login_time = _timed(session.login, user, passwd)
+        _debug(lambda: f"login took {login_time:.3f}s")
+        _refresh_capabilities(session)
+        if settings.get('compress') and 'COMPRESS=DEFLATE' in session.capabilities:
+            from . import imapext, imapstats
+
+            compressed = imapext.compress(session)
+            _debug(lambda: f"compression {'on' if compressed else 'refused'}")
+            if compressed and imapstats.recorder:
+                imapstats.recorder.watch_send(session)
+    else:
+        session, connect_time = _timed(schemes[scheme], path)
+        _watch(session, connect_time)
+    return session
+
+
+def _watch(session, connect_time):
+    """Have session's commands recorded, if --stats or --trace asked for it"""
+    # which would have imported imapstats already
+    imapstats = sys.modules.get(f'{__package__}.imapstats')
+    if imapstats and imapstats.recorder:
+        imapstats.recorder.watch(session, connect_time)
+
+
+def _timed(f, *args):
+    """(f(*args), how many seconds it took)"""
+    start = time.monotonic()
+    result = f(*args)
+    return result, time.monotonic() - start
+
+
+# seconds the credential agent remembers the connection_passwd command's output
+PASSWORD_TTL = 15 * 60
+
+
+def _agent_supported():
+    """Whether this platform has the Unix sockets and file locks the
+    credential agent needs (Windows has neither)"""
+    import socket
+
+    try:
+        import fcntl  # noqa: F401 pylint: disable=unused-import
+    except ImportError:
+        return False
+    return hasattr(socket, 'AF_UNIX')
+
+
+def _password(cmd):
+    """The output of the connection_passwd command, from the credential
+    agent if it's still remembering it"""
+    supported = _agent_supported()
+    # where there can't be an agent, only try for one if asked to
+    ttl = int(config.get('password_cache_ttl', PASSWORD_TTL if supported else 0))
+    if ttl <= 0:
+        return cmd_result(cmd)
+    if not supported:
+        _debug("no credential agent on this platform")
+        return cmd_result(cmd)
+    try:
+        from . import credagent
+    except ImportError as e:
+        _debug(lambda: f"no credential agent: {e!r}")
+        return cmd_result(cmd)
+
+    passwd = credagent.lookup(cmd)
+    if passwd is None:
+        passwd = cmd_result(cmd)
+        credagent.remember(cmd, passwd, ttl)
+    return passwd
+
+
+def _refresh_capabilities(session):
+    """imaplib only asks for CAPABILITY before login, but servers often
+    advertise more afterwards (usually right in the LOGIN response)"""
+    caps = session.untagged_responses.get('CAPABILITY')
+    if not caps:
+        caps = session.capability()[1]
+    session.capabilities = tuple(tostr(caps[-1]).upper().split())
+
+
+def config_flag(key, default=True):
+    """Read a yes/no setting from .mhirc"""
+    value = config.get(key, None)
+    if value is None:
+        return default
+    return str(value).lower() in ('1', 'yes', 'true', 'on')
+
+
+def _mhid_socket():
+    """Where mhid listens for mhi commands"""
+    return mhi_dir() / 'mhid.sock'
+
+
+def _mhid_running():
+    """Whether mhid looks to be running, so that a session costs no connect or login"""
+    return _mhid_socket().exists()
+
+
+def _attach(settings):
+    """A session for settings' account borrowed from mhid, or None; daemon.py
+    (and the multiprocessing it needs) is only imported if mhid is running"""
+    if not _mhid_running():
+        return None
+    from . import daemon
+
+    return daemon.attach(settings)
+
+
+def _run_ext(session, name, *args):
+    """Run one of the imapext functions against session, in mhid if that's
+    where session is"""
+    daemon = sys.modules.get(f'{__package__}.daemon')
+    if daemon and isinstance(session, daemon.DaemonSession):
+        return session.ext(name, *args)
+    from . import imapext
+
+    return getattr(imapext, name)(session, *args)
+
+
+class Connection:
+    """A wrapper around an IMAP connection
+
+    If mhid is running, the session is borrowed from it instead of being
+    opened (and logged into) from scratch.  Pass direct=True to insist
+    on a private session.
+    """
+
+    def __init__(self, startfolder=None, direct=False):
         if startfolder is None:
             startfolder = state.get('folder', 'INBOX')
+        session = None if direct else _attach(_connection_settings())
+        if session is None:
+            session = open_session(_connection_settings())
+        session.debug = 0 if _debug == _debug_noop else 4
+        self.session = session
         self.select(startfolder)
         state['folder'] = startfolder
 
@@ -301,6 +311,8 @@ class Connection:
         return self
 
     def __exit__(self, *args):
+        import imaplib
+
         _debug(f'Exit args are: {args!r}')
         try:
             self.session.close()
@@ -322,31 +334,149 @@ class Connection:
 
     def select(self, folder, errmsg=None):
         errmsg = errmsg or f"Problem changing to folder {folder}:"
-        return die_on_error(self.session.select)(folder, errmsg=errmsg)
+        data = die_on_error(self.session.select)(folder, errmsg=errmsg)
+        self.exists = int(tostr(data[-1])) if data and data[-1] else 0
+        uidvalidity = self.session.untagged_responses.get('UIDVALIDITY')
+        self.uidvalidity = int(tostr(uidvalidity[-1])) if uidvalidity else None
+        return data
+
+    def _ext(self, name, *args):
+        """Run one of the imapext functions against this session"""
+        return _run_ext(self.session, name, *args)
+
+    def fetch_stream(self, msgset, items, errmsg="Problem with fetch:", uid=False, sizer=None):
+        """Yield (msgnum, {item: value}) for msgset as the server sends them.
+
+        Only responses that include the first of items (other than UID)
+        are passed on, so unsolicited FLAGS updates and the like are
+        skipped.  If sizer is given, it's told how long the FETCH took
+        and how much came back.
+        """
+        import imaplib
+        from .response import fetch_responses
+
+        names = items.replace('(', ' ').replace(')', ' ').split()
+        wanted = [n for n in names if n.upper() != 'UID'][0].upper().replace('.PEEK', '').split('[')[0]
+        command = ('UID', 'FETCH') if uid else ('FETCH',)
+        count = nbytes = 0
+        start = time.monotonic()
+        try:
+            for response in self._ext('stream', *command, msgset, items):
+                if sizer:
+                    nbytes += sum(len(p) if not isinstance(p, tuple) else len(p[0]) + len(p[1]) for p in response)
+                for num, values in fetch_responses(response):
+                    if any(k.startswith(wanted) for k in values):
+                        count += 1
+                        yield num, values
+        except imaplib.IMAP4.error as e:
+            print(f'{errmsg} {e}')
+            sys.exit(1)
+        _memory_checkpoint('the end of a FETCH')
+        if sizer:
+            sizer.update(count, time.monotonic() - start, nbytes)
 
     def folders(self):
         result, flist = self.raw_list()
         # check result
-        folders = []
-        _debug(lambda: f"flist: {flist!r} ")
-        for fline in flist:
-            fstr = tostr(fline)
-            f = str(readsexpr(f'({fstr})')[2])
-            _debug(lambda: f" f: {f!r}")
-            folders.append(f)
-        return folders
+        return _folder_names(flist)
 
     def folderstatus(self, folder):
         result, data = self.raw_status(folder, '(MESSAGES RECENT UNSEEN)')
         if result != 'OK':
             return ()
-        stats = readsexpr(f'({tostr(data[0])})')[1]
-        msgs, recent, unseen = stats[1], stats[3], stats[5]
-        return msgs, recent, unseen
+        return _parse_status(data[0])[1]
+
+    def folderstatuses(self):
+        """{folder: (messages, recent, unseen)} for every folder, using
+        LIST-STATUS if the server has it and pipelined STATUSes if not"""
+        items = '(MESSAGES RECENT UNSEEN)'
+        statuses = None
+        if 'LIST-STATUS' in self.session.capabilities:
+            result, flist, statuses = self._ext('list_status', items)
+            if result == 'OK':
+                folders = _folder_names(flist)
+            else:
+                statuses = None
+        if statuses is None:
+            folders = self.folders()
+            statuses = self._status_many(folders, items)
+        stats = dict.fromkeys(folders, ())
+        for line in statuses:
+            f, status = _parse_status(line)
+            stats[f] = status
+        return stats
+
+    def _status_many(self, folders, items):
+        """STATUS for each of folders, shared out between this session and
+        up to status_sessions (from .mhirc) more, each running its share
+        pipelined in a thread of its own"""
+        from concurrent.futures import ThreadPoolExecutor
+
+        width = min(int(config.get('status_sessions', STATUS_SESSIONS)), len(folders) // FOLDERS_PER_SESSION)
+        if width <= 0:
+            return self._ext('status_many', folders, items)
+        shares = [folders[i :: width + 1] for i in range(width + 1)]
+        settings = _connection_settings()
+        with ThreadPoolExecutor(width) as pool:
+            futures = [pool.submit(_status_session, settings, share, items) for share in shares[1:]]
+            statuses = self._ext('status_many', shares[0], items)
+            for share, future in zip(shares[1:], futures):
+                result = future.result()
+                if result is None:
+                    # couldn't get another session; do it here instead
+                    result = self._ext('status_many', share, items)
+                statuses.extend(result)
+        return statuses
+
+
+# extra sessions folders may use for STATUS, and how many folders it takes
+# before another session is worth logging in for.  None by default: STATUS
+# is pipelined, so another session only adds a connect and a LOGIN (see
+# bench_e2e.py --rc 'status_sessions = 2')
+STATUS_SESSIONS = 0
+FOLDERS_PER_SESSION = 16
+
+
+def _status_session(settings, folders, items):
+    """STATUS for each of folders on a session of its own, or None if no
+    session could be had"""
+    import imaplib
+
+    try:
+        session = _attach(settings) or open_session(settings)
+    except (OSError, imaplib.IMAP4.error) as e:
+        _debug(lambda: f"no extra session for STATUS: {e}")
+        return None
+    try:
+        return _run_ext(session, 'status_many', folders, items)
+    finally:
+        try:
+            session.logout()
+        except imaplib.IMAP4.error:
+            pass
+
+
+def _folder_names(flist):
+    """folder names from the untagged responses to LIST"""
+    from .response import parse, text
+
+    _debug(lambda: f"flist: {flist!r} ")
+    return [text(name) for _, _, name in parse(flist)]
+
+
+def _parse_status(line):
+    """(folder, (messages, recent, unseen)) from an untagged STATUS response"""
+    from .response import parse, text
+
+    (name, stats), = parse([line])
+    stats = {str(k).upper(): v for k, v in zip(stats[::2], stats[1::2])}
+    return text(name), (stats['MESSAGES'], stats['RECENT'], stats['UNSEEN'])
 
 
 def die_on_error(f):
     def _die_on_err_wrapper(*args, **kwargs):
+        import imaplib
+
         msgstr = kwargs.get('errmsg', 'There was a problem:')
         if 'errmsg' in kwargs:
             del kwargs['errmsg']
@@ -363,6 +493,75 @@ def die_on_error(f):
     return _die_on_err_wrapper
 
 
+def _msgset_ranges(msgset, count):
+    '''The sorted, merged (start, end) ranges msgset covers in a folder of count messages'''
+    spans = []
+    for r in msgset.split(','):
+        start, _, end = r.partition(':')
+        start = count if start == '*' else int(start)
+        end = start if not end else count if end == '*' else int(end)
+        if start > end:
+            start, end = end, start
+        start, end = max(start, 1), min(end, count)
+        if start <= end:
+            spans.append((start, end))
+    ranges = []
+    for start, end in sorted(spans):
+        if ranges and start <= ranges[-1][1] + 1:
+            ranges[-1] = (ranges[-1][0], max(end, ranges[-1][1]))
+        else:
+            ranges.append((start, end))
+    return ranges
+
+
+def _expand_msgset(msgset, count):
+    '''The sorted message numbers msgset refers to in a folder of count messages'''
+    return [n for start, end in _msgset_ranges(msgset, count) for n in range(start, end + 1)]
+
+
+def _windows(ranges, size):
+    '''Lists of the message numbers in ranges, size() of them at a time'''
+    window = []
+    for start, end in ranges:
+        n = start
+        while n <= end:
+            take = min(end - n + 1, size() - len(window))
+            window.extend(range(n, n + take))
+            n += take
+            if len(window) >= size():
+                yield window
+                window = []
+    if window:
+        yield window
+
+
+class WindowSizer:
+    """How many messages to FETCH at a time.
+
+    Windows start small so the first lines show up quickly, then grow
+    until each one takes about target seconds, so the round trip is a
+    small part of each.  max_bytes keeps any one window (and so memory
+    use) bounded no matter how large the messages are.
+    """
+
+    def __init__(self, size=25, target=0.5, max_size=5000, max_bytes=4 * 1024 * 1024):
+        self.size = size
+        self.target = target
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+
+    def update(self, count, elapsed, nbytes):
+        if not count:
+            return
+        size = self.size * 4
+        if elapsed > 0:
+            size = min(size, int(count * self.target / elapsed))
+        if nbytes:
+            size = min(size, int(count * self.max_bytes / nbytes))
+        self.size = max(1, min(self.max_size, size))
+        _debug(lambda: f"window: {count} msgs, {nbytes} bytes in {elapsed:.3f}s; next window {self.size}")
+
+
 def _get_pager_name():
     for p in (os.environ.get('PAGER', ''), '/usr/bin/less', '/bin/more', 'cat'):
         if Path(p).is_file():
@@ -371,17 +570,25 @@ def _get_pager_name():
 
 
 def paged(f):
+    '''send f's output through the pager when, at the time f is called, it
+    would otherwise go to a terminal'''
+
     @wraps(f)
     def wrapper(*a, **kw):
+        import subprocess
+
+        pager = _get_pager_name()
+        if not (pager and sys.stdout.isatty()):
+            return f(*a, **kw)
+        stdout = sys.stdout
         try:
-            with subprocess.Popen([_get_pager_name()], stdin=subprocess.PIPE, text=True) as p:
+            with subprocess.Popen([pager], stdin=subprocess.PIPE, text=True) as p:
                 sys.stdout = p.stdin
                 return f(*a, **kw)
         finally:
-            sys.stdout = sys.__stdout__
+            sys.stdout = stdout
 
-    pager = _get_pager_name()
-    return wrapper if sys.stdout.isatty() and pager else f
+    return wrapper
 
 
 def msgset_from(arglist):
@@ -446,188 +653,6 @@ def _checkMsgset(msgset):
         fail()
 
 
-def tempFileName(*args, **kwargs):
-    f = tempfile.NamedTemporaryFile(*args, **kwargs)
-    name = f.name
-    f.close()
-    return name
-
-
-def _crlf_terminate(msgfile):
-    '''convenience function to turn a \n terminated file into a \r\n terminated file'''
-    tfile = tempFileName(prefix="mhi")
-    os.rename(msgfile, tfile)
-    with open(tfile, 'r') as infile:
-        with open(msgfile, 'w') as outfile:
-            for line in infile:
-                if not line.endswith('\r\n'):
-                    line = line[:-1]  # strip existing \n (or \r?)
-                    line += '\r\n'  # add new lineending
-                outfile.write(line)
-
-
-def _edit(msgfile):
-    '''internal common code for comp/repl/dist/medit'''
-    env = os.environ
-    editor = env.get('VISUAL', env.get('EDITOR', 'editor'))
-    try:
-        fin = os.system(f"{editor} {msgfile}")
-        if Path(msgfile).exists():
-            _crlf_terminate(msgfile)
-    except Exception as e:
-        _debug(lambda: f"editor exception: {e!r}")
-        return False
-    _debug(lambda: f"editor result code: {fin}")
-    return fin == 0
-
-
-def _SMTPsend(msgfile):
-    ret = {'Unknown': 'SMTP problem'}
-    msg = email.message_from_file(open(msgfile, "r"))
-    fromaddr = msg.get('From', '')
-    toaddrs = msg.get_all('To', [])
-    _debug(lambda: f"composing message from {fromaddr!r} to {toaddrs!r}")
-    server = smtplib.SMTP('localhost')
-    # server.set_debuglevel(1)
-    try:
-        ret = server.sendmail(fromaddr, toaddrs, msg.as_string())
-    except smtplib.SMTPRecipientsRefused:
-        print("No valid recipients. Try again.")
-    except smtplib.SMTPHeloError:
-        print("Error talking to SMTP server (No HELO).")
-    except smtplib.SMTPSenderRefused:
-        print("Error talking to SMTP server (Unacceptable FROM address).")
-    except smtplib.SMTPDataError:
-        print("Error talking to SMTP server (Data Error).")
-    server.quit()
-    for k in ret:
-        print(f"SMTP Error: {k}: {ret[k]}")
-    return len(ret.keys())
-
-
-def _get_messages(folder, msgset):
-    with Connection(folder) as S:
-        msglist = S.search(None, msgset, errmsg="Problem with search:")
-        messages = []
-        for num in msglist[0].split():
-            result, data = S.fetch(num, '(RFC822)', errmsg=f"Problem fetching msg {num}: ")
-            _debug(lambda: f"Data from message {num!r} : {data!r}")
-            messages.append((num, data))
-    return messages
-
-
-def _get_curMessage():
-    folder = state['folder']
-    try:
-        msgset = state[folder + '.cur']
-    except KeyError:
-        print("Error: No current message selected.")
-        raise UsageError()
-    _checkMsgset(msgset)
-    return _get_messages(folder, msgset)[0][1]
-
-
-def _template_update(msgfile):
-    def _quoted_current(_, msg):
-        result = ""
-        for part in msg.walk():
-            _debug(lambda: f"PART {part.get_content_type()}:")
-            for line in part.get_payload(decode=True).split("\n"):
-                result += "> " + line + "\n"
-        return result
-
-    def __header(_, msg, header):
-        if header in msg:
-            return msg[header]
-        return f"[[Missing {header} header]]"
-
-    def _header_from(data, msg):
-        return __header(data, msg, 'from')
-
-    def _header_date(data, msg):
-        return __header(data, msg, 'date')
-
-    def _header_subject(data, msg):
-        return __header(data, msg, 'subject')
-
-    def _header_from_name(data, msg):
-        full = _header_from(data, msg)
-        left = full.find("<")
-        right = full.find(">")
-        if left > -1 and right > -1:
-            return full[:left] + full[right + 1 :]
-        return full
-
-    macros = {
-        '###QUOTED###': _quoted_current,
-        '###:FROM###': _header_from,
-        '###:DATE###': _header_date,
-        '###:SUBJECT###': _header_subject,
-        '###:FROM.NAME###': _header_from_name,
-    }
-
-    template = open(msgfile, 'r')
-    templatetext = template.readlines()
-    outfile = open(msgfile, "w")
-    curdata = _get_curMessage()
-    curmsg = email.message_from_string(curdata[0][1])
-    for line in templatetext:
-        changed = True
-        while changed:
-            changed = False
-            for macro, impl in macros.items():
-                if macro in line:
-                    line = line.replace(macro, impl(curdata, curmsg))
-                    changed = True
-        outfile.write(line)
-    outfile.close()
-
-
-def comp(args):
-    '''Usage: comp
-
-    Compose a new message
-    '''
-    tmpfile = tempFileName(prefix="mhi-comp-")
-    if config.get('comp_template', None):
-        shutil.copyfile(config['comp_template'], tmpfile)
-    if _edit(tmpfile):
-        # edit succeeded, wasn't aborted or anything
-        errcount = _SMTPsend(tmpfile)
-        if not errcount:
-            os.unlink(tmpfile)
-    else:
-        # 'abort - throw away session, keep - save it for later'
-        print("Session aborted.")
-        try:
-            os.unlink(tmpfile)
-        except:
-            pass
-
-
-def repl(args):
-    '''Usage: repl
-
-    Reply to the current message, quoting it
-    '''
-    tmpfile = tempFileName(prefix="mhi-repl-")
-    if config.get('repl_template', None):
-        shutil.copyfile(config['repl_template'], tmpfile)
-        _template_update(tmpfile)
-    # TODO: put quoted contents of current message into tmpfile
-    # TODO: put the author of the current message in the 'To:' field
-    # TODO: swipe MH's -cc, etc syntax for specifying who to copy
-    if _edit(tmpfile):
-        # edit succeeded, wasn't aborted or anything
-        errcount = _SMTPsend(tmpfile)
-        if not errcount:
-            os.unlink(tmpfile)
-    else:
-        # 'abort - throw away session, keep - save it for later'
-        print("Session aborted.")
-        os.unlink(tmpfile)
-
-
 def _selectOrCreate(conn, folder) -> str:
     result, data = conn.raw_select(folder)
     _debug(lambda: f" Result: {result}, {data} ")
@@ -651,54 +676,6 @@ def folder_name(folder):
     return folder
 
 
-@takesFolderArg
-def folder(folder, arglist):
-    '''Usage: folder [+<foldername>]
-
-    Change folders / show current folder
-    '''
-    if arglist:
-        raise UsageError()
-    if folder is None:
-        folder = state.get('folder')
-    if folder is None:
-        print("No current folder selected. Use 'folders' to get a list.")
-    with Connection() as S:
-        msgcount = _selectOrCreate(S, folder)
-    state['folder'] = folder
-    # inbox+ has 64 messages  (1-64); cur=63; (others).
-    cur = state.get(folder + '.cur', 'unset')
-    print(f"Folder {folder_name(folder)} has {msgcount} messages, cur is {cur}.")
-
-
-@paged
-def folders(args):
-    '''Usage: folders
-
-    Show all folders
-    '''
-    HEADER = "FOLDER"
-    with Connection() as S:
-        stats = {}
-        for f in S.folders():
-            status = S.folderstatus(f)
-            stats[f] = status or (0, 0, 0)
-    stats[HEADER] = ["# MESSAGES", "RECENT", "UNSEEN"]
-    folderlist = sorted(key for key in stats if key != HEADER)
-    totalmsgs, totalnew = 0, 0
-    for folder in [HEADER] + folderlist:
-        _debug(lambda: f" folder: {folder!r}")
-        iscur = '*' if folder == state['folder'] else ' '
-        messages, recent, unseen = stats[folder]
-        cur = state.get(f'{folder}.cur', ['-', 'CUR'][folder == HEADER])
-        foldr = folder_name(folder)
-        print(f"{iscur}{foldr:>20} {cur:7} {messages:7} {recent:7} {unseen:7}")
-        if folder != HEADER:
-            totalmsgs += int(messages)
-            totalnew += int(unseen)
-    print(f"TOTAL: {totalmsgs} messages ({totalnew} new) in {len(folderlist)} folders")
-
-
 def _consolidate(data):
     '''data is a comma-separated list of numbers; this function adds ranges with a dash'''
     from itertools import groupby
@@ -719,148 +696,59 @@ def _consolidate(data):
     return result
 
 
-@takesFolderArg
-def pick(folder, arglist):
-    '''Usage: pick <search criteria> [+folder]
+def _uid_map(S, folder):
+    """The message number <-> UID map of folder (which S has selected),
+    brought up to date"""
+    from .scancache import open_cache
 
-    Return a message-set that matches the search criteria.
-    Criteria are based on the IMAP spec search string.
-    A summary of the IMAP spec is available by calling 'pick' with --help as its only option.
-    '''
-    if not arglist:
-        raise UsageError()
-    if len(arglist) == 1 and arglist[0] == "--help":
-        print(PickDocs)
-        sys.exit(1)
-    folder = state['folder'] = folder or state['folder']
-    searchstr = '(' + ' '.join(arglist) + ')'
-    with Connection(folder) as S:
-        data = S.search(None, searchstr, errmsg="Problem with search criteria:")
-        _debug(lambda: f"data: {data!r}")
-    data = [d for d in data if d != '']
-    if data:
-        msglist = []
-        for m in data:
-            msglist.extend(int(i) for i in m.split())
-        print(_consolidate(msglist))
-    else:
-        print("0")
+    m = open_cache(folder)
+    m.sync_uids(S)
+    _follow_cur(folder, m)
+    return m
 
 
-def _cur_msg(folder):
-    try:
-        return state[folder + ".cur"]
-    except KeyError:
-        print("Error: No message(s) selected.")
-        raise UsageError()
-
+def _set_cur(folder, seq, uid, uidvalidity):
+    """Make message seq (whose UID is uid) folder's current message"""
+    state[folder + '.cur'] = seq
+    if uid is not None:
+        state[folder + '.curuid'] = f'{uidvalidity}:{uid}'
 
-@takesFolderArg
-def refile(destfolder, arglist):
-    '''Usage: refile <messageset> +<folder>
 
-    Moves a set of messages from the current folder to a new one.
-    Add -k to keep the originals (making this a 'copy' instead of a 'refile').
-    '''
-    if destfolder is None:
-        print("Error: Destination folder must be specified.")
-        raise UsageError()
-    srcfolder = state["folder"]
-    keep = '-k' in arglist
-    if keep:
-        arglist.remove('-k')
-
-    msgset = msgset_from(arglist) or _cur_msg(srcfolder)
-    _checkMsgset(msgset)
-    with Connection() as S:
-        _selectOrCreate(S, destfolder)
-        S.select(srcfolder)
-        S.copy(msgset, destfolder, errmsg="Problem with copy:")
-        data = S.search(None, msgset, errmsg="Problem with search:")
-        msgnums = data[0].split()
-        if keep:
-            action = 'copied'
-        else:
-            action = 'refiled'
-            print(
-                "Refiling... ",
-            )
-            for num in msgnums:
-                S.raw_store(num, '+FLAGS', '\\Deleted')
-                print(
-                    ".",
-                )
-            S.expunge()
-        print(f"{len(msgnums)} messages {action} to '{destfolder}'.")
-    print("Done.")
-
-
-@takesFolderArg
-def rmf(folder, arglist):
-    '''Usage:  rmf +<foldername>
-    remove a folder
-    '''
-    _debug(lambda: f"Folder is {folder!r}")
-    if folder is None:
-        raise UsageError()
-    with Connection() as S:
-        result, data = S.raw_select(folder)
-        _debug(lambda: f" Result: {result}, {data}")
-        if result != 'OK':
-            print(f"Folder '{folder}' doesn't exist.")
-            return
-        if state['folder'] == folder:
-            state['folder'] = 'INBOX'
-        S.select(state['folder'])
-        result, data = S.raw_delete(folder)
-    if result == 'OK':
-        print(f"Folder '{folder}' deleted.")
+def _follow_cur(folder, m):
+    """Renumber folder's current message to wherever its UID now is.  If it
+    has been removed, the message after it is current, as in MH, or the
+    last message if there's none after it; if the folder is empty, there's
+    no current message."""
+    try:
+        uidvalidity, uid = map(int, state[folder + '.curuid'].split(':'))
+    except (KeyError, ValueError):
+        return
+    if uidvalidity != m.uidvalidity:
+        return
+    seq = m.seq_from(uid) or len(m.uids)
+    if seq:
+        _set_cur(folder, seq, m.uid(seq), uidvalidity)
     else:
-        print(f"Failed to delete folder '{folder}': {data}")
+        del state[folder + '.curuid']
+        if folder + '.cur' in state:
+            del state[folder + '.cur']
 
 
-@takesFolderArg
-def rmm(folder, arglist):
-    '''Usage: rmm [+folder] <messageset>
+def _expunged(S, folder, m, data=None):
+    """Apply the EXPUNGE responses S got (or which EXPUNGE returned as data)
+    to folder's UID map"""
+    if data is None:
+        _, data = S.raw_response('EXPUNGE')
+    m.expunged([int(tostr(n)) for n in data if n is not None])
+    _follow_cur(folder, m)
 
-    ie: rmm +INBOX 1
-    ie: rmm 1:5
 
-    Remove the specified messages (or the current message if unspecified)
-    from the specified folder (or the current folder if unspecified).
-    '''
-    folder = state['folder'] = folder or state['folder']
-    msgset = msgset_from(arglist) or _cur_msg(folder)
-    _checkMsgset(msgset)
-    with Connection(folder) as S:
-        data = S.search(None, msgset, errmsg="Problem with search:")
-        _debug(lambda: f"data: {data!r}")
-        S.store(msgset, '+FLAGS', '\\Deleted', errmsg="Problem setting deleted flag: ")
-        S.expunge(errmsg="Problem expunging deleted messages: ")
-        print("Deleted.")
-    if data and data[0]:
-        first = tostr(data[0]).split()[0]
-        # TODO: fix this
-        state[folder + '.cur'] = first
-
-
-@takesFolderArg
-def mr(folder, arglist):
-    '''Usage: mr [+folder] <messageset>
-
-    Mark the specified messages (or the current message if unspecified)
-    from the specified folder (or the current folder if unspecified) as read.
-    '''
-    folder = state['folder'] = folder or state['folder']
-    msgset = msgset_from(arglist) or _cur_msg(folder)
-    _checkMsgset(msgset)
-    with Connection(folder) as S:
-        data = S.search(None, msgset, errmsg="Problem with search:")
-        _debug(lambda: f"data: {data!r}")
-        S.store(msgset, '+FLAGS', '\\Seen', errmsg="Problem setting read flag: ")
-    if data[0]:
-        first = data[0].split()[0]
-        state[folder + '.cur'] = first
+def _cur_msg(folder):
+    try:
+        return state[folder + ".cur"]
+    except KeyError:
+        print("Error: No message(s) selected.")
+        raise UsageError()
 
 
 def _headers_from(msg):
@@ -874,147 +762,6 @@ def _headers_from(msg):
     return result
 
 
-@paged
-def _show(folder, msgset):
-    '''common code for show/next/prev
-    updates folder's cur pointer
-    '''
-    import email
-    from email.policy import default
-
-    outputfunc = print
-    with Connection(folder) as S:
-        msglist = S.search(None, msgset, errmsg="Problem with search:")
-        _debug(lambda: f"SEARCH returned: {msglist!r}")
-        nums = tostr(msglist[0])
-        for num in nums.split():
-            result, data = S.raw_fetch(num, '(RFC822)')
-            _debug(lambda: f"data for {num!r} is: {msglist!r}")
-            outputfunc(f"(Message {folder}:{num})\n")
-            msgbytes = data[0][1]
-            # outputfunc(_headers_from(msgbytes.decode()))
-            msg = email.message_from_bytes(msgbytes, policy=default)
-            state[folder + '.cur'] = int(num)
-            outputfunc(msg.as_string(unixfrom=True))
-            # outputfunc(msg.get_body(preferencelist=('related', 'plain', 'html')))
-            # for part in msg.walk():
-            #     _debug(lambda: "PART %s:" % part.get_content_type())
-            #     msg = part.get_payload(0).decode()
-            #     outputfunc(msg)
-
-
-@takesFolderArg
-def show(folder, arglist):
-    '''Usage:  show [<messageset>]
-
-    Show the specified messages, or the current message if none specified
-    '''
-    folder = state['folder'] = folder if folder else state['folder']
-    msgset = msgset_from(arglist) or _cur_msg(folder)
-    _checkMsgset(msgset)
-    _show(folder, msgset)
-
-
-@takesFolderArg
-def next(folder, arglist):
-    '''Usage: next [+<folder>]
-
-    Show the next message in the specified folder, or the current folder if not specified
-    '''
-    # TODO: needs better bounds checking
-    folder = state['folder'] = folder or state['folder']
-    try:
-        cur = int(state[folder + '.cur']) + 1
-    except KeyError:
-        cur = 1
-    _show(folder, str(cur))
-
-
-@takesFolderArg
-def prev(folder, arglist):
-    '''Usage: prev [+<folder>]
-    Show the previous message in the specified folder, or the current folder if not specified
-    '''
-    # TODO: needs better bounds checking
-    folder = state['folder'] = folder or state['folder']
-    try:
-        cur = int(state[folder + '.cur']) - 1
-    except KeyError:
-        cur = 1
-    _show(folder, str(cur))
-
-
-@paged
-@takesFolderArg
-def scan(folder, arglist):
-    '''Usage: scan [+<folder>] [messageset]
-    Show a list of the specified messages (or all if unspecified)
-    in the specified folder, or the current folder if not specified
-    '''
-
-    def summarize_envelope(env_date, env_from, env_sender, flags):
-        _debug(lambda: f"env_date={env_date}\nenv_from={env_from}\nenv_sender={env_sender}\nflags={flags}")
-        try:
-            fmt = "%d %b %Y %H:%M:%S"
-            if ',' in env_date:
-                fmt = "%a, " + fmt
-            env_date = ' '.join(str(env_date).split()[: len(fmt.split())])
-            dt = time.strptime(env_date, fmt)
-            outtime = time.strftime("%m/%d", dt)
-        except Exception as e:
-            _debug(lambda: f"strptime exception: {e!r}")
-            outtime = "??/??"
-        if isinstance(env_from, list):
-            outfrom = str(env_from[0][0])
-            if outfrom == 'NIL':
-                outfrom = "%s@%s" % (env_from[0][2], env_from[0][3])
-        else:
-            outfrom = "<Unknown>"
-        if cur == num:
-            status = '>'
-        elif 'Answered' in flags:
-            status = 'r'
-        elif 'Seen' in flags:
-            status = ' '
-        elif 'Recent' in flags:
-            status = 'N'
-        else:
-            status = 'O'
-        return f'{num:4} {status} {outtime} {outfrom[:18]:<18} '
-
-    subjlen = 47
-    if len(arglist) > 99:
-        raise UsageError()
-    # find any folder refs and put together the msgset string
-    folder = state['folder'] = folder or state['folder']
-    msgset = msgset_from(arglist) or "1:*"
-    _checkMsgset(msgset)
-    with Connection(folder) as S:
-        data = S.fetch(msgset, '(ENVELOPE FLAGS)', errmsg="Problem with fetch:")
-        # take out fake/bad hits
-        data = [hit for hit in (tostr(h) for h in data if h) if ' ' in hit]
-        if not data:
-            print("No messages.")
-            sys.exit(0)
-        try:
-            cur = int(state[folder + '.cur'])
-        except Exception:
-            cur = None
-        for hit in data:
-            _debug(lambda: f'hit={hit}')
-            num, e = hit.split(' ', 1)
-            num = int(num)
-            _debug(lambda: f'e={e}')
-            e = readsexpr(e)
-            env_date, env_subj, env_from, env_sender = e[1][:4]
-            _debug(lambda: f'env_subj={env_subj}')
-            flags = [str(f) for f in e[3]]
-
-            outenv = summarize_envelope(env_date, env_from, env_sender, flags)
-            outsubj = "<no subject>" if str(env_subj) == "NIL" else str(env_subj)
-            print(outenv + outsubj[:subjlen])
-
-
 def debug(args):
     global _debug
     _debug = _debug_stdout
@@ -1031,35 +778,144 @@ def help(args):
         print(f"Valid commands: {CommandList}")
         sys.exit(0)
     cmd = args[0]
-    cmdfunc = Commands.get(cmd, None)
+    cmdfunc = _command(cmd)
     print(f"Help on {cmd}:\n")
     print(cmdfunc.__doc__)
 
 
+# command name -> 'module:function' within mhi; a command's module is only
+# imported when that command is run, so each command (and what it imports)
+# doesn't slow down every other command's startup
 Commands = {
-    'folders': folders,
-    'folder': folder,
-    'debug': debug,
-    'pick': pick,
-    'refile': refile,
-    'rmf': rmf,
-    'rmm': rmm,
-    'scan': scan,
-    'search': pick,
-    'show': show,
-    'next': next,
-    'prev': prev,
-    'comp': comp,
-    'repl': repl,
-    'help': help,
-    'mr': mr,
+    'folders': 'folders:folders',
+    'folder': 'folders:folder',
+    'debug': 'main:debug',
+    'pick': 'pick:pick',
+    'index': 'pick:index',
+    'refile': 'messages:refile',
+    'rmf': 'folders:rmf',
+    'rmm': 'messages:rmm',
+    'scan': 'scan:scan',
+    'search': 'pick:pick',
+    'show': 'show:show',
+    'next': 'show:next',
+    'prev': 'show:prev',
+    'comp': 'compose:comp',
+    'repl': 'compose:repl',
+    'help': 'main:help',
+    'forget-password': 'credagent:forget_password',
+    'mr': 'messages:mr',
+    'watch': 'watch:watch',
+    'cache': 'bodycache:cache',
 }
 
+
+def _command(name):
+    """The function implementing command name, or None if there's no such command"""
+    from importlib import import_module
+
+    if name not in Commands:
+        return None
+    module, func = Commands[name].split(':')
+    return getattr(import_module(f'.{module}', __package__), func)
+
+
 CommandList = ', '.join(sorted(Commands.keys()))
 
 
+def _options(args):
+    """Split the --options before the command name off args, returning
+    ({option: value}, the rest of args); None if there's a bad one"""
+    options = {}
+    while len(args) > 1 and args[1].startswith('--'):
+        option, _, value = args[1].partition('=')
+        if option not in Options:
+            print(f"Unknown option {option}.  Valid ones: {', '.join(Options)}")
+            return None, args
+        if not _option_value_ok(option, value):
+            print(f"Usage: {Options[option]}")
+            return None, args
+        options[option] = value
+        args = args[:1] + args[2:]
+    return options, args
+
+
+def _option_value_ok(option, value):
+    if option == '--trace':
+        return bool(value)
+    if option == '--profile':
+        return value in ('', 'cpu', 'mem')
+    return not value
+
+
+# options that go before the command name, and what they do
+Options = {
+    '--stats': "--stats prints each IMAP command's round trips, time and bytes at exit",
+    '--trace': '--trace=FILE writes a line of JSON to FILE for each IMAP command',
+    '--profile': '--profile[=cpu|mem] writes a cProfile or tracemalloc profile of the command to the current directory',
+}
+
+# allocation sites listed by --profile=mem
+PROFILE_TOP = 25
+
+# under --profile=mem, [bytes, snapshot] from the fullest _memory_checkpoint() yet
+_fullest = None
+
+
+def _memory_checkpoint(where):
+    """under --profile=mem, keep a snapshot of what's allocated now if it's
+    more than at any checkpoint before; called where memory use peaks, since
+    what's freed again before exit wouldn't show up otherwise"""
+    if _fullest is None:
+        return
+    import tracemalloc
+
+    current = tracemalloc.get_traced_memory()[0]
+    if current >= _fullest[0]:
+        _fullest[:] = [current, tracemalloc.take_snapshot(), where]
+
+
+def _profiled(kind, name, run):
+    """run() under cProfile (kind 'cpu', written to mhi-<name>.pstats) or
+    tracemalloc ('mem', its top allocation sites written to mhi-<name>.mem.txt)"""
+    if kind == 'cpu':
+        import cProfile
+
+        profiler = cProfile.Profile()
+        path = f'mhi-{name}.pstats'
+        try:
+            return profiler.runcall(run)
+        finally:
+            profiler.dump_stats(path)
+            print(f"CPU profile written to {path}; read it with python -m pstats {path}", file=sys.stderr)
+    import tracemalloc
+
+    global _fullest
+    tracemalloc.start()
+    _fullest = [0, None, None]
+    path = f'mhi-{name}.mem.txt'
+    try:
+        return run()
+    finally:
+        _memory_checkpoint('exit')
+        held, snapshot, where = _fullest
+        _fullest = None
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        with open(path, 'w') as f:
+            print(f"mhi {name}: peak {peak} bytes allocated, {current} still allocated at the end", file=f)
+            print(f"top {PROFILE_TOP} allocation sites at the fullest checkpoint ({where}, {held} bytes allocated):", file=f)
+            for stat in snapshot.statistics('lineno')[:PROFILE_TOP]:
+                print(stat, file=f)
+        print(f"Memory profile written to {path}", file=sys.stderr)
+
+
 def _dispatch(args):
     _debug(lambda: f"args={args}")
+    options, args = _options(args)
+    if options is None:
+        return
     if len(args) <= 1:
         print(f"Must specify a command.  Valid ones: {CommandList}")
         return
@@ -1068,26 +924,38 @@ def _dispatch(args):
     cmdargs = args[2:]
     _debug(lambda: f"cmdargs={cmdargs}")
     _debug(lambda: f"Commands={Commands}")
-    cmdfunc = Commands.get(cmd, None)
+    cmdfunc = _command(cmd)
     if not cmdfunc:
         print(f"Unknown command {cmd}.  Valid ones: {CommandList}")
         return
     _debug(lambda: f"cmdfunc={cmdfunc}")
+    if '--stats' in options or options.get('--trace'):
+        from . import imapstats
+
+        imapstats.start(options.get('--trace'))
     try:
-        cmdfunc(cmdargs)
+        if '--profile' in options:
+            _profiled(options['--profile'] or 'cpu', cmd, lambda: cmdfunc(cmdargs))
+        else:
+            cmdfunc(cmdargs)
     except IOError:
         pass
     except UsageError:
         print(cmdfunc.__doc__)
         sys.exit(1)
-    config.write()
+    finally:
+        if '--stats' in options or options.get('--trace'):
+            imapstats.stop(report='--stats' in options)
     state.write()
 
+
 def init_config():
     global config, state
+    from .statestore import open_state
+
     cfgdir = os.environ.get('HOME', '')
     config = ConfigObj(infile=f"{cfgdir}/.mhirc", create_empty=True)
-    state = ConfigObj(infile=f"{cfgdir}/.mhistate", create_empty=True)
+    state = open_state(cfgdir)
 
 
 def _cmd_dispatch(args):
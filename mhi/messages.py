@@ -0,0 +1,104 @@
+"""refile, rmm and mr: moving, removing and marking messages by UID
+
+Message numbers are turned into UIDs with the folder's UID map (see
+scancache.py), so none of these needs a SEARCH first.
+"""
+
+from . import main as mhi
+
+
+@mhi.takesFolderArg
+def refile(destfolder, arglist):
+    '''Usage: refile <messageset> +<folder>
+
+    Moves a set of messages from the current folder to a new one.
+    Add -k to keep the originals (making this a 'copy' instead of a 'refile').
+    '''
+    if destfolder is None:
+        print("Error: Destination folder must be specified.")
+        raise mhi.UsageError()
+    srcfolder = mhi.state["folder"]
+    keep = '-k' in arglist
+    if keep:
+        arglist.remove('-k')
+
+    msgset = mhi.msgset_from(arglist) or mhi._cur_msg(srcfolder)
+    mhi._checkMsgset(msgset)
+
+    action = 'copied' if keep else 'refiled'
+    with mhi.Connection() as S:
+        mhi._selectOrCreate(S, destfolder)
+        S.select(srcfolder)
+        m = mhi._uid_map(S, srcfolder)
+        uids = m.uids_for(msgset)
+        uidset = mhi._consolidate(uids).replace('-', ':')
+        caps = S.session.capabilities
+        expunged = None
+        if not uids:
+            pass
+        elif keep:
+            S.uid('COPY', uidset, destfolder, errmsg="Problem with copy:")
+        elif 'MOVE' in caps:
+            # RFC 6851
+            S.uid('MOVE', uidset, destfolder, errmsg="Problem with move:")
+        else:
+            S.uid('COPY', uidset, destfolder, errmsg="Problem with copy:")
+            S.uid('STORE', uidset, '+FLAGS.SILENT', '(\\Deleted)', errmsg="Problem setting deleted flag:")
+            if 'UIDPLUS' in caps:
+                # RFC 4315: only expunge what we just refiled
+                S.uid('EXPUNGE', uidset, errmsg="Problem expunging refiled messages:")
+            else:
+                expunged = S.expunge(errmsg="Problem expunging refiled messages:")
+        if uids and not keep:
+            mhi._expunged(S, srcfolder, m, expunged)
+        print(f"{len(uids)} messages {action} to '{destfolder}'.")
+    print("Done.")
+
+
+@mhi.takesFolderArg
+def rmm(folder, arglist):
+    '''Usage: rmm [+folder] <messageset>
+
+    ie: rmm +INBOX 1
+    ie: rmm 1:5
+
+    Remove the specified messages (or the current message if unspecified)
+    from the specified folder (or the current folder if unspecified).
+    '''
+    folder = mhi.state['folder'] = folder or mhi.state['folder']
+    msgset = mhi.msgset_from(arglist) or mhi._cur_msg(folder)
+    mhi._checkMsgset(msgset)
+    with mhi.Connection(folder) as S:
+        m = mhi._uid_map(S, folder)
+        uids = m.uids_for(msgset)
+        if uids:
+            first = m.seq(uids[0])
+            uidset = mhi._consolidate(uids).replace('-', ':')
+            S.uid('STORE', uidset, '+FLAGS.SILENT', '(\\Deleted)', errmsg="Problem setting deleted flag: ")
+            expunged = None
+            if 'UIDPLUS' in S.session.capabilities:
+                S.uid('EXPUNGE', uidset, errmsg="Problem expunging deleted messages: ")
+            else:
+                expunged = S.expunge(errmsg="Problem expunging deleted messages: ")
+            mhi._expunged(S, folder, m, expunged)
+            # the message after the first one deleted is current now
+            mhi._set_cur(folder, first, m.uid(first), m.uidvalidity)
+        print("Deleted.")
+
+
+@mhi.takesFolderArg
+def mr(folder, arglist):
+    '''Usage: mr [+folder] <messageset>
+
+    Mark the specified messages (or the current message if unspecified)
+    from the specified folder (or the current folder if unspecified) as read.
+    '''
+    folder = mhi.state['folder'] = folder or mhi.state['folder']
+    msgset = mhi.msgset_from(arglist) or mhi._cur_msg(folder)
+    mhi._checkMsgset(msgset)
+    with mhi.Connection(folder) as S:
+        m = mhi._uid_map(S, folder)
+        uids = m.uids_for(msgset)
+        if uids:
+            S.uid('STORE', mhi._consolidate(uids).replace('-', ':'), '+FLAGS.SILENT', '(\\Seen)', errmsg="Problem setting read flag: ")
+            mhi._set_cur(folder, m.seq(uids[0]), uids[0], m.uidvalidity)
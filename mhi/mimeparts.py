@@ -0,0 +1,101 @@
+"""What a message is made of, from its BODYSTRUCTURE
+
+show used to fetch every message whole, so reading three lines of a
+message with a 40MB attachment meant downloading 40MB.  It now fetches
+the BODYSTRUCTURE and header first, then just the parts worth
+displaying (text/plain, or text/html where there's no plain
+alternative), and lists the rest, which `show -part` fetches on request.
+"""
+
+import base64
+import binascii
+import quopri
+from collections import namedtuple
+
+from .response import text
+
+Part = namedtuple('Part', 'section mimetype params encoding size filename shown')
+
+
+def _params(plist):
+    '''{name: value} from a body parameter list'''
+    if not isinstance(plist, list):
+        return {}
+    return {text(k).lower(): text(v) for k, v in zip(plist[::2], plist[1::2])}
+
+
+def _leaf(body, section, displayable):
+    mimetype = f'{text(body[0])}/{text(body[1])}'.lower()
+    params = _params(body[2])
+    # the extension data (and so the disposition) starts later for types
+    # whose basic fields have more in them
+    if mimetype == 'message/rfc822':
+        disp_at = 11
+    elif mimetype.startswith('text/'):
+        disp_at = 9
+    else:
+        disp_at = 8
+    disposition = body[disp_at] if len(body) > disp_at and isinstance(body[disp_at], list) else [None, None]
+    filename = _params(disposition[1]).get('filename') or params.get('name')
+    attachment = str(text(disposition[0]) or '').lower() == 'attachment'
+    shown = displayable and not attachment and mimetype in ('text/plain', 'text/html')
+    return Part(section, mimetype, params, str(text(body[5]) or '7bit').lower(), body[6] or 0, filename, shown)
+
+
+def _walk(body, section, displayable, out):
+    if not isinstance(body[0], list):
+        out.append(_leaf(body, section or '1', displayable))
+        return
+    children = []
+    for child in body:
+        if not isinstance(child, list):
+            break
+        children.append(child)
+    subtype = str(text(body[len(children)]) or '').lower()
+    prefix = f'{section}.' if section else ''
+    chosen = None
+    if subtype == 'alternative':
+        # display the plain text version if there is one, else the last (richest)
+        plain = [c for c in children if not isinstance(c[0], list) and f'{text(c[0])}/{text(c[1])}'.lower() == 'text/plain']
+        chosen = plain[-1] if plain else children[-1]
+    for n, child in enumerate(children, 1):
+        _walk(child, f'{prefix}{n}', displayable and (chosen is None or child is chosen), out)
+
+
+def parts(bodystructure):
+    '''[Part] for each leaf part of a message, in order, given its parsed BODYSTRUCTURE'''
+    out = []
+    _walk(bodystructure, '', True, out)
+    return out
+
+
+def decode(part, data):
+    '''a part's content, undoing its transfer encoding; text parts come back as str'''
+    data = bytes(data)
+    try:
+        if part.encoding == 'base64':
+            data = base64.b64decode(data)
+        elif part.encoding == 'quoted-printable':
+            data = quopri.decodestring(data)
+    except (binascii.Error, ValueError):
+        pass
+    if not part.mimetype.startswith('text/'):
+        return data
+    try:
+        return data.decode(part.params.get('charset') or 'us-ascii', 'replace')
+    except LookupError:
+        return data.decode('utf-8', 'replace')
+
+
+def human_size(size):
+    for unit in ('B', 'K', 'M'):
+        if size < 1024:
+            return f'{size:.0f}{unit}' if unit == 'B' or size >= 10 else f'{size:.1f}{unit}'
+        size /= 1024
+    return f'{size:.1f}G'
+
+
+def describe(part):
+    '''a one-line summary of a part show isn't displaying'''
+    name = f' "{part.filename}"' if part.filename else ''
+    return f'[part {part.section}: {part.mimetype}{name}, {human_size(part.size)}]'
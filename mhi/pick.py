@@ -0,0 +1,81 @@
+"""pick and index: searching a folder, locally if it has a text index"""
+
+import sys
+
+from . import main as mhi
+from .textindex import open_index, text_criteria
+
+
+@mhi.takesFolderArg
+def pick(folder, arglist):
+    '''Usage: pick <search criteria> [+folder]
+
+    Return a message-set that matches the search criteria.
+    Criteria are based on the IMAP spec search string.
+    A summary of the IMAP spec is available by calling 'pick' with --help as its only option.
+    '''
+    if not arglist:
+        raise mhi.UsageError()
+    if len(arglist) == 1 and arglist[0] == "--help":
+        from .pickdocs import PickDocs
+
+        print(PickDocs)
+        sys.exit(1)
+    folder = mhi.state['folder'] = folder or mhi.state['folder']
+    msglist = _pick_local(folder, arglist)
+    if msglist is None:
+        searchstr = '(' + ' '.join(arglist) + ')'
+        with mhi.Connection(folder) as S:
+            data = S.search(None, searchstr, errmsg="Problem with search criteria:")
+            mhi._debug(lambda: f"data: {data!r}")
+        msglist = [int(i) for m in data if m for i in m.split()]
+    print(mhi._consolidate(msglist))
+
+
+def _pick_local(folder, arglist):
+    '''Answer a BODY/TEXT pick from the folder's text index, if it has one;
+    None means ask the server'''
+    criteria = text_criteria(arglist)
+    if not criteria:
+        return None
+    import sqlite3
+
+    try:
+        idx = open_index(folder, create=False)
+    except sqlite3.OperationalError as e:
+        mhi._debug(lambda: f"no text index: {e}")
+        return None
+    if idx is None:
+        return None
+    with mhi.Connection(folder) as S:
+        idx.sync(S)
+    return idx.search(criteria)
+
+
+@mhi.takesFolderArg
+def index(folder, arglist):
+    '''Usage: index [-d] [+folder]
+
+    Build (or bring up to date) a local full-text index of the specified
+    folder, or the current folder if not specified.  pick answers BODY and
+    TEXT searches in indexed folders from the index instead of the server.
+    -d drops the folder's index.
+    '''
+    drop = '-d' in arglist
+    if arglist and arglist != ['-d']:
+        raise mhi.UsageError()
+    folder = folder or mhi.state['folder']
+    import sqlite3
+
+    try:
+        idx = open_index(folder)
+    except sqlite3.OperationalError as e:
+        print(f"Can't index: sqlite has no FTS5 trigram tokenizer ({e})")
+        sys.exit(1)
+    if drop:
+        idx.drop()
+        print(f"Dropped the index of '{folder}'.")
+        return
+    with mhi.Connection(folder) as S:
+        added = idx.sync(S)
+    print(f"Indexed {added} new messages in '{folder}'.")
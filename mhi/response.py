@@ -0,0 +1,110 @@
+"""Parse the untagged response data imaplib hands back, as it hands it back
+
+imaplib returns each untagged response either as a bytes line or, if the
+server sent literals, as a run of (line-up-to-literal, literal) tuples
+followed by the bytes that end the line.  parse() walks those pieces
+directly, so a {n} literal is just another string in the result, and
+strings are returned as memoryview slices of imaplib's buffers.  Nothing
+is decoded (or copied) until a command asks for it with text().
+
+Parsed values are lists, ints, None (for NIL), str (for other atoms, such
+as flags) and memoryviews (for quoted strings and literals).
+"""
+
+import re
+
+_literal = re.compile(rb'\{(\d+)\+?\}$')
+
+_token = re.compile(
+    rb'''[ \r\n\t]*(?:
+        ([()])
+       |"([^"\\]*(?:\\.[^"\\]*)*)"
+       |((?:[^ \r\n\t()"\[]+|\[[^\]]*\])+)
+       |([^ \r\n\t])
+    )''',
+    re.X | re.S,
+)
+
+_unescape = re.compile(rb'\\(.)', re.S)
+
+
+class ParseError(Exception):
+    pass
+
+
+def _atom(atom):
+    if atom.isdigit():
+        return int(atom)
+    if atom.upper() == b'NIL':
+        return None
+    return atom.decode('utf-8', 'replace')
+
+
+def _tokenize(segment, stack):
+    '''add the values in one segment of a response to the lists in stack'''
+    view = memoryview(segment)
+    for m in _token.finditer(segment):
+        paren, string, atom, bad = m.groups()
+        if atom is not None:
+            stack[-1].append(_atom(atom))
+        elif string is not None:
+            if b'\\' in string:
+                stack[-1].append(memoryview(_unescape.sub(rb'\1', string)))
+            else:
+                stack[-1].append(view[m.start(2) : m.end(2)])
+        elif paren == b'(':
+            l = []
+            stack[-1].append(l)
+            stack.append(l)
+        elif paren:
+            if len(stack) == 1:
+                raise ParseError(f'unbalanced ) in {bytes(segment)!r}')
+            stack.pop()
+        elif bad:
+            raise ParseError(f'unexpected {bad!r} in {bytes(segment)!r}')
+
+
+def parse(data):
+    '''yield the list of top level values in each response in data'''
+    stack = [[]]
+    for part in data:
+        if part is None:
+            continue
+        if isinstance(part, tuple):
+            line, literal = part[0], part[1]
+            m = _literal.search(line)
+            _tokenize(line[: m.start()] if m else line, stack)
+            stack[-1].append(memoryview(literal))
+            continue
+        if isinstance(part, str):
+            part = part.encode()
+        _tokenize(part, stack)
+        if len(stack) != 1:
+            raise ParseError(f'unbalanced ( in response ending {bytes(part)!r}')
+        yield stack[0]
+        stack = [[]]
+
+
+def fetch_responses(data):
+    '''(msgnum, {ITEM: value}) for each message in a FETCH response'''
+    for response in parse(data):
+        if len(response) < 2 or not isinstance(response[0], int):
+            continue
+        num, items = response[0], response[1]
+        yield num, {str(k).upper(): v for k, v in zip(items[::2], items[1::2])}
+
+
+def text(value):
+    '''decode a string value; None (NIL) stays None'''
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, int):
+        return str(value)
+    return str(value, 'utf-8', 'replace')
+
+
+def decoded(value):
+    '''value with every string in it decoded'''
+    if isinstance(value, list):
+        return [decoded(v) for v in value]
+    return text(value)
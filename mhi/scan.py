@@ -0,0 +1,95 @@
+"""scan: a line for each message, a window of FETCHes at a time
+
+With scan_cache on (the default), envelopes come from scancache.py and
+only what changed since the last scan is fetched.
+"""
+
+import sys
+import time
+
+from . import main as mhi
+from .response import decoded
+
+
+def _scan_windows(S, ranges, sizer):
+    '''yield lists of (msgnum, envelope, flags), a FETCH at a time'''
+    for window in mhi._windows(ranges, lambda: sizer.size):
+        msgset = mhi._consolidate(window).replace('-', ':')
+        yield [(n, decoded(e['ENVELOPE'][:4]), e['FLAGS']) for n, e in S.fetch_stream(msgset, '(ENVELOPE FLAGS)', sizer=sizer)]
+
+
+# how much of the subject a scan line shows
+SUBJECT_WIDTH = 47
+
+
+def _scan_row(num, cur, envelope, flags):
+    """The scan line for message num, given its ENVELOPE and FLAGS"""
+    env_date, env_subj, env_from, env_sender = envelope[:4]
+    mhi._debug(lambda: f"env_date={env_date}\nenv_from={env_from}\nenv_sender={env_sender}\nflags={flags}\nenv_subj={env_subj}")
+    try:
+        fmt = "%d %b %Y %H:%M:%S"
+        if ',' in env_date:
+            fmt = "%a, " + fmt
+        env_date = ' '.join(str(env_date).split()[: len(fmt.split())])
+        dt = time.strptime(env_date, fmt)
+        outtime = time.strftime("%m/%d", dt)
+    except Exception as e:
+        mhi._debug(lambda: f"strptime exception: {e!r}")
+        outtime = "??/??"
+    if isinstance(env_from, list):
+        outfrom = env_from[0][0]
+        if outfrom is None:
+            outfrom = "%s@%s" % (env_from[0][2], env_from[0][3])
+    else:
+        outfrom = "<Unknown>"
+    if cur == num:
+        status = '>'
+    elif '\\Answered' in flags:
+        status = 'r'
+    elif '\\Seen' in flags:
+        status = ' '
+    elif '\\Recent' in flags:
+        status = 'N'
+    else:
+        status = 'O'
+    subject = "<no subject>" if env_subj is None else env_subj
+    return f'{num:4} {status} {outtime} {outfrom[:18]:<18} ' + subject[:SUBJECT_WIDTH]
+
+
+@mhi.paged
+@mhi.takesFolderArg
+def scan(folder, arglist):
+    '''Usage: scan [+<folder>] [messageset]
+    Show a list of the specified messages (or all if unspecified)
+    in the specified folder, or the current folder if not specified
+    '''
+
+    if len(arglist) > 99:
+        raise mhi.UsageError()
+    # find any folder refs and put together the msgset string
+    folder = mhi.state['folder'] = folder or mhi.state['folder']
+    msgset = mhi.msgset_from(arglist) or "1:*"
+    mhi._checkMsgset(msgset)
+    with mhi.Connection(folder) as S:
+        sizer = mhi.WindowSizer()
+        if mhi.config_flag('scan_cache'):
+            from .scancache import open_cache
+
+            cache = open_cache(folder)
+            cache.sync(S)
+            mhi._follow_cur(folder, cache)
+            windows = cache.envelopes(S, mhi._msgset_ranges(msgset, len(cache.uids)), sizer)
+        else:
+            windows = _scan_windows(S, mhi._msgset_ranges(msgset, S.exists), sizer)
+        try:
+            cur = int(mhi.state[folder + '.cur'])
+        except Exception:
+            cur = None
+        count = 0
+        for window in windows:
+            for num, envelope, flags in window:
+                print(_scan_row(num, cur, envelope, flags))
+                count += 1
+            sys.stdout.flush()
+        if not count:
+            print("No messages.")
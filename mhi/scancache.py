@@ -0,0 +1,236 @@
+"""A local cache of each folder's UIDs, and of envelopes and flags for scan
+
+Envelopes are kept in ~/.mhi/scan.db, keyed by (folder, UID) and
+invalidated wholesale if the folder's UIDVALIDITY changes.  Each scan
+resyncs the cache against the status the server sent back from SELECT:
+
+ * no new messages, no expunges and (with CONDSTORE) an unchanged
+   HIGHESTMODSEQ means nothing else needs to be asked for at all
+ * new messages are found with UID SEARCH UID <old UIDNEXT>:*, and their
+   envelopes fetched when a scan first reaches them, a window at a time
+ * flag changes come from UID FETCH ... (CHANGEDSINCE <modseq>) when the
+   server does CONDSTORE, otherwise from a FLAGS-only fetch of just the
+   messages being scanned, a window at a time as the scan reaches them
+ * expunges are spotted by the message count not adding up, and answered
+   with a UID SEARCH ALL
+
+The UID list doubles as the folder's message number <-> UID map, which
+commands use to turn message sets into UID sets without asking the
+server.  Expunges the server reports to our own commands are applied to
+it directly with expunged().
+"""
+
+import bisect
+import json
+from array import array
+
+from . import main as mhi
+from .response import decoded, fetch_responses
+from .statestore import connect
+
+# bump this whenever what's stored changes shape
+VERSION = 2
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS folders (
+    folder TEXT PRIMARY KEY,
+    uidvalidity INTEGER,
+    uidnext INTEGER,
+    modseq INTEGER,
+    uids BLOB
+);
+CREATE TABLE IF NOT EXISTS envelopes (
+    folder TEXT,
+    uid INTEGER,
+    envelope TEXT,
+    flags TEXT,
+    PRIMARY KEY (folder, uid)
+) WITHOUT ROWID;
+'''
+
+
+def _response(S, code):
+    '''the last value the server sent for an untagged response code, or None'''
+    _, data = S.raw_response(code)
+    if not data or data[-1] is None:
+        return None
+    return int(mhi.tostr(data[-1]).split()[0])
+
+
+def _uidlist(data):
+    return [int(u) for u in mhi.tostr(data[0] or '').split()]
+
+
+class FolderCache:
+    """What is known locally about one folder's messages"""
+
+    def __init__(self, db, folder):
+        self.db = db
+        self.folder = folder
+        row = db.execute('SELECT uidvalidity, uidnext, modseq, uids FROM folders WHERE folder = ?', (folder,)).fetchone()
+        self.uidvalidity, self.uidnext, self.modseq, uids = row or (None, 1, None, b'')
+        self.uids = array('I')
+        self.uids.frombytes(uids or b'')
+        # cached flags of UIDs below this may be out of date; see envelopes()
+        self.stale = 0
+
+    def reset(self, uidvalidity):
+        self.db.execute('DELETE FROM envelopes WHERE folder = ?', (self.folder,))
+        self.uidvalidity, self.uidnext, self.modseq = uidvalidity, 1, None
+        self.uids = array('I')
+        self.save()
+
+    def save(self):
+        self.db.execute(
+            'INSERT OR REPLACE INTO folders VALUES (?, ?, ?, ?, ?)',
+            (self.folder, self.uidvalidity, self.uidnext, self.modseq, self.uids.tobytes()),
+        )
+        self.db.commit()
+
+    def _store(self, hits):
+        '''store a list of (uid, {'ENVELOPE':..., 'FLAGS':...}) pairs, yielding
+        (uid, envelope, flags); whoever gave us hits commits.  Hits are read
+        off the network before any of them is written, so that the write
+        lock isn't held while waiting on the server.'''
+        for uid, items in hits:
+            flags = items['FLAGS']
+            if 'ENVELOPE' in items:
+                envelope = decoded(items['ENVELOPE'])
+                self.db.execute(
+                    'INSERT OR REPLACE INTO envelopes VALUES (?, ?, ?, ?)',
+                    (self.folder, uid, json.dumps(envelope), json.dumps(flags)),
+                )
+                yield uid, envelope, flags
+            else:
+                self.db.execute('UPDATE envelopes SET flags = ? WHERE folder = ? AND uid = ?', (json.dumps(flags), self.folder, uid))
+
+    def sync_uids(self, S):
+        '''bring the folder's UID list up to date with the folder S has
+        selected; returns the status S's SELECT reported, for sync()'''
+        exists = _response(S, 'EXISTS') or 0
+        uidvalidity = _response(S, 'UIDVALIDITY')
+        uidnext = _response(S, 'UIDNEXT')
+        modseq = _response(S, 'HIGHESTMODSEQ')
+        if uidvalidity is None or uidvalidity != self.uidvalidity:
+            self.reset(uidvalidity)
+        unchanged = uidnext is not None and uidnext == self.uidnext and exists == len(self.uids)
+        if not unchanged:
+            new = []
+            if uidnext is None or uidnext != self.uidnext:
+                found = S.uid('SEARCH', None, f'UID {self.uidnext}:*', errmsg="Problem with search:")
+                new = [u for u in _uidlist(found) if u >= self.uidnext]
+            if len(self.uids) + len(new) == exists:
+                self.uids.extend(sorted(new))
+            else:
+                # something was expunged
+                uids = _uidlist(S.uid('SEARCH', None, 'ALL', errmsg="Problem with search:"))
+                gone = set(self.uids) - set(uids)
+                self.db.executemany('DELETE FROM envelopes WHERE folder = ? AND uid = ?', ((self.folder, u) for u in gone))
+                self.uids = array('I', uids)
+            self.uidnext = uidnext or (self.uids[-1] + 1 if self.uids else 1)
+            self.save()
+        return unchanged, modseq
+
+    def sync(self, S):
+        '''bring the folder's UID list up to date with the folder S has
+        selected, and, with CONDSTORE, the cached flags; envelopes for new
+        messages, and flags without CONDSTORE, are fetched by envelopes()'''
+        uidvalidity, uidnext = self.uidvalidity, self.uidnext
+        unchanged, modseq = self.sync_uids(S)
+        if unchanged and modseq is not None and modseq == self.modseq:
+            mhi._debug(lambda: f"scan cache for {self.folder} is current")
+            return
+        # the messages that were here last time, whose flags may have changed
+        known = bisect.bisect_left(self.uids, uidnext) if self.uidvalidity == uidvalidity else 0
+        if known and modseq is not None and self.modseq is not None:
+            changed = S.uid('FETCH', f'1:{self.uidnext - 1}', f'(UID FLAGS) (CHANGEDSINCE {self.modseq})', errmsg="Problem with fetch:")
+            for _ in self._store(_uid_items(fetch_responses(changed))):
+                pass
+        elif known and modseq is None:
+            # there's no asking what changed, so the flags of what's shown
+            # are refetched as it's shown
+            self.stale = uidnext
+        elif known:
+            # everything's flags, once, to count modseqs from
+            sizer = mhi.WindowSizer(size=1000, max_size=50000)
+            for window in mhi._windows([(1, known)], lambda: sizer.size):
+                uidset = mhi._consolidate([self.uids[n - 1] for n in window]).replace('-', ':')
+                for _ in self._store(list(_uid_items(S.fetch_stream(uidset, '(UID FLAGS)', uid=True, sizer=sizer)))):
+                    pass
+                self.db.commit()
+        self.modseq = modseq
+        self.save()
+
+    def uid(self, seq):
+        '''the UID of message number seq, or None if there's no such message'''
+        return self.uids[seq - 1] if 1 <= seq <= len(self.uids) else None
+
+    def seq(self, uid):
+        '''the message number of uid, or None if it isn't in the folder'''
+        i = bisect.bisect_left(self.uids, uid)
+        return i + 1 if i < len(self.uids) and self.uids[i] == uid else None
+
+    def seq_from(self, uid):
+        '''the message number of uid or, if it's gone, of the first message
+        after it; None if there's no such message'''
+        i = bisect.bisect_left(self.uids, uid)
+        return i + 1 if i < len(self.uids) else None
+
+    def uids_for(self, msgset):
+        '''the UIDs of the messages msgset refers to'''
+        return [self.uids[n - 1] for start, end in mhi._msgset_ranges(msgset, len(self.uids)) for n in range(start, end + 1)]
+
+    def expunged(self, seqs):
+        '''forget the messages the server said it expunged, in the order it said so'''
+        for n in seqs:
+            if 1 <= n <= len(self.uids):
+                self.db.execute('DELETE FROM envelopes WHERE folder = ? AND uid = ?', (self.folder, self.uids[n - 1]))
+                del self.uids[n - 1]
+        self.save()
+
+    def envelopes(self, S, ranges, sizer):
+        '''yield lists of (seq, envelope, flags) for the sequence number ranges,
+        in order, fetching (in windows sized by sizer) any envelopes that
+        aren't cached yet, and the flags of cached ones that may be stale'''
+        fetching = True
+        for seqs in mhi._windows(ranges, lambda: sizer.size if fetching else 1000):
+            uids = [self.uids[s - 1] for s in seqs]
+            rows = self.db.execute(
+                'SELECT uid, envelope, flags FROM envelopes WHERE folder = ? AND uid BETWEEN ? AND ?', (self.folder, uids[0], uids[-1])
+            )
+            cached = {uid: (json.loads(envelope), json.loads(flags)) for uid, envelope, flags in rows}
+            missing = [u for u in uids if u not in cached]
+            stale = [u for u in uids if u in cached and u < self.stale]
+            fetching = bool(missing or stale)
+            if stale:
+                uidset = mhi._consolidate(stale).replace('-', ':')
+                hits = list(_uid_items(S.fetch_stream(uidset, '(UID FLAGS)', uid=True, sizer=sizer)))
+                for _ in self._store(hits):
+                    pass
+                self.db.commit()
+                for uid, items in hits:
+                    if uid in cached:
+                        cached[uid] = (cached[uid][0], items['FLAGS'])
+            if missing:
+                uidset = mhi._consolidate(missing).replace('-', ':')
+                hits = S.fetch_stream(uidset, '(UID ENVELOPE FLAGS)', uid=True, sizer=sizer)
+                for uid, envelope, flags in self._store(list(_uid_items(hits))):
+                    cached[uid] = (envelope, flags)
+                self.db.commit()
+            yield [(s, *cached[u]) for s, u in zip(seqs, uids) if u in cached]
+
+
+def _uid_items(responses):
+    '''(uid, {item: value}) for each parsed (seq, {item: value}) FETCH response'''
+    for seq, items in responses:
+        if 'UID' in items:
+            yield int(items['UID']), items
+
+
+def open_cache(folder):
+    db = connect('scan.db')
+    if db.execute('PRAGMA user_version').fetchone()[0] != VERSION:
+        db.executescript('DROP TABLE IF EXISTS folders; DROP TABLE IF EXISTS envelopes;')
+        db.execute(f'PRAGMA user_version = {VERSION}')
+    db.executescript(SCHEMA)
+    return FolderCache(db, folder)
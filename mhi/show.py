@@ -0,0 +1,319 @@
+"""show, next and prev: displaying messages, from the message cache when it can
+
+Only the header and text parts of a message are fetched to show it;
+whatever is fetched goes in the message cache (bodycache.py), along with
+the messages either side of it, so that next and prev can be answered
+locally.
+"""
+
+import json
+import sys
+import time
+
+from . import main as mhi
+from .bodycache import open_bodies
+from .mimeparts import decode, describe, parts
+from .response import text
+from .scancache import open_cache
+
+
+def _cached_messages(bodies, folder, m, msgset):
+    '''[(msgnum, message bytes)] for the messages in msgset from the message
+    cache, looking them up in the UID map m, or None if any aren't there'''
+    cached = [(n, bodies.get(folder, m.uidvalidity, m.uid(n), ['RFC822'])) for n in mhi._expand_msgset(msgset, len(m.uids))]
+    if cached and all(items for _, items in cached):
+        return [(n, items['RFC822']) for n, items in cached]
+    return None
+
+
+def _get_messages(folder, msgset):
+    '''[(msgnum, message bytes)] for the messages in msgset'''
+    bodies = open_bodies()
+    if bodies and not mhi._mhid_running():
+        # not worth connecting just to check the UID map
+        cached = _cached_messages(bodies, folder, open_cache(folder), msgset)
+        if cached:
+            return cached
+    with mhi.Connection(folder) as S:
+        if bodies:
+            cached = _cached_messages(bodies, folder, mhi._uid_map(S, folder), msgset)
+            if cached:
+                return cached
+        messages = []
+        for num, items in S.fetch_stream(msgset, '(UID RFC822)', errmsg="Problem fetching messages:"):
+            mhi._debug(lambda: f"Data from message {num!r} : {items!r}")
+            messages.append((num, bytes(items['RFC822'])))
+            if bodies and 'UID' in items and S.uidvalidity is not None:
+                bodies.put(folder, S.uidvalidity, int(items['UID']), {'RFC822': items['RFC822']})
+    return messages
+
+
+def _show_part(folder, num, items, section):
+    """print one part of a message, or write it out raw if it isn't text"""
+    found = [p for p in parts(items['BODYSTRUCTURE']) if p.section == section]
+    if not found or items.get(f'BODY[{section}]') is None:
+        print(f"Message {folder}:{num} has no part {section}.")
+        return
+    content = decode(found[0], items[f'BODY[{section}]'])
+    if isinstance(content, str):
+        print(content)
+    elif sys.stdout.isatty():
+        print(f"{describe(found[0])} isn't text; redirect show's output to save it.")
+    else:
+        sys.stdout.flush()
+        sys.stdout.buffer.write(content)
+
+
+def _show_message(folder, num, items):
+    """print a message's header and text parts, and list its other parts"""
+    print(f"(Message {folder}:{num})\n")
+    print(str(bytes(items['BODY[HEADER]']), 'utf-8', 'replace').replace('\r\n', '\n').rstrip('\n') + '\n')
+    for p in parts(items['BODYSTRUCTURE']):
+        # the server sends NIL for a part it can't find
+        content = items.get(f'BODY[{p.section}]')
+        print(decode(p, content) if p.shown and content is not None else describe(p))
+
+
+def _cached_items(bodies, folder, uidvalidity, uid, part):
+    """what _show needs of a message, from the message cache, or None"""
+    items = bodies.get(folder, uidvalidity, uid, ['BODYSTRUCTURE', 'BODY[HEADER]' if part is None else f'BODY[{part}]'])
+    if items is None:
+        return None
+    items['BODYSTRUCTURE'] = json.loads(items['BODYSTRUCTURE'])
+    if part is None:
+        shown = [f'BODY[{p.section}]' for p in parts(items['BODYSTRUCTURE']) if p.shown]
+        texts = bodies.get(folder, uidvalidity, uid, shown) if shown else {}
+        if texts is None:
+            return None
+        items.update(texts)
+    return items
+
+
+def _show_cached(folder, msgset, part, bodies, m):
+    """show msgset from the message cache, if everything needed is there,
+    looking message numbers up in the UID map m; returns the message
+    numbers shown, or None if it couldn't"""
+    nums = mhi._expand_msgset(msgset, len(m.uids)) if m.uidvalidity is not None else []
+    found = []
+    for num in nums:
+        items = _cached_items(bodies, folder, m.uidvalidity, m.uid(num), part)
+        if items is None:
+            return None
+        found.append((num, items))
+    if not found:
+        return None
+    for num, items in found:
+        mhi._set_cur(folder, num, m.uid(num), m.uidvalidity)
+        if part is not None:
+            _show_part(folder, num, items, part)
+        else:
+            _show_message(folder, num, items)
+    mhi._debug(lambda: f"showed {msgset} from the message cache")
+    return [num for num, _ in found]
+
+
+def _cache_items(bodies, folder, uidvalidity, items, peeked=False):
+    """put what was fetched of a message in the message cache"""
+    if bodies is None or 'UID' not in items or uidvalidity is None:
+        return
+    fetched = {k: v for k, v in items.items() if k.startswith('BODY[') and v is not None}
+    fetched['BODYSTRUCTURE'] = json.dumps(items['BODYSTRUCTURE'], default=text).encode()
+    bodies.put(folder, uidvalidity, int(items['UID']), fetched, peeked)
+
+
+def _with_shown_parts(S, messages):
+    """Fetch the parts show displays into each of messages, a list of (num,
+    items) with UID and BODYSTRUCTURE, with one UID FETCH for all the
+    messages that want the same parts.  Yields (num, items) in order, each
+    as soon as it and the messages before it have everything."""
+    by_uid = {int(items['UID']): items for _, items in messages}
+    complete = set()
+    groups = {}
+    for uid, items in by_uid.items():
+        sections = tuple(p.section for p in parts(items['BODYSTRUCTURE']) if p.shown)
+        if sections:
+            groups.setdefault(sections, []).append(uid)
+        else:
+            complete.add(uid)
+    done = 0
+
+    def ready():
+        nonlocal done
+        while done < len(messages) and int(messages[done][1]['UID']) in complete:
+            done += 1
+            yield messages[done - 1]
+
+    yield from ready()
+    for sections, uids in groups.items():
+        wanted = ' '.join(f'BODY.PEEK[{s}]' for s in sections)
+        for _, texts in S.fetch_stream(mhi._consolidate(sorted(uids)).replace('-', ':'), f'(UID {wanted})', uid=True):
+            uid = int(texts['UID'])
+            by_uid[uid].update(texts)
+            complete.add(uid)
+            yield from ready()
+    # anything the server didn't send parts for (expunged meanwhile, say)
+    yield from messages[done:]
+
+
+# kilobytes of header and text, at most, that are prefetched of a message
+PREFETCH_KB = 256
+
+
+def _prefetch(S, folder, m, bodies, around):
+    """Fetch the messages either side of message number around into the
+    message cache, so that next and prev needn't wait for the server.
+    BODY.PEEK leaves them unseen until they're actually shown."""
+    cap = int(float(mhi.config.get('prefetch_size', PREFETCH_KB)) * 1024)
+    uids = [m.uid(n) for n in (around + 1, around - 1)]
+    uids = [u for u in uids if u is not None and bodies.get(folder, m.uidvalidity, u, ['BODYSTRUCTURE', 'BODY[HEADER]']) is None]
+    if cap <= 0 or not uids:
+        return
+    start = time.monotonic()
+    found = [
+        (num, items)
+        for num, items in S.fetch_stream(mhi._consolidate(sorted(uids)).replace('-', ':'), '(UID BODYSTRUCTURE BODY.PEEK[HEADER])', uid=True)
+        if len(items['BODY[HEADER]']) + sum(p.size for p in parts(items['BODYSTRUCTURE']) if p.shown) <= cap
+    ]
+    for _, items in _with_shown_parts(S, found):
+        _cache_items(bodies, folder, S.uidvalidity, items, peeked=True)
+    mhi._debug(lambda: f"prefetching UIDs {uids} took {time.monotonic() - start:.3f}s")
+
+
+def _mark_seen(S, folder, m, bodies, peeked, around):
+    """mark the prefetched messages peeked (UIDs) \\Seen, now that they've
+    been shown, as fetching them would have; and look further ahead"""
+    S.uid('STORE', mhi._consolidate(peeked).replace('-', ':'), '+FLAGS.SILENT', '(\\Seen)', errmsg="Problem setting read flag: ")
+    bodies.unpeek(folder, m.uidvalidity, peeked)
+    _prefetch(S, folder, m, bodies, around)
+
+
+def _seen_after_showing(S, folder, bodies, uidvalidity, shown):
+    """Having shown messages from the message cache by the UID map as it
+    was, bring the map up to date, say if any of shown (a list of (num,
+    UID)) weren't where it said, and mark the prefetched ones \\Seen"""
+    m = mhi._uid_map(S, folder)
+    if m.uidvalidity != uidvalidity:
+        print(f"({folder} was renumbered on the server; what was shown may not have been message {shown[0][0]}.)", file=sys.stderr)
+        return
+    for num, uid in shown:
+        now = m.seq(uid)
+        if now is None:
+            print(f"(Message {folder}:{num}, shown from the message cache, has since been removed.)", file=sys.stderr)
+        elif now != num:
+            print(f"(Message {folder}:{num}, shown from the message cache, is message {now} now.)", file=sys.stderr)
+    peeked = [uid for uid in bodies.peeked(folder, uidvalidity, [uid for _, uid in shown]) if m.seq(uid)]
+    if peeked:
+        _mark_seen(S, folder, m, bodies, peeked, m.seq(shown[-1][1]) or shown[-1][0])
+
+
+def _show(folder, msgset, part=None):
+    '''common code for show/next/prev
+    updates folder's cur pointer
+    '''
+    bodies = open_bodies()
+    if bodies and not mhi._mhid_running():
+        # not worth connecting just to check the UID map first: show what's
+        # cached, and only then connect, if there's something to tell the
+        # server (that prefetched messages have been seen)
+        m = open_cache(folder)
+        nums = _show_cached(folder, msgset, part, bodies, m)
+        if nums:
+            shown = [(n, m.uid(n)) for n in nums]
+            if bodies.peeked(folder, m.uidvalidity, [uid for _, uid in shown]):
+                sys.stdout.flush()
+                with mhi.Connection(folder) as S:
+                    _seen_after_showing(S, folder, bodies, m.uidvalidity, shown)
+            return
+    with mhi.Connection(folder) as S:
+        # current, so that what's cached is shown for the right numbers, and
+        # so that next time can be served locally
+        m = mhi._uid_map(S, folder) if bodies else None
+        nums = bodies and _show_cached(folder, msgset, part, bodies, m)
+        if nums:
+            peeked = bodies.peeked(folder, m.uidvalidity, [m.uid(n) for n in nums])
+            if peeked:
+                sys.stdout.flush()
+                _mark_seen(S, folder, m, bodies, peeked, nums[-1])
+            return
+        if part is not None:
+            for num, items in S.fetch_stream(msgset, f'(UID BODYSTRUCTURE BODY[{part}])'):
+                mhi._set_cur(folder, int(num), items.get('UID'), S.uidvalidity)
+                _cache_items(bodies, folder, S.uidvalidity, items)
+                _show_part(folder, num, items, part)
+            return
+        # a window at a time, so the first messages show while later ones
+        # are still to come: the structure and header first (which marks the
+        # message \Seen, as fetching it whole did), then only the parts that
+        # get displayed
+        sizer = mhi.WindowSizer()
+        last = None
+        for window in mhi._windows(mhi._msgset_ranges(msgset, S.exists), lambda: sizer.size):
+            window_set = mhi._consolidate(window).replace('-', ':')
+            messages = list(S.fetch_stream(window_set, '(UID BODYSTRUCTURE BODY[HEADER])', sizer=sizer))
+            for num, items in _with_shown_parts(S, messages):
+                mhi._debug(lambda: f"data for {num!r} is: {items!r}")
+                mhi._set_cur(folder, int(num), items.get('UID'), S.uidvalidity)
+                _cache_items(bodies, folder, S.uidvalidity, items)
+                _show_message(folder, num, items)
+                sys.stdout.flush()
+                last = num
+        if bodies and last is not None:
+            _prefetch(S, folder, m, bodies, last)
+
+
+@mhi.paged
+def _show_paged(folder, msgset):
+    '''_show whole messages, through the pager'''
+    _show(folder, msgset)
+
+
+@mhi.takesFolderArg
+def show(folder, arglist):
+    '''Usage:  show [-part <n>] [<messageset>]
+
+    Show the specified messages, or the current message if none specified.
+    Only text parts are fetched and shown; the others are listed, and
+    -part fetches one of them (write it to a file with show -part 2 > file).
+    '''
+    part = None
+    if arglist[:1] == ['-part']:
+        if len(arglist) < 2 or not all(n.isdigit() for n in arglist[1].split('.')):
+            raise mhi.UsageError()
+        part, arglist = arglist[1], arglist[2:]
+    folder = mhi.state['folder'] = folder if folder else mhi.state['folder']
+    msgset = mhi.msgset_from(arglist) or mhi._cur_msg(folder)
+    mhi._checkMsgset(msgset)
+    if part is None:
+        _show_paged(folder, msgset)
+    else:
+        # not through the pager, since a part that isn't text is written out as it is
+        _show(folder, msgset, part)
+
+
+@mhi.takesFolderArg
+def next(folder, arglist):
+    '''Usage: next [+<folder>]
+
+    Show the next message in the specified folder, or the current folder if not specified
+    '''
+    # TODO: needs better bounds checking
+    folder = mhi.state['folder'] = folder or mhi.state['folder']
+    try:
+        cur = int(mhi.state[folder + '.cur']) + 1
+    except KeyError:
+        cur = 1
+    _show_paged(folder, str(cur))
+
+
+@mhi.takesFolderArg
+def prev(folder, arglist):
+    '''Usage: prev [+<folder>]
+    Show the previous message in the specified folder, or the current folder if not specified
+    '''
+    # TODO: needs better bounds checking
+    folder = mhi.state['folder'] = folder or mhi.state['folder']
+    try:
+        cur = int(mhi.state[folder + '.cur']) - 1
+    except KeyError:
+        cur = 1
+    _show_paged(folder, str(cur))
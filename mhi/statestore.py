@@ -0,0 +1,147 @@
+"""Where mhi keeps its state: the current folder and each folder's current message
+
+State used to be ~/.mhistate, a ConfigObj file that was read in full at
+the start of every command and rewritten in full at the end of it, even
+when nothing had changed.  It now lives in ~/.mhi/state.db, one row per
+key: keys are looked up as they're asked for, and write() saves just the
+keys that were changed, in one transaction.  An existing ~/.mhistate is
+copied in the first time the store is opened.
+
+Several mhi commands can run at once (say a scan in one folder and an mr
+in another).  Since each command writes back only the keys it changed,
+and every folder's keys are rows of their own, commands working in
+different folders never overwrite each other's .cur.  The database is in
+WAL mode, so reading never waits for a writer, and a write holds the
+lock only for the few upserts of one write().  The caches beside it in
+~/.mhi/ are opened the same way, by connect().
+
+The database isn't opened until a key is first looked up, so loading the
+config doesn't load sqlite3 too.
+"""
+
+import os
+
+from . import main as mhi
+
+# bump this whenever what's stored changes shape
+VERSION = 1
+
+# seconds to wait for another command's write() to finish
+BUSY_TIMEOUT = 10
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+) WITHOUT ROWID;
+'''
+
+
+class StateStore:
+    """A dict-ish view of the state table that remembers what it changed
+
+    Values are stored as strings, as they were in .mhistate.
+    """
+
+    def __init__(self, home):
+        self.home = home
+        self._db = None
+        self.cache = {}
+        self.dirty = set()
+
+    @property
+    def db(self):
+        if self._db is None:
+            self._db = _open_db(self.home)
+        return self._db
+
+    def _load(self, key):
+        if key not in self.cache:
+            row = self.db.execute('SELECT value FROM state WHERE key = ?', (key,)).fetchone()
+            self.cache[key] = row[0] if row else None
+        return self.cache[key]
+
+    def __getitem__(self, key):
+        value = self._load(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        value = self._load(key)
+        return default if value is None else value
+
+    def __contains__(self, key):
+        return self._load(key) is not None
+
+    def __setitem__(self, key, value):
+        value = str(value)
+        if self._load(key) != value:
+            self.cache[key] = value
+            self.dirty.add(key)
+
+    def __delitem__(self, key):
+        if self._load(key) is None:
+            raise KeyError(key)
+        self.cache[key] = None
+        self.dirty.add(key)
+
+    def write(self):
+        '''save whatever has been changed'''
+        if not self.dirty:
+            return
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            for key in self.dirty:
+                if self.cache[key] is None:
+                    self.db.execute('DELETE FROM state WHERE key = ?', (key,))
+                else:
+                    self.db.execute('INSERT OR REPLACE INTO state VALUES (?, ?)', (key, self.cache[key]))
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+        self.db.execute('COMMIT')
+        self.dirty.clear()
+
+
+def _migrate(db, oldfile):
+    '''copy everything in an old ConfigObj state file into db'''
+    from configobj import ConfigObj
+
+    old = ConfigObj(infile=oldfile)
+    db.executemany('INSERT OR REPLACE INTO state VALUES (?, ?)', ((k, str(v)) for k, v in old.items()))
+    mhi._debug(lambda: f"copied {len(old)} keys from {oldfile}")
+
+
+def connect(name, **kwargs):
+    '''a connection to the database ~/.mhi/name, in WAL mode and waiting up
+    to BUSY_TIMEOUT for other commands' writes; kwargs go to sqlite3.connect'''
+    import sqlite3
+
+    db = sqlite3.connect(str(mhi.mhi_dir() / name), timeout=BUSY_TIMEOUT, **kwargs)
+    if db.execute('PRAGMA journal_mode').fetchone()[0] != 'wal':
+        db.execute('PRAGMA journal_mode = WAL')
+    db.execute('PRAGMA synchronous = NORMAL')
+    return db
+
+
+def _open_db(home):
+    '''state.db, created (and .mhistate in home copied in) if need be'''
+    # transactions are begun explicitly, so that writes can take the lock up front
+    db = connect('state.db', isolation_level=None)
+    if db.execute('PRAGMA user_version').fetchone()[0] != VERSION:
+        db.execute('BEGIN IMMEDIATE')
+        # another command may have got here first
+        if db.execute('PRAGMA user_version').fetchone()[0] != VERSION:
+            db.execute(SCHEMA)
+            oldfile = os.path.join(home, '.mhistate')
+            if os.path.exists(oldfile):
+                _migrate(db, oldfile)
+            db.execute(f'PRAGMA user_version = {VERSION}')
+        db.execute('COMMIT')
+    return db
+
+
+def open_state(home):
+    '''the StateStore for the user whose home directory is home'''
+    return StateStore(home)
@@ -0,0 +1,215 @@
+"""A local full-text index of folders, for pick
+
+`mhi index +folder` fetches every message in the folder (with BODY.PEEK,
+so nothing gets marked \\Seen) and puts its header and text parts in an
+SQLite FTS5 table in ~/.mhi/text.db, using the trigram tokenizer so that
+any substring can be looked up, as IMAP SEARCH expects.  After that,
+pick brings the folder's index up to date by UID the same way the scan
+cache does (only messages past the old UIDNEXT are fetched, expunged
+ones are dropped) and answers BODY and TEXT searches itself.
+"""
+
+import bisect
+import re
+from array import array
+
+from . import main as mhi
+from .scancache import _response, _uidlist
+from .statestore import connect
+
+# bump this whenever what's stored changes shape
+VERSION = 1
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS folders (
+    folder TEXT PRIMARY KEY,
+    uidvalidity INTEGER,
+    uidnext INTEGER,
+    uids BLOB
+);
+CREATE TABLE IF NOT EXISTS docs (
+    id INTEGER PRIMARY KEY,
+    folder TEXT,
+    uid INTEGER,
+    UNIQUE (folder, uid)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS text USING fts5(header, body, tokenize = 'trigram');
+'''
+
+_criterion = re.compile(r'\s*(?:"((?:[^"\\]|\\.)*)"|([^\s"]+))')
+
+# what each search key looks in
+_COLUMNS = {'BODY': ('body',), 'TEXT': ('header', 'body')}
+
+
+def text_criteria(arglist):
+    '''[(key, string)] if the pick criteria are nothing but BODY and TEXT
+    searches (which are ANDed together), otherwise None'''
+    s = ' '.join(arglist).strip()
+    if s.startswith('(') and s.endswith(')'):
+        s = s[1:-1]
+    tokens = []
+    pos = 0
+    while pos < len(s.rstrip()):
+        m = _criterion.match(s, pos)
+        if not m:
+            return None
+        quoted, atom = m.groups()
+        tokens.append(re.sub(r'\\(.)', r'\1', quoted) if quoted is not None else atom)
+        pos = m.end()
+    if not tokens or len(tokens) % 2:
+        return None
+    keys = [k.upper() for k in tokens[::2]]
+    if any(k not in _COLUMNS for k in keys):
+        return None
+    return list(zip(keys, tokens[1::2]))
+
+
+def _message_text(raw):
+    '''(header, body) text of a message, body being its decoded text parts'''
+    # only syncing needs email, not every pick
+    import email
+    import email.policy
+
+    msg = email.message_from_bytes(raw, policy=email.policy.default)
+    header = '\n'.join(f'{k}: {v}' for k, v in msg.items())
+    parts = []
+    for part in msg.walk():
+        if part.get_content_maintype() != 'text' or part.is_attachment():
+            continue
+        try:
+            parts.append(part.get_content())
+        except (LookupError, ValueError):
+            parts.append(str(part.get_payload(decode=True) or b'', 'latin-1'))
+    return header, '\n'.join(parts)
+
+
+def _phrase(s):
+    return '"' + s.replace('"', '""') + '"'
+
+
+class FolderIndex:
+    """The index of one folder's messages"""
+
+    def __init__(self, db, folder):
+        self.db = db
+        self.folder = folder
+        row = db.execute('SELECT uidvalidity, uidnext, uids FROM folders WHERE folder = ?', (folder,)).fetchone()
+        self.indexed = row is not None
+        self.uidvalidity, self.uidnext, uids = row or (None, 1, b'')
+        self.uids = array('I')
+        self.uids.frombytes(uids or b'')
+
+    def _delete(self, uids):
+        for uid in uids:
+            row = self.db.execute('SELECT id FROM docs WHERE folder = ? AND uid = ?', (self.folder, uid)).fetchone()
+            if row:
+                self.db.execute('DELETE FROM text WHERE rowid = ?', row)
+                self.db.execute('DELETE FROM docs WHERE id = ?', row)
+
+    def drop(self):
+        self._delete(self.uids)
+        self.db.execute('DELETE FROM folders WHERE folder = ?', (self.folder,))
+        self.db.commit()
+        self.indexed = False
+
+    def save(self):
+        self.db.execute(
+            'INSERT OR REPLACE INTO folders VALUES (?, ?, ?, ?)',
+            (self.folder, self.uidvalidity, self.uidnext, self.uids.tobytes()),
+        )
+        self.db.commit()
+        self.indexed = True
+
+    def _add(self, uid, raw):
+        header, body = _message_text(raw)
+        self._delete([uid])
+        cursor = self.db.execute('INSERT INTO docs (folder, uid) VALUES (?, ?)', (self.folder, uid))
+        self.db.execute('INSERT INTO text (rowid, header, body) VALUES (?, ?, ?)', (cursor.lastrowid, header, body))
+
+    def sync(self, S):
+        '''index whatever has arrived in the folder S has selected since the
+        last sync, and forget whatever has been expunged; returns how many
+        messages were added'''
+        exists = _response(S, 'EXISTS') or 0
+        uidvalidity = _response(S, 'UIDVALIDITY')
+        uidnext = _response(S, 'UIDNEXT')
+        if uidvalidity is None or uidvalidity != self.uidvalidity:
+            self._delete(self.uids)
+            self.db.commit()
+            self.uidvalidity, self.uidnext, self.uids = uidvalidity, 1, array('I')
+        if uidnext is not None and uidnext == self.uidnext and exists == len(self.uids):
+            mhi._debug(lambda: f"text index for {self.folder} is current")
+            return 0
+        new = []
+        if uidnext is None or uidnext != self.uidnext:
+            found = S.uid('SEARCH', None, f'UID {self.uidnext}:*', errmsg="Problem with search:")
+            new = sorted(u for u in _uidlist(found) if u >= self.uidnext)
+        uids = list(self.uids) + new
+        if len(uids) != exists:
+            # something was expunged
+            uids = _uidlist(S.uid('SEARCH', None, 'ALL', errmsg="Problem with search:"))
+            self._delete(set(self.uids) - set(uids))
+            self.db.commit()
+        sizer = mhi.WindowSizer(size=10)
+        for window in mhi._windows([(1, len(new))], lambda: sizer.size):
+            uidset = mhi._consolidate([new[i - 1] for i in window]).replace('-', ':')
+            # all of the window, before the write lock is taken for any of it
+            hits = S.fetch_stream(uidset, '(UID BODY.PEEK[])', uid=True, sizer=sizer)
+            fetched = [(int(items['UID']), bytes(items['BODY[]'])) for _, items in hits if 'UID' in items]
+            for uid, raw in fetched:
+                self._add(uid, raw)
+            self.db.commit()
+        self.uids = array('I', uids)
+        self.uidnext = uidnext or (uids[-1] + 1 if uids else 1)
+        self.save()
+        return len(new)
+
+    def search(self, criteria):
+        '''the sequence numbers of the messages matching all of criteria'''
+        # trigrams find any substring of 3 or more characters; shorter
+        # ones have to be looked for the slow way
+        phrases, where, args = [], [], []
+        for key, s in criteria:
+            columns = _COLUMNS[key]
+            if len(s) >= 3:
+                phrases.append(f'{{{" ".join(columns)}}} : {_phrase(s)}')
+            else:
+                where.append('(' + ' OR '.join(f'instr(lower(text.{c}), lower(?))' for c in columns) + ')')
+                args.extend(s for _ in columns)
+        if phrases:
+            where.insert(0, 'text MATCH ?')
+            args.insert(0, ' AND '.join(phrases))
+        rows = self.db.execute(
+            f'SELECT docs.uid FROM text CROSS JOIN docs ON docs.id = text.rowid WHERE {" AND ".join(where)} AND docs.folder = ?',
+            args + [self.folder],
+        )
+        found = []
+        for (uid,) in rows:
+            i = bisect.bisect_left(self.uids, uid)
+            if i < len(self.uids) and self.uids[i] == uid:
+                found.append(i + 1)
+        return sorted(found)
+
+
+def open_index(folder, create=True):
+    '''the FolderIndex for folder; raises sqlite3.OperationalError if this
+    sqlite doesn't have FTS5 with the trigram tokenizer.  Unless create is
+    true, text.db is left as it is (or as it isn't), and None is returned
+    if folder has no index in it.'''
+    if not create and not (mhi.mhi_dir() / 'text.db').exists():
+        return None
+    db = connect('text.db')
+    if db.execute('PRAGMA user_version').fetchone()[0] != VERSION:
+        if not create:
+            db.close()
+            return None
+        db.executescript('DROP TABLE IF EXISTS folders; DROP TABLE IF EXISTS docs; DROP TABLE IF EXISTS text;')
+        db.execute(f'PRAGMA user_version = {VERSION}')
+    if create:
+        db.executescript(SCHEMA)
+    index = FolderIndex(db, folder)
+    if not (create or index.indexed):
+        db.close()
+        return None
+    return index
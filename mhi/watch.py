@@ -0,0 +1,69 @@
+"""watch: report messages arriving and leaving, with IDLE (and NOTIFY)"""
+
+import sys
+import time
+from contextlib import closing
+
+from . import main as mhi
+from .response import parse, text
+
+
+# RFC 2177 has servers drop clients that IDLE for more than 30 minutes
+IDLE_RENEW = 28 * 60
+
+WATCH_EVENTS = 'MessageNew MessageExpunge'
+
+
+def _watch_events(folder, name, data, counts):
+    """Lines describing one kind of untagged response received while
+    watching folder; counts holds each folder's message count, and is
+    kept up to date"""
+    lines = []
+    if name == 'EXISTS':
+        exists = int(mhi.tostr(data[-1]))
+        if exists > counts[folder]:
+            new = exists - counts[folder]
+            lines.append(f"{mhi.folder_name(folder)}: {new} new message{'s' if new > 1 else ''}, {exists} in all")
+        counts[folder] = exists
+    elif name == 'EXPUNGE':
+        counts[folder] -= len(data)
+        lines.append(f"{mhi.folder_name(folder)}: {len(data)} removed, {counts[folder]} left")
+    elif name == 'STATUS':
+        for (mailbox, stats) in parse(data):
+            mailbox = text(mailbox)
+            stats = {str(k).upper(): v for k, v in zip(stats[::2], stats[1::2])}
+            if 'MESSAGES' not in stats or stats['MESSAGES'] == counts.get(mailbox):
+                continue
+            if mailbox in counts:
+                change = stats['MESSAGES'] - counts[mailbox]
+                lines.append(f"{mhi.folder_name(mailbox)}: {abs(change)} {'new' if change > 0 else 'removed'}, {stats['MESSAGES']} in all")
+            counts[mailbox] = stats['MESSAGES']
+    return [time.strftime('%H:%M:%S ') + line for line in lines]
+
+
+@mhi.takesFolderArg
+def watch(folder, arglist):
+    '''Usage: watch [+folder]
+
+    Print a line whenever messages arrive in or are removed from the
+    specified folder (or the current one), until interrupted.  If the
+    server supports NOTIFY, every other folder is watched too.
+    '''
+    if arglist:
+        raise mhi.UsageError()
+    folder = folder or mhi.state.get('folder', 'INBOX')
+    with mhi.Connection(folder, direct=True) as S:
+        capabilities = S.session.capabilities
+        if 'IDLE' not in capabilities:
+            print("The server doesn't support IDLE.")
+            sys.exit(1)
+        counts = {folder: S.exists}
+        everywhere = 'NOTIFY' in capabilities and S._ext('notify', WATCH_EVENTS) == 'OK'
+        print(f"Watching {'all folders' if everywhere else mhi.folder_name(folder)}; {S.exists} messages in {mhi.folder_name(folder)}.")
+        sys.stdout.flush()
+        while True:
+            with closing(S._ext('idle', IDLE_RENEW)) as responses:
+                for name, data in responses:
+                    for line in _watch_events(folder, name, data, counts):
+                        print(line)
+                    sys.stdout.flush()
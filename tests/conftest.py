@@ -0,0 +1,47 @@
+import contextlib
+import io
+
+import pytest
+from imapsim import Simulator
+
+from mhi import main as mhi
+
+
+class Account:
+    """A simulated server, and a HOME whose .mhirc points mhi at it"""
+
+    def __init__(self, sim, home):
+        self.sim = sim
+        self.home = home
+
+    def run(self, *args):
+        '''run an mhi command and return what it printed'''
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            mhi._cmd_dispatch(['mhi', *args])
+        return out.getvalue()
+
+
+@pytest.fixture
+def home(tmp_path, monkeypatch):
+    '''HOME in tmp_path, with mhi's (empty) config and state loaded from
+    there, so that tests never touch the real ~/.mhirc and ~/.mhi'''
+    monkeypatch.setenv('HOME', str(tmp_path))
+    mhi.init_config()
+    return tmp_path
+
+
+@pytest.fixture
+def account(tmp_path, monkeypatch):
+    '''account(folders, rc='', **simulator_options) starts a Simulator
+    serving folders and returns an Account using it, with rc added to its
+    .mhirc; the server is stopped after the test'''
+    with contextlib.ExitStack() as running:
+
+        def start(folders, rc='', **options):
+            sim = running.enter_context(Simulator(folders, **options))
+            host, port = sim.server.sockets[0].getsockname()[:2]
+            (tmp_path / '.mhirc').write_text(f'connection = imap://user:secret@{host}:{port}\n{rc}')
+            monkeypatch.setenv('HOME', str(tmp_path))
+            return Account(sim, tmp_path)
+
+        yield start
@@ -29,6 +29,32 @@ class ImapConnectionMock(mock.Mock):
     fail = False
     error = False
     state = None
+    capabilities = ('IMAP4REV1',)
+    untagged_responses = {}
+    tagged_commands = {}
+
+    def _command(self, name, *args):
+        tag = 'A%d' % len(self.tagged_commands)
+        self.tagged_commands[tag] = (name, args)
+        return tag
+
+    def _command_complete(self, name, tag):
+        name, args = self.tagged_commands.pop(tag)
+        typ, dat = getattr(self, name.lower())(*args)
+        if typ == 'OK':
+            self.untagged_responses.setdefault(name, []).extend(dat)
+        return typ, [b'completed']
+
+    def _untagged_response(self, typ, dat, name):
+        if typ == 'NO':
+            return typ, dat
+        return typ, self.untagged_responses.pop(name, [None])
+
+    def response(self, code):
+        return code, self.untagged_responses.pop(code.upper(), [None])
+
+    def capability(self):
+        return ('OK', [b' '.join(bytes(c, 'utf-8') for c in self.capabilities)])
 
     def fetch(self, mails_id_set, request):
         flag_str = ""
@@ -41,11 +67,11 @@ class ImapConnectionMock(mock.Mock):
             uid_str = 'UID 1 '
 
         imap_header = bytes(
-            '1 ({uid_str}{flag_str}BODY[HEADER] {{1621}}'.format(
+            '1 ({uid_str}{flag_str}RFC822 {{1621}}'.format(
                 flag_str=flag_str,
                 uid_str=uid_str),
             'utf-8')
-        return ('OK', [(imap_header, example_email_content, b')')])
+        return ('OK', [(imap_header, example_email_content), b')'])
 
     def store(self, mails_id_set, request, flags):
         flags = ['\\\\Answered', '\\\\Seen', 'NonJunk']
@@ -0,0 +1,773 @@
+"""A local IMAP4rev1 server full of made-up mail, for tests and benchmarks
+
+    sim = Simulator({'INBOX': 10000, 'Archive': 200}, rtt=0.02)
+    host, port = sim.start()
+    ...                   # point mhi at imap://user:pw@host:port/
+    sim.stats             # connections, commands, round trips, bytes each way
+    sim.stop()
+
+Unlike imap4mock, this is a real server (asyncio, on 127.0.0.1, in a
+thread of its own so that the blocking code under test can talk to it
+from the main thread), so what mhi sends and how often it waits for a
+reply can be measured.
+
+Messages are generated from their folder and UID whenever they're asked
+for, so a folder of a million messages costs little more than its UID
+list; only flags that differ from the generated ones, and where copied
+messages came from, are remembered.  Some messages have a subject that
+has to be sent as a literal, an HTML alternative, or a base64 attachment,
+so that the interesting paths of the response parser, show and pick all
+get exercised.
+
+CONDSTORE and LIST-STATUS are there to be offered (capabilities=
+CAPABILITIES + ' CONDSTORE') but aren't by default, so that the fallbacks
+get measured.
+
+Delays can be injected three ways: rtt is added once per round trip
+(whenever the server has had to wait for the client), latency per
+command ({'FETCH': 0.01}, or a number for every command), and bandwidth
+limits what the server sends, in bytes per second.
+"""
+
+import asyncio
+import base64
+import bisect
+import functools
+import random
+import re
+import socket
+import threading
+import time
+import zlib
+from array import array
+from collections import Counter
+
+CAPABILITIES = 'IMAP4rev1 UIDPLUS MOVE IDLE'
+
+# seconds to hold an answer back for commands pipelined after the one answered
+PIPELINE_GRACE = 0.005
+
+NAMES = ['Alice Example', 'Bob Jones', 'Carol Smith', 'Dave Brown', 'Erin Wu', 'Frank Miller', 'Grace Lee', 'Héloïse Martin']
+DOMAINS = ['example.org', 'lists.python.org', 'mail.example.com', 'corp.example.net']
+WORDS = (
+    'meeting notes release build broken fix patch review urgent lunch invoice report draft schedule '
+    'python imap server mail list digest update weekly banana café thread question answer'
+).split()
+
+_token = re.compile(r'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|([^\s()"\[]*\[[^\]]*\][^\s()"]*|[^\s()"]+))')
+_section = re.compile(r'(BODY(?:\.PEEK)?)\[([^\]]*)\](?:<(\d+)(?:\.(\d+))?>)?$', re.I)
+
+
+def parse_args(s):
+    '''the arguments of a command line, with parenthesized lists as lists'''
+    stack = [[]]
+    pos = 0
+    while pos < len(s.rstrip()):
+        m = _token.match(s, pos)
+        if not m:
+            raise ValueError(f'bad arguments: {s!r}')
+        opening, closing, quoted, atom = m.groups()
+        if opening:
+            stack[-1].append([])
+            stack.append(stack[-1][-1])
+        elif closing:
+            stack.pop()
+        elif quoted is not None:
+            stack[-1].append(re.sub(r'\\(.)', r'\1', quoted))
+        else:
+            stack[-1].append(atom)
+        pos = m.end()
+    return stack[0]
+
+
+def q(s):
+    '''an IMAP string: quoted if it can be, a literal if not'''
+    if s is None:
+        return b'NIL'
+    data = s.encode() if isinstance(s, str) else s
+    if data.isascii() and b'\r' not in data and b'\n' not in data:
+        return b'"' + data.replace(b'\\', b'\\\\').replace(b'"', b'\\"') + b'"'
+    return b'{%d}\r\n' % len(data) + data
+
+
+@functools.lru_cache(maxsize=1)
+def _base64_lines():
+    '''base64 lines to cut attachments from'''
+    rnd = random.Random(0)
+    raw = rnd.getrandbits(57 * 8 * 40000).to_bytes(57 * 40000, 'little')
+    return [base64.b64encode(raw[i : i + 57]) for i in range(0, len(raw), 57)]
+
+
+def _seed(key):
+    return zlib.crc32(f'{key[0]}\0{key[1]}'.encode())
+
+
+def default_flags(key):
+    '''the flags a generated message starts with'''
+    h = _seed(key)
+    flags = set()
+    if h % 10:
+        flags.add('\\Seen')
+    if h % 20 == 1:
+        flags.add('\\Answered')
+    if h % 50 == 3:
+        flags.add('\\Flagged')
+    return flags
+
+
+class Message:
+    """A generated message; key is the (folder, UID) it was generated for"""
+
+    def __init__(self, key):
+        # just what an ENVELOPE needs; the rest is made when it's asked for
+        seed = _seed(key)
+        rnd = random.Random(seed)
+        self.uid = key[1]
+        self.seed = seed
+        self.name = rnd.choice(NAMES)
+        self.mailbox = self.name.split()[0].lower().replace('é', 'e').replace('ï', 'i')
+        self.host = rnd.choice(DOMAINS)
+        self.subject = ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(2, 8))).capitalize()
+        self.reply = rnd.random() < 0.2
+        if self.reply:
+            self.subject = 'Re: ' + self.subject
+        self.when = 1.6e9 + self.uid * 617 + rnd.randint(0, 600)
+        self.date = time.strftime('%a, %d %b %Y %H:%M:%S +0000', time.gmtime(self.when))
+        self.message_id = f'<{rnd.getrandbits(48):x}.{self.uid}@{self.host}>'
+
+    @functools.cached_property
+    def _content(self):
+        '''(header, body, parts, BODYSTRUCTURE); parts is None for a single part message'''
+        rnd = random.Random(self.seed + 1)
+        n = self.uid
+        words = [rnd.choice(WORDS) for _ in range(rnd.randint(20, 400))]
+        text = '\r\n'.join(' '.join(words[i : i + 12]) for i in range(0, len(words), 12)) + '\r\n'
+        header = (
+            f'Date: {self.date}\r\nFrom: {self.name} <{self.mailbox}@{self.host}>\r\nTo: Me <me@example.org>\r\n'
+            f'Subject: {self.subject}\r\nMessage-ID: {self.message_id}\r\nMIME-Version: 1.0\r\n'
+        )
+        kind = rnd.random()
+        plain = ('TEXT', 'PLAIN', 'utf-8', '8BIT', b'Content-Type: text/plain; charset=utf-8\r\nContent-Transfer-Encoding: 8bit\r\n', text.encode())
+        if kind < 0.1:
+            lines = _base64_lines()
+            count = rnd.choice([300, 1500, 6000, 36000])
+            start = rnd.randrange(len(lines) - count)
+            name = f'{rnd.choice(WORDS)}-{n}.pdf'
+            pdf = (
+                'APPLICATION',
+                'PDF',
+                None,
+                'BASE64',
+                f'Content-Type: application/pdf; name="{name}"\r\nContent-Transfer-Encoding: base64\r\n'
+                f'Content-Disposition: attachment; filename="{name}"\r\n'.encode(),
+                b'\r\n'.join(lines[start : start + count]) + b'\r\n',
+                name,
+            )
+            parts = [plain, pdf]
+            subtype = 'MIXED'
+        elif kind < 0.3:
+            html = '<html><body><p>' + '</p>\r\n<p>'.join(text.split('\r\n')) + '</p></body></html>\r\n'
+            parts = [plain, ('TEXT', 'HTML', 'utf-8', '8BIT', b'Content-Type: text/html; charset=utf-8\r\n', html.encode())]
+            subtype = 'ALTERNATIVE'
+        else:
+            header += plain[4].decode()
+            return header.encode() + b'\r\n', plain[5], None, self._part_structure(plain)
+        boundary = f'=_{n}_{subtype.lower()}'
+        header += f'Content-Type: multipart/{subtype.lower()}; boundary="{boundary}"\r\n'
+        body = b''.join(b'--%s\r\n%s\r\n%s\r\n' % (boundary.encode(), p[4], p[5]) for p in parts) + b'--%s--\r\n' % boundary.encode()
+        structure = b'(' + b''.join(self._part_structure(p) for p in parts) + b' "%s" ("BOUNDARY" %s) NIL NIL)' % (subtype.encode(), q(boundary))
+        return header.encode() + b'\r\n', body, parts, structure
+
+    @property
+    def header(self):
+        return self._content[0]
+
+    @property
+    def body(self):
+        return self._content[1]
+
+    @property
+    def parts(self):
+        return self._content[2]
+
+    @property
+    def structure(self):
+        return self._content[3]
+
+    @property
+    def raw(self):
+        return self.header + self.body
+
+    @staticmethod
+    def _part_structure(part):
+        mtype, subtype, charset, encoding, _, content = part[:6]
+        params = b'("CHARSET" %s)' % q(charset) if charset else b'("NAME" %s)' % q(part[6])
+        s = b'(%s %s %s NIL NIL %s %d' % (q(mtype), q(subtype), params, q(encoding), len(content))
+        if mtype == 'TEXT':
+            s += b' %d' % content.count(b'\n')
+        disposition = b'("ATTACHMENT" ("FILENAME" %s))' % q(part[6]) if len(part) > 6 else b'NIL'
+        return s + b' NIL %s NIL)' % disposition
+
+    def envelope(self):
+        who = b'((%s NIL %s %s))' % (q(self.name), q(self.mailbox), q(self.host))
+        in_reply_to = q(f'<parent.{self.message_id[1:]}') if self.reply else b'NIL'
+        return b'(%s %s %s %s %s (("Me" NIL "me" "example.org")) NIL NIL %s %s)' % (
+            q(self.date),
+            q(self.subject),
+            who,
+            who,
+            who,
+            in_reply_to,
+            q(self.message_id),
+        )
+
+    def section(self, spec):
+        '''the content of a BODY[spec], or None if there's no such section'''
+        spec = spec.upper()
+        if spec == '':
+            return self.raw
+        if spec == 'HEADER':
+            return self.header
+        if spec == 'TEXT':
+            return self.body
+        m = re.match(r'HEADER\.FIELDS(\.NOT)? \((.*)\)$', spec)
+        if m:
+            names = {f.upper() for f in m.group(2).split()}
+            lines = re.findall(rb'[^\r\n]+\r\n(?:[ \t][^\r\n]*\r\n)*', self.header)
+            keep = [line for line in lines if (line.split(b':')[0].decode().upper() in names) != bool(m.group(1))]
+            return b''.join(keep) + b'\r\n'
+        m = re.match(r'(\d+)(\.MIME)?$', spec)
+        if m:
+            n = int(m.group(1))
+            if self.parts is None:
+                return self.body if n == 1 and not m.group(2) else None
+            if not 1 <= n <= len(self.parts):
+                return None
+            return self.parts[n - 1][4] + b'\r\n' if m.group(2) else self.parts[n - 1][5]
+        return None
+
+    def text(self):
+        return self.raw.decode('utf-8', 'replace')
+
+
+@functools.lru_cache(maxsize=4096)
+def message(key):
+    return Message(key)
+
+
+class Mailbox:
+    """One folder: its UIDs, and whatever about them isn't generated"""
+
+    def __init__(self, name, count, uidvalidity):
+        self.name = name
+        self.uidvalidity = uidvalidity
+        self.uids = array('I', range(1, count + 1))
+        self.uidnext = count + 1
+        self.flags = {}
+        self.origin = {}
+        self.modseq = 1
+        self.modseqs = {}
+        self._unseen = None
+
+    def message(self, uid):
+        return message(self.origin.get(uid, (self.name, uid)))
+
+    def flags_of(self, uid):
+        if uid in self.flags:
+            return self.flags[uid]
+        return default_flags(self.origin.get(uid, (self.name, uid)))
+
+    def set_flags(self, uid, flags):
+        self.flags[uid] = set(flags)
+        self.modseq += 1
+        self.modseqs[uid] = self.modseq
+        self._unseen = None
+
+    def modseq_of(self, uid):
+        return self.modseqs.get(uid, 1)
+
+    def unseen(self):
+        if self._unseen is None:
+            self._unseen = sum(1 for u in self.uids if '\\Seen' not in self.flags_of(u))
+        return self._unseen
+
+    def add(self, key, flags):
+        uid = self.uidnext
+        self.uidnext += 1
+        self.uids.append(uid)
+        self.origin[uid] = key
+        self.set_flags(uid, flags)
+        return uid
+
+    def remove(self, doomed):
+        '''remove the UIDs in doomed, returning the message numbers to report
+        in EXPUNGE responses, in order'''
+        seqs = []
+        kept = array('I')
+        for uid in self.uids:
+            if uid in doomed:
+                seqs.append(len(kept) + 1)
+                self.flags.pop(uid, None)
+                self.modseqs.pop(uid, None)
+            else:
+                kept.append(uid)
+        self.uids = kept
+        self.modseq += bool(seqs)
+        self._unseen = None
+        return seqs
+
+    def indexes(self, spec, uid=False):
+        '''the 0-based indexes into uids of a sequence set (or UID set)'''
+        found = set()
+        count = len(self.uids)
+        top = (self.uids[-1] if self.uids else 0) if uid else count
+        for part in spec.split(','):
+            lo, _, hi = part.partition(':')
+            lo = top if lo == '*' else int(lo)
+            hi = lo if not hi else top if hi == '*' else int(hi)
+            lo, hi = min(lo, hi), max(lo, hi)
+            if uid:
+                found.update(range(bisect.bisect_left(self.uids, lo), bisect.bisect_right(self.uids, hi)))
+            else:
+                found.update(range(max(lo, 1) - 1, min(hi, count)))
+        return sorted(found)
+
+
+class _Session:
+    """One client connection"""
+
+    def __init__(self, sim, reader, writer):
+        self.sim = sim
+        self.reader = reader
+        self.writer = writer
+        self.buffer = bytearray()
+        self.out = []
+        self.selected = None
+        self.readonly = False
+
+    async def readline(self):
+        while b'\n' not in self.buffer:
+            waiting = not self.buffer
+            data = await self.reader.read(65536)
+            if not data:
+                return None
+            self.sim.stats['bytes_in'] += len(data)
+            if waiting:
+                # the client had to wait for us to hear from it
+                self.sim.stats['round_trips'] += 1
+                if self.sim.rtt:
+                    await asyncio.sleep(self.sim.rtt)
+            self.buffer += data
+        end = self.buffer.index(b'\n') + 1
+        line = bytes(self.buffer[:end])
+        del self.buffer[:end]
+        return line.decode('utf-8', 'replace').rstrip('\r\n')
+
+    async def pipelined(self):
+        '''before answering, give commands the client sent without waiting
+        for the answer a moment to arrive, so they count as the same round trip'''
+        if b'\n' in self.buffer:
+            return
+        sock = self.writer.get_extra_info('socket')
+        if hasattr(socket, 'TCP_QUICKACK') and sock is not None:
+            # the client's Nagle algorithm holds what it sends next until
+            # what it sent last is acknowledged, so don't delay the ACK
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+        try:
+            data = await asyncio.wait_for(self.reader.read(65536), PIPELINE_GRACE)
+        except asyncio.TimeoutError:
+            return
+        self.sim.stats['bytes_in'] += len(data)
+        self.buffer += data
+
+    def send(self, *pieces):
+        self.out.extend(pieces)
+
+    async def flush(self):
+        data = b''.join(p.encode() if isinstance(p, str) else p for p in self.out)
+        self.out = []
+        if not data:
+            return
+        self.sim.stats['bytes_out'] += len(data)
+        self.writer.write(data)
+        if self.sim.bandwidth:
+            await asyncio.sleep(len(data) / self.sim.bandwidth)
+        await self.writer.drain()
+
+    async def run(self):
+        # connecting and waiting for the greeting is a round trip too
+        self.sim.stats['connections'] += 1
+        self.sim.stats['round_trips'] += 1
+        if self.sim.rtt:
+            await asyncio.sleep(self.sim.rtt)
+        self.send(f'* OK [CAPABILITY {self.sim.capabilities}] imapsim ready\r\n')
+        await self.flush()
+        while True:
+            line = await self.readline()
+            if line is None:
+                break
+            tag, _, rest = line.partition(' ')
+            name, _, rest = rest.partition(' ')
+            name = name.upper()
+            uid = name == 'UID'
+            if uid:
+                name, _, rest = rest.partition(' ')
+                name = name.upper()
+            self.sim.stats['commands'][f'UID {name}' if uid else name] += 1
+            latency = self.sim.latency.get(name, self.sim.latency.get('*', 0)) if isinstance(self.sim.latency, dict) else self.sim.latency
+            if latency:
+                await asyncio.sleep(latency)
+            handler = getattr(self, f'do_{name.lower()}', None)
+            try:
+                args = parse_args(rest)
+                if handler is None or (uid and name not in ('FETCH', 'SEARCH', 'STORE', 'COPY', 'MOVE', 'EXPUNGE')):
+                    raise ValueError(f'unknown command {name}')
+                result = await handler(args, uid) if name == 'IDLE' else handler(args, uid)
+                self.send(f'{tag} {result or "OK " + name + " completed"}\r\n')
+            except (ValueError, IndexError, KeyError) as e:
+                self.send(f'{tag} BAD {e}\r\n')
+            await self.pipelined()
+            await self.flush()
+            if name == 'LOGOUT':
+                break
+        self.writer.close()
+
+    # connection and folder commands
+
+    def do_capability(self, args, uid):
+        self.send(f'* CAPABILITY {self.sim.capabilities}\r\n')
+
+    def do_noop(self, args, uid):
+        pass
+
+    do_check = do_noop
+
+    def do_login(self, args, uid):
+        return f'OK [CAPABILITY {self.sim.capabilities}] logged in'
+
+    def do_logout(self, args, uid):
+        self.send('* BYE imapsim logging out\r\n')
+
+    def _folder(self, name):
+        name = 'INBOX' if name.upper() == 'INBOX' else name
+        return self.sim.folders.get(name)
+
+    def do_select(self, args, uid, readonly=False):
+        box = self._folder(args[0])
+        self.selected = None
+        if box is None:
+            return f'NO [NONEXISTENT] no folder {args[0]}'
+        self.selected, self.readonly = box, readonly
+        self.send(
+            '* FLAGS (\\Answered \\Flagged \\Deleted \\Seen \\Draft)\r\n',
+            f'* {len(box.uids)} EXISTS\r\n* 0 RECENT\r\n',
+            f'* OK [UIDVALIDITY {box.uidvalidity}] UIDs valid\r\n* OK [UIDNEXT {box.uidnext}] next UID\r\n',
+            '* OK [PERMANENTFLAGS (\\Answered \\Flagged \\Deleted \\Seen \\Draft \\*)] flags\r\n',
+        )
+        if 'CONDSTORE' in self.sim.capabilities:
+            self.send(f'* OK [HIGHESTMODSEQ {box.modseq}] modseq\r\n')
+        return f'OK [{"READ-ONLY" if readonly else "READ-WRITE"}] selected'
+
+    def do_examine(self, args, uid):
+        return self.do_select(args, uid, readonly=True)
+
+    def do_close(self, args, uid):
+        if self.selected and not self.readonly:
+            self.selected.remove({u for u in self.selected.uids if '\\Deleted' in self.selected.flags_of(u)})
+        self.selected = None
+
+    def do_create(self, args, uid):
+        if self._folder(args[0]) is not None:
+            return 'NO [ALREADYEXISTS] folder exists'
+        self.sim.add_folder(args[0], 0)
+
+    def do_delete(self, args, uid):
+        if self._folder(args[0]) is None:
+            return 'NO [NONEXISTENT] no such folder'
+        del self.sim.folders[args[0]]
+
+    def _status(self, box, items):
+        values = {
+            'MESSAGES': len(box.uids),
+            'RECENT': 0,
+            'UNSEEN': box.unseen() if 'UNSEEN' in (i.upper() for i in items) else 0,
+            'UIDNEXT': box.uidnext,
+            'UIDVALIDITY': box.uidvalidity,
+        }
+        return b'* STATUS %s (%s)\r\n' % (q(box.name), ' '.join(f'{i.upper()} {values[i.upper()]}' for i in items).encode())
+
+    def do_status(self, args, uid):
+        box = self._folder(args[0])
+        if box is None:
+            return 'NO [NONEXISTENT] no such folder'
+        self.send(self._status(box, args[1]))
+
+    def do_list(self, args, uid):
+        pattern = re.escape(args[1]).replace(r'\*', '.*').replace('%', '[^/]*')
+        status = None
+        if len(args) > 3 and str(args[2]).upper() == 'RETURN':
+            status = args[3][1]
+        for name in sorted(self.sim.folders):
+            if re.fullmatch(pattern, name):
+                self.send(b'* LIST (\\HasNoChildren) "/" %s\r\n' % q(name))
+                if status:
+                    self.send(self._status(self.sim.folders[name], status))
+
+    async def do_idle(self, args, uid):
+        self.send('+ idling\r\n')
+        await self.flush()
+        await self.readline()
+
+    # message commands
+
+    def _need_selected(self):
+        if self.selected is None:
+            raise ValueError('no folder selected')
+        return self.selected
+
+    def do_fetch(self, args, uid):
+        box = self._need_selected()
+        items = args[1] if isinstance(args[1], list) else [args[1]]
+        macros = {'ALL': ['FLAGS', 'INTERNALDATE', 'RFC822.SIZE', 'ENVELOPE'], 'FAST': ['FLAGS', 'INTERNALDATE', 'RFC822.SIZE']}
+        macros['FULL'] = macros['ALL'] + ['BODY']
+        items = [i for item in items for i in macros.get(str(item).upper(), [item])]
+        if uid and 'UID' not in (i.upper() for i in items):
+            items.insert(0, 'UID')
+        changedsince = None
+        if len(args) > 2 and str(args[2][0]).upper() == 'CHANGEDSINCE':
+            # which implies MODSEQ (RFC 7162)
+            changedsince = int(args[2][1])
+            items += [] if 'MODSEQ' in (i.upper() for i in items) else ['MODSEQ']
+        for i in box.indexes(args[0], uid):
+            u = box.uids[i]
+            if changedsince is not None and box.modseq_of(u) <= changedsince:
+                continue
+            msg = box.message(u)
+            out = []
+            seen = False
+            for item in items:
+                name = item.upper()
+                if name == 'UID':
+                    out.append(b'UID %d' % u)
+                elif name == 'FLAGS':
+                    out.append(b'FLAGS (%s)' % ' '.join(sorted(box.flags_of(u))).encode())
+                elif name == 'ENVELOPE':
+                    out.append(b'ENVELOPE ' + msg.envelope())
+                elif name == 'MODSEQ':
+                    out.append(b'MODSEQ (%d)' % box.modseq_of(u))
+                elif name == 'INTERNALDATE':
+                    out.append(b'INTERNALDATE "%s"' % time.strftime('%d-%b-%Y %H:%M:%S +0000', time.gmtime(msg.when)).encode())
+                elif name == 'RFC822.SIZE':
+                    out.append(b'RFC822.SIZE %d' % len(msg.raw))
+                elif name in ('BODYSTRUCTURE', 'BODY'):
+                    out.append(b'%s %s' % (name.encode(), msg.structure))
+                elif name in ('RFC822', 'RFC822.HEADER', 'RFC822.TEXT'):
+                    content = {'RFC822': msg.raw, 'RFC822.HEADER': msg.header, 'RFC822.TEXT': msg.body}[name]
+                    out.append(b'%s %s' % (name.encode(), q(content)))
+                    seen = seen or name != 'RFC822.HEADER'
+                else:
+                    m = _section.match(item)
+                    if not m:
+                        raise ValueError(f'unknown fetch item {item}')
+                    content = msg.section(m.group(2))
+                    label = f'BODY[{m.group(2)}]'
+                    if content is not None and m.group(3):
+                        start = int(m.group(3))
+                        content = content[start : start + int(m.group(4))] if m.group(4) else content[start:]
+                        label += f'<{start}>'
+                    out.append(b'%s %s' % (label.encode(), b'NIL' if content is None else q(content)))
+                    seen = seen or m.group(1).upper() == 'BODY'
+            if seen and not self.readonly and '\\Seen' not in box.flags_of(u):
+                box.set_flags(u, box.flags_of(u) | {'\\Seen'})
+                if 'FLAGS' not in (i.upper() for i in items):
+                    out.append(b'FLAGS (%s)' % ' '.join(sorted(box.flags_of(u))).encode())
+            self.send(b'* %d FETCH (%s)\r\n' % (i + 1, b' '.join(out)))
+
+    def do_store(self, args, uid):
+        box = self._need_selected()
+        op = args[1].upper()
+        flags = set(args[2] if isinstance(args[2], list) else [args[2]])
+        for i in box.indexes(args[0], uid):
+            u = box.uids[i]
+            current = box.flags_of(u)
+            if op.startswith('+'):
+                box.set_flags(u, current | flags)
+            elif op.startswith('-'):
+                box.set_flags(u, current - flags)
+            else:
+                box.set_flags(u, flags)
+            if not op.endswith('.SILENT'):
+                uidpart = b'UID %d ' % u if uid else b''
+                self.send(b'* %d FETCH (%sFLAGS (%s))\r\n' % (i + 1, uidpart, ' '.join(sorted(box.flags_of(u))).encode()))
+
+    def do_copy(self, args, uid, move=False):
+        box = self._need_selected()
+        dest = self._folder(args[1])
+        if dest is None:
+            return 'NO [TRYCREATE] no such folder'
+        source = [box.uids[i] for i in box.indexes(args[0], uid)]
+        copies = [dest.add(box.origin.get(u, (box.name, u)), box.flags_of(u) - {'\\Deleted'}) for u in source]
+        code = ''
+        if source and 'UIDPLUS' in self.sim.capabilities:
+            code = f'[COPYUID {dest.uidvalidity} {",".join(map(str, source))} {",".join(map(str, copies))}] '
+        if move:
+            self.send(code and f'* OK {code}moved\r\n')
+            for seq in box.remove(set(source)):
+                self.send(f'* {seq} EXPUNGE\r\n')
+            return f'OK {"UID " if uid else ""}MOVE completed'
+        return f'OK {code}COPY completed'
+
+    def do_move(self, args, uid):
+        return self.do_copy(args, uid, move=True)
+
+    def do_expunge(self, args, uid):
+        box = self._need_selected()
+        candidates = [box.uids[i] for i in box.indexes(args[0], True)] if uid else box.uids
+        for seq in box.remove({u for u in candidates if '\\Deleted' in box.flags_of(u)}):
+            self.send(f'* {seq} EXPUNGE\r\n')
+
+    def do_search(self, args, uid):
+        box = self._need_selected()
+        if args and str(args[0]).upper() == 'CHARSET':
+            args = args[2:]
+        hits = self._search(box, list(args))
+        self.send('* SEARCH' + ''.join(f' {box.uids[i] if uid else i + 1}' for i in sorted(hits)) + '\r\n')
+
+    def _search(self, box, keys):
+        '''the indexes of the messages matching all of the search keys (which are consumed)'''
+        found = set(range(len(box.uids)))
+        while keys:
+            found &= self._search_one(box, keys)
+        return found
+
+    def _search_one(self, box, keys):
+        key = keys.pop(0)
+        if isinstance(key, list):
+            return self._search(box, list(key))
+        k = key.upper()
+        everything = range(len(box.uids))
+        if k == 'NOT':
+            return set(everything) - self._search_one(box, keys)
+        if k == 'OR':
+            return self._search_one(box, keys) | self._search_one(box, keys)
+        if k == 'UID':
+            return set(box.indexes(keys.pop(0), True))
+        if re.fullmatch(r'[\d:*,]+', key):
+            return set(box.indexes(key))
+        matches = self._predicate(box, k, keys)
+        return {i for i in everything if matches(box.uids[i])}
+
+    @staticmethod
+    def _predicate(box, k, keys):
+        '''a test of a UID for the search key k, taking its arguments from keys'''
+        flags = {
+            'SEEN': '\\Seen',
+            'ANSWERED': '\\Answered',
+            'FLAGGED': '\\Flagged',
+            'DELETED': '\\Deleted',
+            'DRAFT': '\\Draft',
+        }
+        if k in ('ALL', 'OLD'):
+            return lambda u: True
+        if k in ('NEW', 'RECENT'):
+            return lambda u: False
+        if k in flags:
+            return lambda u: flags[k] in box.flags_of(u)
+        if k.startswith('UN') and k[2:] in flags:
+            return lambda u: flags[k[2:]] not in box.flags_of(u)
+        if k in ('LARGER', 'SMALLER'):
+            limit = int(keys.pop(0))
+            if k == 'LARGER':
+                return lambda u: len(box.message(u).raw) > limit
+            return lambda u: len(box.message(u).raw) < limit
+        if k in ('FROM', 'TO', 'SUBJECT', 'BODY', 'TEXT', 'HEADER'):
+            field = keys.pop(0) if k == 'HEADER' else None
+            needle = keys.pop(0).lower()
+
+            def haystack(msg):
+                if k == 'FROM':
+                    return f'{msg.name} <{msg.mailbox}@{msg.host}>'
+                if k == 'TO':
+                    return 'Me <me@example.org>'
+                if k == 'SUBJECT':
+                    return msg.subject
+                if k == 'BODY':
+                    return msg.body.decode('utf-8', 'replace')
+                if k == 'HEADER':
+                    return (msg.section(f'HEADER.FIELDS ({field})') or b'').decode('utf-8', 'replace')
+                return msg.text()
+
+            return lambda u: needle in haystack(box.message(u)).lower()
+        raise ValueError(f'unsupported search key {k}')
+
+
+class Simulator:
+    """The server, and the folders it serves
+
+    folders is {name: how many messages}."""
+
+    def __init__(self, folders=None, capabilities=CAPABILITIES, rtt=0, latency=0, bandwidth=0):
+        self.folders = {}
+        for name, count in (folders or {'INBOX': 100}).items():
+            self.add_folder(name, count)
+        self.capabilities = capabilities
+        self.rtt = rtt
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.reset_stats()
+        self.loop = self.server = self.thread = None
+
+    def add_folder(self, name, count):
+        self.folders[name] = Mailbox(name, count, 1000 + len(self.folders))
+
+    def reset_stats(self):
+        self.stats = {'connections': 0, 'round_trips': 0, 'bytes_in': 0, 'bytes_out': 0, 'commands': Counter()}
+
+    async def _serve(self, reader, writer):
+        try:
+            await _Session(self, reader, writer).run()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+
+    def start(self):
+        '''start serving in a thread of its own; returns (host, port)'''
+        self.loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(self.loop)
+            self.server = self.loop.run_until_complete(asyncio.start_server(self._serve, '127.0.0.1', 0))
+            started.set()
+            self.loop.run_forever()
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+        started.wait()
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def _shutdown(self):
+        self.server.close()
+        sessions = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in sessions:
+            task.cancel()
+        await asyncio.gather(*sessions, return_exceptions=True)
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def synthetic_folders(inbox, folders=0, per_folder=100):
+    '''{name: count} for an INBOX of inbox messages and some list folders'''
+    spec = {'INBOX': inbox}
+    spec.update({f'Lists/list{n:03}': per_folder for n in range(folders)})
+    return spec
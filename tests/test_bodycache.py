@@ -0,0 +1,45 @@
+import os
+
+from mhi import main as mhi
+from mhi.bodycache import open_bodies
+
+
+def test_get_put_and_dedupe(home):
+    bodies = open_bodies()
+    assert bodies.get('INBOX', 7, 1, ['BODY[HEADER]']) is None
+    bodies.put('INBOX', 7, 1, {'BODY[HEADER]': b'Subject: hi\r\n\r\n', 'BODY[1]': memoryview(b'hello ' * 1000)})
+    # a refiled copy is the same content, so nothing more is stored
+    size = bodies.size()
+    bodies.put('archive', 3, 40, {'BODY[1]': b'hello ' * 1000})
+    assert bodies.size() == size < 1000
+    assert bodies.get('INBOX', 7, 1, ['BODY[HEADER]', 'BODY[1]']) == {'BODY[HEADER]': b'Subject: hi\r\n\r\n', 'BODY[1]': b'hello ' * 1000}
+    assert bodies.get('INBOX', 7, 1, ['BODY[1]', 'BODY[2]']) is None
+    # another UIDVALIDITY is another message
+    assert bodies.get('INBOX', 8, 1, ['BODY[1]']) is None
+    stats = bodies.stats()
+    assert (stats['messages'], stats['folders'], stats['items'], stats['raw']) == (2, 2, 2, 6015)
+
+
+def test_least_recently_used_goes_first(home):
+    bodies = open_bodies()
+    for uid in range(1, 4):
+        bodies.put('INBOX', 1, uid, {'RFC822': os.urandom(1000)})
+    bodies.get('INBOX', 1, 1, ['RFC822'])
+    bodies.trim(2500)
+    assert [uid for uid in range(1, 4) if bodies.get('INBOX', 1, uid, ['RFC822'])] == [1, 3]
+
+
+def test_turned_off(home, monkeypatch):
+    monkeypatch.setitem(mhi.config, 'message_cache', '0')
+    assert open_bodies() is None
+
+
+def test_peeked_until_fetched_or_unpeeked(home):
+    bodies = open_bodies()
+    for uid in (4, 5, 6):
+        bodies.put('INBOX', 1, uid, {'BODY[HEADER]': b'Subject: %d\r\n\r\n' % uid}, peeked=True)
+    assert bodies.peeked('INBOX', 1, [3, 4, 5, 6]) == [4, 5, 6]
+    # fetched again, this time marking it \Seen
+    bodies.put('INBOX', 1, 5, {'BODY[1]': b'text'})
+    bodies.unpeek('INBOX', 1, [6])
+    assert bodies.peeked('INBOX', 1, [3, 4, 5, 6]) == [4]
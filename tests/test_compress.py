@@ -0,0 +1,21 @@
+import io
+import zlib
+
+from mhi import imapext
+
+
+def test_inflating_reads_lines_across_flushes():
+    deflater = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+    lines = [b'* %d FETCH (FLAGS (\\Seen))\r\n' % n for n in range(1, 2001)] + [b'A001 OK FETCH done\r\n']
+    wire = b''.join(deflater.compress(line) + deflater.flush(zlib.Z_SYNC_FLUSH) for line in lines)
+    assert len(wire) < len(b''.join(lines)) / 2
+    f = io.BufferedReader(imapext._Inflating(io.BufferedReader(io.BytesIO(wire))))
+    assert [f.readline() for _ in lines] == lines
+    assert f.readline() == b''
+
+
+def test_compress_needs_a_socket():
+    class Stream:
+        '''like IMAP4_stream, which talks to a subprocess'''
+
+    assert imapext.compress(Stream()) is False
@@ -0,0 +1,60 @@
+import socket
+import sys
+import threading
+
+from mhi import credagent, daemon
+from mhi import main as mhi
+
+
+def test_remember_and_forget(tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+    assert credagent.lookup('pass show mail') is None
+    agent = threading.Thread(target=credagent.serve, daemon=True)
+    agent.start()
+    for _ in range(100):
+        if credagent._request('get', '') is None and (tmp_path / '.mhi' / 'cred.sock').exists():
+            break
+        agent.join(0.05)
+    assert (tmp_path / '.mhi' / 'cred.sock').stat().st_mode & 0o777 == 0o600
+    assert credagent.remember('pass show mail', 'sekrit', 60)
+    assert credagent.lookup('pass show mail') == 'sekrit'
+    assert credagent.lookup('pass show other') is None
+    assert credagent.remember('pass show old', 'stale', -1)
+    assert credagent.lookup('pass show old') is None
+    assert credagent.forget()
+    agent.join(5)
+    assert not agent.is_alive()
+    assert credagent.lookup('pass show mail') is None
+    assert not credagent.forget()
+
+
+def test_one_agent_at_a_time(tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+    monkeypatch.setattr(daemon, 'AUTH_TIMEOUT', 0.2)
+    agent = threading.Thread(target=credagent.serve, daemon=True)
+    agent.start()
+    for _ in range(100):
+        if (tmp_path / '.mhi' / 'cred.sock').exists():
+            break
+        agent.join(0.05)
+    assert credagent.remember('pass show mail', 'sekrit', 60)
+    # a second agent started at the same time leaves the first one be
+    credagent.serve()
+    # and one that connects without a word doesn't hold up the others
+    with socket.socket(socket.AF_UNIX) as silent:
+        silent.connect(credagent._socket_path())
+        assert credagent.lookup('pass show mail') == 'sekrit'
+    assert credagent.forget()
+    agent.join(5)
+    assert not agent.is_alive()
+
+
+def test_no_agent_without_fcntl(home, monkeypatch):
+    # as on Windows: the command is run directly, and no agent started
+    monkeypatch.setitem(sys.modules, 'fcntl', None)
+    monkeypatch.delitem(sys.modules, 'mhi.credagent')
+    assert mhi._password('echo sekrit') == 'sekrit'
+    monkeypatch.setitem(mhi.config, 'password_cache_ttl', '60')
+    assert mhi._password('echo sekrit') == 'sekrit'
+    assert 'mhi.credagent' not in sys.modules
+    assert not (home / '.mhi' / 'cred.sock').exists()
@@ -0,0 +1,312 @@
+import base64
+import contextlib
+import imaplib
+import io
+import subprocess
+import sys
+import time
+
+import pytest
+from imapsim import CAPABILITIES, Simulator, synthetic_folders
+
+from mhi import imapext
+from mhi import main as mhi
+from mhi.mimeparts import parts
+from mhi.response import fetch_responses
+from mhi.scancache import open_cache
+
+
+def test_generated_messages_hang_together():
+    with Simulator({'INBOX': 50, 'Archive': 0}) as sim:
+        S = imaplib.IMAP4(*sim.server.sockets[0].getsockname()[:2])
+        S.login('user', 'secret')
+        assert S.select('INBOX') == ('OK', [b'50'])
+        assert S.uid('SEARCH', 'UID 48:*') == ('OK', [b'48 49 50'])
+        typ, data = S.uid('FETCH', '1:50', '(UID BODYSTRUCTURE)')
+        for num, items in fetch_responses(data):
+            for part in parts(items['BODYSTRUCTURE']):
+                typ, content = S.uid('FETCH', str(items['UID']), f'(BODY.PEEK[{part.section}])')
+                assert len(content[0][1]) == part.size
+        S.uid('MOVE', '1:10', 'Archive')
+        sim.reset_stats()
+        statuses = imapext.status_many(S, ['INBOX', 'Archive'], '(MESSAGES UNSEEN)')
+        unseen = [sim.folders[f].unseen() for f in ('INBOX', 'Archive')]
+        assert sum(unseen) == 4
+        assert [s.split(b' (')[1] for s in statuses] == [b'MESSAGES 40 UNSEEN %d)' % unseen[0], b'MESSAGES 10 UNSEEN %d)' % unseen[1]]
+        # pipelined, so both took one round trip between them
+        assert sim.stats['round_trips'] == 1
+        S.logout()
+
+
+# what refile and rmm send, by what the server offers
+REMOVING = {
+    CAPABILITIES: (['UID MOVE'], ['UID STORE', 'UID EXPUNGE']),
+    'IMAP4rev1 UIDPLUS IDLE': (['UID COPY', 'UID STORE', 'UID EXPUNGE'], ['UID STORE', 'UID EXPUNGE']),
+    'IMAP4rev1 IDLE': (['UID COPY', 'UID STORE', 'EXPUNGE'], ['UID STORE', 'EXPUNGE']),
+}
+REMOVING_COMMANDS = {'UID MOVE', 'UID COPY', 'UID STORE', 'UID EXPUNGE', 'EXPUNGE'}
+
+
+@pytest.mark.parametrize('capabilities', REMOVING)
+@pytest.mark.parametrize('command', ['refile', 'rmm'])
+def test_removing_end_to_end(account, capabilities, command):
+    user = account({'INBOX': 30, 'Archive': 5}, capabilities=capabilities)
+    sim = user.sim
+    inbox = sim.folders['INBOX']
+    removed = inbox.uids[2]
+    user.run('folder', '+INBOX')
+    sim.reset_stats()
+    user.run(command, '3', *(['+Archive'] if command == 'refile' else []))
+    sent = REMOVING[capabilities][command == 'rmm']
+    assert {c: n for c, n in sim.stats['commands'].items() if c in REMOVING_COMMANDS} == dict.fromkeys(sent, 1)
+    # nothing pipelined, so a round trip for each command and connecting
+    assert sim.stats['round_trips'] == sum(sim.stats['commands'].values()) + 1
+    assert len(inbox.uids) == 29 and removed not in inbox.uids
+    if command == 'refile':
+        archive = sim.folders['Archive']
+        assert len(archive.uids) == 6 and archive.origin[archive.uids[-1]] == ('INBOX', removed)
+    # the UID map follows what the server said it expunged
+    assert list(open_cache('INBOX').uids) == list(inbox.uids)
+
+
+@pytest.mark.parametrize('capabilities', REMOVING)
+def test_refiling_the_current_message(account, capabilities):
+    user = account({'INBOX': 10, 'Archive': 0}, capabilities=capabilities)
+    inbox = user.sim.folders['INBOX']
+    following = inbox.uids[4]
+    user.run('folder', '+INBOX')
+    user.run('show', '4')
+    user.run('refile', '+Archive')
+    # the message after it is current now, under the number it had
+    assert mhi.state['INBOX.cur'] == '4'
+    assert user.run('show').startswith('(Message INBOX:4)')
+    assert inbox.uids[3] == following
+    user.run('show', '9')
+    user.run('refile', '+Archive')
+    # the last message went, so the one before it is current
+    assert mhi.state['INBOX.cur'] == '8'
+
+
+def test_show_many_end_to_end(account, monkeypatch):
+    user = account({'INBOX': 250})
+    user.run('folder', '+INBOX')
+    shown = []
+
+    def fetch_stream(self, msgset, items, *args, **kwargs):
+        if 'BODYSTRUCTURE' in items and not kwargs.get('uid'):
+            # messages shown by the time each window's headers are asked for
+            shown.append(sys.stdout.getvalue().count('(Message INBOX:'))
+        return Connection_fetch_stream(self, msgset, items, *args, **kwargs)
+
+    Connection_fetch_stream = mhi.Connection.fetch_stream
+    monkeypatch.setattr(mhi.Connection, 'fetch_stream', fetch_stream)
+    user.sim.reset_stats()
+    out = user.run('show', '1-200')
+    assert out.count('(Message INBOX:') == 200
+    # a window at a time, the first small, each shown before the next is fetched
+    assert len(shown) > 1
+    assert shown[:2] == [0, mhi.WindowSizer().size]
+    assert shown == sorted(shown)
+    # for each window: a FETCH of the structures and a UID FETCH of the texts
+    # for each of the three kinds of message there are; besides, connecting,
+    # LOGIN, SELECT, the UID map's SEARCH, the prefetch's four at most, CLOSE, LOGOUT
+    assert user.sim.stats['commands']['FETCH'] == len(shown)
+    assert user.sim.stats['round_trips'] <= 4 * len(shown) + 11
+
+
+def test_show_missing_part(account):
+    user = account({'INBOX': 20})
+    box = user.sim.folders['INBOX']
+    single = next(n for n, uid in enumerate(box.uids, 1) if box.message(uid).parts is None)
+    user.run('folder', '+INBOX')
+    # the server answers BODY[2] NIL, which mustn't reach the message cache
+    assert user.run('show', '-part', '2', str(single)) == f"Message INBOX:{single} has no part 2.\n"
+    assert user.run('show', '-part', '1', str(single)).startswith(box.message(box.uids[single - 1]).body.decode()[:40])
+
+
+class _Output(io.TextIOWrapper):
+    '''stdout writing to a BytesIO, a terminal or not'''
+
+    def __init__(self, tty):
+        super().__init__(io.BytesIO())
+        self.tty = tty
+
+    def isatty(self):
+        return self.tty
+
+
+def test_show_part_that_isnt_text(account, monkeypatch):
+    user = account({'INBOX': 40})
+    box = user.sim.folders['INBOX']
+    num, pdf = next((n, m.parts[1]) for n, m in enumerate(map(box.message, box.uids), 1) if m.parts and m.parts[1][1] == 'PDF')
+    user.run('folder', '+INBOX')
+    # a pager there to be found, and that mustn't be started
+    monkeypatch.setenv('PAGER', sys.executable)
+    monkeypatch.setattr(subprocess, 'Popen', None)
+    # fetched, then from the message cache
+    for _ in range(2):
+        for tty in (True, False):
+            with contextlib.redirect_stdout(_Output(tty)) as out:
+                mhi._cmd_dispatch(['mhi', 'show', '-part', '2', str(num)])
+                out.flush()
+            written = out.buffer.getvalue()
+            if tty:
+                assert written.endswith(b"isn't text; redirect show's output to save it.\n")
+            else:
+                assert written == base64.b64decode(pdf[5])
+
+
+def _answer_elsewhere(sim, num):
+    '''mark message num in INBOX \\Answered from another session'''
+    S = imaplib.IMAP4(*sim.server.sockets[0].getsockname()[:2])
+    S.login('user', 'secret')
+    S.select('INBOX')
+    S.store(str(num), '+FLAGS', '(\\Answered)')
+    S.logout()
+
+
+def _unanswered(box, nums):
+    return next(n for n in nums if '\\Answered' not in box.flags_of(box.uids[n - 1]))
+
+
+def test_scan_resyncs_flags_of_what_it_shows(account, monkeypatch):
+    user = account({'INBOX': 300})
+    box = user.sim.folders['INBOX']
+    user.run('folder', '+INBOX')
+    user.run('scan')
+    num = _unanswered(box, range(2, 300))
+    _answer_elsewhere(user.sim, num)
+    fetched = []
+
+    def fetch_stream(self, msgset, *args, **kwargs):
+        fetched.append(msgset)
+        return Connection_fetch_stream(self, msgset, *args, **kwargs)
+
+    Connection_fetch_stream = mhi.Connection.fetch_stream
+    monkeypatch.setattr(mhi.Connection, 'fetch_stream', fetch_stream)
+    out = user.run('scan', str(num))
+    # no CONDSTORE, so the flags of the one message shown are fetched, and only those
+    assert fetched == [str(box.uids[num - 1])]
+    assert out.startswith(f'{num:4} r ')
+
+
+def test_scan_resyncs_flags_with_condstore(account):
+    user = account({'INBOX': 300}, capabilities=CAPABILITIES + ' CONDSTORE')
+    box = user.sim.folders['INBOX']
+    user.run('folder', '+INBOX')
+    user.run('scan')
+    num = _unanswered(box, range(2, 300))
+    _answer_elsewhere(user.sim, num)
+    user.sim.reset_stats()
+    out = user.run('scan')
+    # what changed since last time, in one UID FETCH ... (CHANGEDSINCE ...), and nothing else
+    assert user.sim.stats['commands']['UID FETCH'] == 1
+    assert not user.sim.stats['commands']['FETCH']
+    assert out.splitlines()[num - 1].startswith(f'{num:4} r ')
+    user.sim.reset_stats()
+    user.run('scan')
+    assert not user.sim.stats['commands']['UID FETCH']
+
+
+def test_folders_with_list_status(account):
+    user = account(synthetic_folders(50, 40), capabilities=CAPABILITIES + ' LIST-STATUS')
+    user.run('folder', '+INBOX')
+    user.sim.reset_stats()
+    lines = user.run('folders').splitlines()
+    # every folder and its counts from the one LIST, with no STATUS, in a round trip of its own
+    commands = user.sim.stats['commands']
+    assert commands['LIST'] == 1 and not commands['STATUS']
+    assert user.sim.stats['round_trips'] == sum(commands.values()) + 1
+    box = user.sim.folders['Lists/list007']
+    assert lines[9].split() == ['Lists/list007', '-', '100', '0', str(box.unseen())]
+
+
+def test_pick_end_to_end(account):
+    user = account({'INBOX': 30})
+    user.run('folder', '+INBOX')
+    assert user.run('pick', 'OR', '3:5', '9') == '3-5,9\n'
+    assert user.run('pick', '3:5', '9') == '0\n'
+
+
+def test_pick_text_without_an_index(account):
+    user = account({'INBOX': 30})
+    user.run('folder', '+INBOX')
+    user.sim.reset_stats()
+    found = user.run('pick', 'BODY', 'banana')
+    assert found != '0\n'
+    # asked the server, and left no index behind
+    assert user.sim.stats['commands']['SEARCH'] == 1
+    assert not (user.home / '.mhi' / 'text.db').exists()
+    user.run('index')
+    user.sim.reset_stats()
+    assert user.run('pick', 'BODY', 'banana') == found
+    assert not user.sim.stats['commands']['SEARCH']
+
+
+def test_password_command_runs_while_connecting(account):
+    rtt = 0.2
+    user = account({'INBOX': 10}, 'password_cache_ttl = 0\n', rtt=rtt)
+    mhi.init_config()
+    host, port = user.sim.server.sockets[0].getsockname()[:2]
+    settings = {'connection': f'imap://user@{host}:{port}', 'connection_user': 'user', 'compress': False}
+
+    def logged_in(passwd):
+        start = time.monotonic()
+        mhi.open_session({**settings, 'connection_passwd': passwd}).logout()
+        return time.monotonic() - start
+
+    plain = logged_in('secret')
+    # a password command that takes as long as connecting (the greeting and
+    # CAPABILITY), run one after the other, would add that much again
+    overlapped = logged_in(f'`sleep {2 * rtt}; echo secret`')
+    assert overlapped < plain + rtt
+
+
+def _expunge_elsewhere(sim, num):
+    '''expunge message num from INBOX in another session'''
+    S = imaplib.IMAP4(*sim.server.sockets[0].getsockname()[:2])
+    S.login('user', 'secret')
+    S.select('INBOX')
+    S.store(str(num), '+FLAGS', '(\\Deleted)')
+    S.expunge()
+    S.logout()
+
+
+def test_next_shows_prefetched_before_connecting(account, monkeypatch):
+    user = account({'INBOX': 10})
+    box = user.sim.folders['INBOX']
+    user.run('folder', '+INBOX')
+    user.run('show', '4')
+    shown_by = []
+
+    def open_session(settings):
+        # what had been written by the time the server was first spoken to
+        shown_by.append(sys.stdout.getvalue())
+        return mhi_open_session(settings)
+
+    mhi_open_session = mhi.open_session
+    monkeypatch.setattr(mhi, 'open_session', open_session)
+    user.sim.reset_stats()
+    out = user.run('next')
+    assert box.message(box.uids[4]).message_id in shown_by[0] == out
+    # and then it was marked \Seen, and 6 prefetched
+    assert '\\Seen' in box.flags_of(box.uids[4])
+    assert user.sim.stats['commands']['UID STORE'] == 1
+    assert box.message(box.uids[5]).message_id in user.run('next')
+    assert len(shown_by) == 2
+
+
+def test_show_prefetched_after_expunge_elsewhere(account, capsys):
+    user = account({'INBOX': 10})
+    box = user.sim.folders['INBOX']
+    user.run('folder', '+INBOX')
+    user.run('show', '4')
+    prefetched = box.uids[4]
+    _expunge_elsewhere(user.sim, 2)
+    # 5 was prefetched, so it's shown by the UID map as it was, then the
+    # map is brought up to date to mark it \Seen, and the change noted
+    out = user.run('show', '5')
+    assert box.message(prefetched).message_id in out
+    assert capsys.readouterr().err == "(Message INBOX:5, shown from the message cache, is message 4 now.)\n"
+    assert '\\Seen' in box.flags_of(prefetched)
+    assert mhi.state['INBOX.cur'] == '4'
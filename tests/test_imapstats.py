@@ -0,0 +1,28 @@
+import json
+
+from imapsim import synthetic_folders
+
+from mhi import main as mhi
+
+
+def test_stats_and_trace_match_the_server(account, capsys):
+    user = account(synthetic_folders(50, 40), 'status_sessions = 2\n')
+    trace = user.home / 'trace.jsonl'
+    user.run('--stats', f'--trace={trace}', 'folders')
+    records = [json.loads(line) for line in trace.read_text().splitlines()]
+    # the STATUSes are shared out between the extra sessions, and pipelined on each
+    assert len({r['session'] for r in records}) == 3
+    assert sum(r['command'] == 'STATUS' for r in records) == 41
+    # connecting and each session's commands, with its STATUSes as one; the
+    # server may see more if a pipelined command is slow to reach it
+    round_trips = sum(r['round_trips'] for r in records)
+    assert round_trips == 8 + 5 + 5 <= user.sim.stats['round_trips']
+    assert sum(r['responses'].get('STATUS', 0) for r in records) == 41
+    summary = capsys.readouterr().err
+    assert f"3 sessions, {len(records) - 3} commands, {round_trips} round trips" in summary
+
+
+def test_unknown_option(capsys):
+    assert mhi._options(['mhi', '--verbose', 'scan']) == (None, ['mhi', '--verbose', 'scan'])
+    assert 'Unknown option --verbose' in capsys.readouterr().out
+    assert mhi._options(['mhi', '--stats', 'scan', '--stats']) == ({'--stats': ''}, ['mhi', 'scan', '--stats'])
@@ -0,0 +1,38 @@
+from mhi.mimeparts import Part, decode, describe, parts
+from mhi.response import fetch_responses
+
+MIXED = (
+    b'2 (BODYSTRUCTURE ((("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "QUOTED-PRINTABLE" 28 1 NIL NIL NIL)'
+    b'("TEXT" "HTML" ("CHARSET" "utf-8") NIL NIL "7BIT" 40 1 NIL NIL NIL) "ALTERNATIVE" ("BOUNDARY" "b2") NIL NIL)'
+    b'("APPLICATION" "PDF" NIL NIL NIL "BASE64" 42004412 NIL ("ATTACHMENT" ("FILENAME" "report.pdf")) NIL)'
+    b'("MESSAGE" "RFC822" NIL NIL NIL "7BIT" 300 (NIL "fwd" NIL NIL NIL NIL NIL NIL NIL NIL) ("TEXT" "PLAIN" NIL NIL NIL "7BIT" 10 1) 12 NIL NIL)'
+    b' "MIXED" ("BOUNDARY" "b1") NIL NIL))'
+)
+
+
+def _structure(line):
+    return [items['BODYSTRUCTURE'] for _, items in fetch_responses([line])][0]
+
+
+def test_multipart():
+    found = parts(_structure(MIXED))
+    assert [(p.section, p.mimetype, p.shown) for p in found] == [
+        ('1.1', 'text/plain', True),
+        ('1.2', 'text/html', False),
+        ('2', 'application/pdf', False),
+        ('3', 'message/rfc822', False),
+    ]
+    assert found[0].encoding == 'quoted-printable' and found[0].params == {'charset': 'utf-8'}
+    assert describe(found[2]) == '[part 2: application/pdf "report.pdf", 40M]'
+
+
+def test_single_part_is_part_1():
+    line = b'1 (BODYSTRUCTURE ("TEXT" "HTML" ("CHARSET" "us-ascii") NIL NIL "7BIT" 16 1 NIL NIL NIL))'
+    assert [(p.section, p.shown) for p in parts(_structure(line))] == [('1', True)]
+
+
+def test_decode():
+    plain = Part('1', 'text/plain', {'charset': 'utf-8'}, 'quoted-printable', 9, None, True)
+    assert decode(plain, b'caf=C3=A9 =\r\nbar') == 'café bar'
+    pdf = Part('2', 'application/pdf', {}, 'base64', 8, 'x.pdf', False)
+    assert decode(pdf, memoryview(b'JVBERi0=\r\n')) == b'%PDF-'
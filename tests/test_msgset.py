@@ -0,0 +1,106 @@
+import sys
+
+import pytest
+
+from mhi import main as mhi
+from mhi.main import WindowSizer, _expand_msgset, _msgset_ranges, _windows
+
+def test_expand():
+    assert _expand_msgset('1:*', 4) == [1, 2, 3, 4]
+    assert _expand_msgset('3,1', 4) == [1, 3]
+    assert _expand_msgset('2:3,*', 5) == [2, 3, 5]
+    assert _expand_msgset('4:2', 5) == [2, 3, 4]
+    assert _expand_msgset('3:9', 4) == [3, 4]
+    assert _expand_msgset('1:*', 0) == []
+
+
+def test_ranges():
+    assert _msgset_ranges('5:2', 10) == [(2, 5)]
+    assert _msgset_ranges('*', 7) == [(7, 7)]
+    assert _msgset_ranges('3:*', 7) == [(3, 7)]
+    assert _msgset_ranges('*:3', 7) == [(3, 7)]
+    # overlapping and adjacent ranges merge, whatever order they're given in
+    assert _msgset_ranges('9,2:6,1:3', 10) == [(1, 6), (9, 9)]
+    assert _msgset_ranges('1:2,3:4', 10) == [(1, 4)]
+    # clamped to the folder
+    assert _msgset_ranges('8:20', 10) == [(8, 10)]
+    assert _msgset_ranges('12,0', 10) == []
+
+
+def test_windows():
+    assert list(_windows([(1, 5), (8, 9)], lambda: 3)) == [[1, 2, 3], [4, 5, 8], [9]]
+    assert list(_windows([], lambda: 3)) == []
+    # the size is asked for afresh for each window
+    sizes = iter([2, 2, 4, 4, 1, 1])
+    size = 2
+
+    def grow():
+        return size
+
+    windows = []
+    for window in _windows([(1, 10)], grow):
+        windows.append(window)
+        size = next(sizes)
+    assert windows == [[1, 2], [3, 4], [5, 6], [7, 8, 9, 10]]
+
+
+def test_sizer_grows_while_windows_are_quick():
+    sizer = WindowSizer(size=25, target=0.5)
+    sizer.update(25, 0.01, 2500)
+    assert sizer.size == 100
+    sizer.update(100, 0.02, 10000)
+    assert sizer.size == 400
+
+
+def test_sizer_shrinks_to_the_target_time():
+    sizer = WindowSizer(size=400, target=0.5)
+    sizer.update(400, 2.0, 40000)
+    assert sizer.size == 100
+
+
+def test_sizer_shrinks_to_the_byte_limit():
+    sizer = WindowSizer(size=100, max_bytes=1000000)
+    sizer.update(100, 0.01, 10000000)
+    assert sizer.size == 10
+
+
+def test_sizer_clamps():
+    sizer = WindowSizer(size=4000, max_size=5000)
+    sizer.update(4000, 0.01, 1000)
+    assert sizer.size == 5000
+    sizer.update(5000, 10000.0, 1000)
+    assert sizer.size == 1
+    # an empty window says nothing about how big the next should be
+    sizer.update(0, 5.0, 0)
+    assert sizer.size == 1
+
+
+def _count(msgset):
+    return sum(end - start + 1 for start, end in _msgset_ranges(msgset.replace('*', '0'), 10 ** 9))
+
+
+@pytest.mark.parametrize('rc, warm', [('', False), ('', True), ('scan_cache = no\n', False)])
+def test_scan_shows_lines_before_fetching_everything(account, monkeypatch, rc, warm):
+    user = account({'INBOX': 3000}, rc)
+    fetches = []
+
+    def fetch_stream(self, msgset, items, *args, **kwargs):
+        # envelopes or, from a warm cache without CONDSTORE, just flags:
+        # how many messages were asked for, and how many lines were out by then
+        fetches.append((_count(msgset), sys.stdout.getvalue().count('\n')))
+        return Connection_fetch_stream(self, msgset, items, *args, **kwargs)
+
+    Connection_fetch_stream = mhi.Connection.fetch_stream
+    monkeypatch.setattr(mhi.Connection, 'fetch_stream', fetch_stream)
+    user.run('folder', '+INBOX')
+    if warm:
+        user.run('scan')
+        fetches.clear()
+    out = user.run('scan')
+    assert out.count('\n') == 3000
+    assert len(fetches) > 2
+    # a small window first, so the first lines come quickly, and every
+    # window's lines were printed before the next was fetched
+    assert fetches[0] == (WindowSizer().size, 0)
+    assert all(printed == sum(n for n, _ in fetches[:i]) for i, (_, printed) in enumerate(fetches))
+    assert max(n for n, _ in fetches) <= WindowSizer().max_size
@@ -0,0 +1,41 @@
+import pstats
+
+import pytest
+
+from mhi import main as mhi
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def test_cpu_profile(workdir, capsys):
+    mhi._cmd_dispatch(['mhi', '--profile', 'help', 'scan'])
+    assert 'Help on scan' in capsys.readouterr().out
+    stats = pstats.Stats(str(workdir / 'mhi-help.pstats'))
+    assert any(name == 'help' for _, _, name in stats.stats)
+
+
+def test_memory_profile_even_on_exit(workdir):
+    with pytest.raises(SystemExit):
+        mhi._cmd_dispatch(['mhi', '--profile=mem', 'help'])
+    assert (workdir / 'mhi-help.mem.txt').read_text().startswith('mhi help: peak ')
+
+
+def test_bad_profile_kind(workdir, capsys):
+    mhi._cmd_dispatch(['mhi', '--profile=gpu', 'help'])
+    assert capsys.readouterr().out.startswith('Usage: --profile[=cpu|mem]')
+    assert not list(workdir.glob('mhi-*'))
+
+
+def test_memory_profile_sees_what_fetches_hold(workdir, account):
+    user = account({'INBOX': 50}, 'message_cache = 0\n')
+    user.run('folder', '+INBOX')
+    user.run('--profile=mem', 'show', '1-50')
+    report = (workdir / 'mhi-show.mem.txt').read_text()
+    assert 'at the fullest checkpoint (the end of a FETCH,' in report
+    # the message text show fetched, long since freed by the time it exits
+    assert 'response.py' in report
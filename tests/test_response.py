@@ -0,0 +1,32 @@
+import pytest
+
+from mhi.response import ParseError, decoded, fetch_responses, parse, text
+
+
+def test_fetch_with_literals():
+    data = [
+        (b'7 (UID 12 ENVELOPE ("Tue, 3 Jan 1989 09:42:34 +0200" {9}', b'a "quote"'),
+        (b' (("B\\"ob" NIL "bob" "x.org")) NIL NIL NIL NIL NIL NIL NIL) BODY[HEADER.FIELDS (FROM)] {5}', b'From:'),
+        b' FLAGS (\\Seen))',
+        b'8 (UID 13 FLAGS ())',
+    ]
+    (n1, m1), (n2, m2) = fetch_responses(data)
+    assert (n1, n2) == (7, 8)
+    assert m1['UID'] == 12
+    envelope = decoded(m1['ENVELOPE'])
+    assert envelope[1] == 'a "quote"'
+    assert envelope[2] == [['B"ob', None, 'bob', 'x.org']]
+    assert text(m1['BODY[HEADER.FIELDS (FROM)]']) == 'From:'
+    assert m1['FLAGS'] == ['\\Seen']
+    assert m2['FLAGS'] == []
+
+
+def test_list_and_search():
+    lists = [b'(\\HasNoChildren) "/" "INBOX"', (b'() "/" {4}', b'a(b)'), b'']
+    assert [text(name) for _, _, name in parse(lists)] == ['INBOX', 'a(b)']
+    assert list(parse([b'1 2 3', b'', None])) == [[1, 2, 3], []]
+
+
+def test_unbalanced():
+    with pytest.raises(ParseError):
+        list(parse([b'1 (UID 2']))
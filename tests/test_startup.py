@@ -0,0 +1,56 @@
+import contextlib
+import io
+import os
+import subprocess
+import sys
+
+from mhi import main as mhi
+
+# what every command used to import up front, whether it needed it or not
+HEAVY = ('imaplib', 'smtplib', 'ssl', 'tempfile', 'shutil', 'email.message')
+
+
+def test_import_is_light():
+    code = f'import sys, mhi.main; print(" ".join(m for m in {HEAVY!r} if m in sys.modules))'
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    assert result.stdout.split() == []
+
+
+def _imported(code, modules, home):
+    '''which of modules are imported after running code with HOME at home'''
+    code = f'import sys; from mhi import main as mhi; {code}; print(" ".join(m for m in {modules!r} if m in sys.modules), file=sys.stderr)'
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True, env={**os.environ, 'HOME': str(home)})
+    return result.stderr.split()
+
+
+def test_config_loads_without_sqlite(tmp_path):
+    assert _imported('mhi.init_config()', ('sqlite3',), tmp_path) == []
+
+
+def test_connecting_without_mhid_leaves_it_out(account):
+    user = account({'INBOX': 3})
+    code = "mhi._cmd_dispatch(['mhi', 'folder', '+INBOX'])"
+    assert _imported(code, ('mhi.daemon', 'mhi.imapstats', 'multiprocessing.connection'), user.home) == []
+
+
+def test_every_command_resolves():
+    for name in mhi.Commands:
+        assert callable(mhi._command(name)), name
+    assert mhi._command('nonesuch') is None
+
+
+def test_paging_is_decided_when_called(monkeypatch):
+    class Terminal(io.StringIO):
+        def isatty(self):
+            return True
+
+    monkeypatch.setattr(sys, 'stdout', Terminal())
+
+    @mhi.paged
+    def hello():
+        print('hello')
+
+    # decorated with a terminal for stdout, but called without one
+    with contextlib.redirect_stdout(io.StringIO()) as out:
+        hello()
+    assert out.getvalue() == 'hello\n'
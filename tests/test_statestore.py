@@ -0,0 +1,94 @@
+import io
+import multiprocessing
+import os
+import sqlite3
+import sys
+
+from mhi import main as mhi
+from mhi.scancache import open_cache
+from mhi.statestore import open_state
+
+
+def test_migrate_and_write(tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+    (tmp_path / '.mhistate').write_text('folder = Lists\nINBOX.cur = 12\nLists.cur = 3\n')
+    state = open_state(str(tmp_path))
+    assert state['folder'] == 'Lists'
+    assert state.get('INBOX.cur') == '12'
+    assert state.get('Sent.cur', 'unset') == 'unset'
+    # the old file is only read once
+    (tmp_path / '.mhistate').write_text('folder = Elsewhere\n')
+    state = open_state(str(tmp_path))
+    assert state['folder'] == 'Lists'
+
+    state['folder'] = 'Lists'
+    state['INBOX.cur'] = 12
+    assert not state.dirty
+    state['INBOX.cur'] = 13
+    del state['Lists.cur']
+    changes = state.db.total_changes
+    state.write()
+    assert state.db.total_changes == changes + 2
+    state.write()
+    assert state.db.total_changes == changes + 2
+
+    state = open_state(str(tmp_path))
+    assert state['INBOX.cur'] == '13'
+    assert 'Lists.cur' not in state
+
+
+def _dispatches(home, folder, count):
+    '''show each of count messages in folder, a command at a time, as
+    that many mhi processes one after the other would'''
+    os.environ['HOME'] = home
+    sys.stdout = io.StringIO()
+    for n in range(1, count + 1):
+        mhi.init_config()
+        mhi._dispatch(['mhi', 'show', f'+{folder}', str(n)])
+
+
+def test_concurrent_dispatches(account):
+    folders = [f'F{i}' for i in range(8)]
+    user = account(dict.fromkeys(['INBOX', *folders], 20))
+    user.run('folder', '+INBOX')
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=_dispatches, args=(str(user.home), f, 20)) for f in folders]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join(60)
+        assert w.exitcode == 0
+    # each one's cur and UID map got written, whoever else was writing at the time
+    state = open_state(str(user.home))
+    for f in folders:
+        assert state[f'{f}.cur'] == '20'
+        assert len(open_cache(f).uids) == 20
+        box = user.sim.folders[f]
+        # shown from the server or, prefetched, from the message cache: marked \Seen either way
+        assert all('\\Seen' in box.flags_of(u) for u in box.uids)
+    assert state['folder'] in folders
+
+
+def test_caches_dont_hold_writes_over_the_network(account, monkeypatch):
+    opened = []
+
+    def connect(*args, **kwargs):
+        opened.append(sqlite3_connect(*args, **kwargs))
+        return opened[-1]
+
+    def fetch_stream(self, *args, **kwargs):
+        for hit in Connection_fetch_stream(self, *args, **kwargs):
+            # another command could be waiting to write
+            assert not any(db.in_transaction for db in opened)
+            yield hit
+
+    sqlite3_connect, Connection_fetch_stream = sqlite3.connect, mhi.Connection.fetch_stream
+    monkeypatch.setattr(sqlite3, 'connect', connect)
+    monkeypatch.setattr(mhi.Connection, 'fetch_stream', fetch_stream)
+    user = account({'INBOX': 300})
+    user.run('folder', '+INBOX')
+    # envelopes, then (no CONDSTORE here) flags, a window at a time
+    user.run('scan', '1-300')
+    user.run('scan', '1-300')
+    user.run('pick', 'BODY', 'invoice')
+    assert {db.execute('PRAGMA journal_mode').fetchone()[0] for db in opened} == {'wal'}
@@ -0,0 +1,65 @@
+from mhi.textindex import open_index, text_criteria
+
+
+def test_text_criteria():
+    assert text_criteria(['BODY', 'foo']) == [('BODY', 'foo')]
+    assert text_criteria(['(text', '"foo bar"', 'BODY', 'baz)']) == [('TEXT', 'foo bar'), ('BODY', 'baz')]
+    assert text_criteria(['FROM', 'bob']) is None
+    assert text_criteria(['BODY', 'foo', 'UNSEEN']) is None
+    assert text_criteria(['BODY']) is None
+
+
+class FakeSession:
+    '''just enough of a Connection for FolderIndex.sync'''
+
+    def __init__(self, msgs):
+        self.msgs = msgs
+
+    def raw_response(self, code):
+        values = {'EXISTS': len(self.msgs), 'UIDVALIDITY': 1, 'UIDNEXT': max(self.msgs, default=0) + 1}
+        return code, [str(values[code]).encode()]
+
+    def uid(self, cmd, charset, criteria, errmsg=None):
+        lo = int(criteria.split()[-1].split(':')[0]) if criteria != 'ALL' else 1
+        return [' '.join(str(u) for u in sorted(self.msgs) if u >= lo).encode()]
+
+    def fetch_stream(self, uidset, items, uid=False, sizer=None):
+        wanted = set()
+        for r in uidset.split(','):
+            lo, _, hi = r.partition(':')
+            wanted.update(range(int(lo), int(hi or lo) + 1))
+        for seq, u in enumerate(sorted(self.msgs), 1):
+            if u in wanted:
+                yield seq, {'UID': u, 'BODY[]': self.msgs[u]}
+
+
+def test_index_and_search(tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+    msgs = {
+        3: b'Subject: lunch\r\n\r\nhow about tacos?\r\n',
+        5: b'Subject: tacos\r\n\r\nno thanks\r\n',
+        9: b'Subject: re: lunch\r\n\r\nTACOS it is, 50% off\r\n',
+    }
+    index = open_index('INBOX')
+    assert not index.indexed
+    assert index.sync(FakeSession(msgs)) == 3
+    assert index.search([('BODY', 'tacos')]) == [1, 3]
+    assert index.search([('TEXT', 'tacos')]) == [1, 2, 3]
+    assert index.search([('TEXT', 'lunch'), ('BODY', '0%')]) == [3]
+    # message 5 is expunged, 12 arrives
+    del msgs[5]
+    msgs[12] = b'Subject: dinner\r\n\r\ntacos again\r\n'
+    index = open_index('INBOX')
+    assert index.sync(FakeSession(msgs)) == 1
+    assert index.search([('TEXT', 'tacos')]) == [1, 2, 3]
+    assert index.search([('TEXT', 'thanks')]) == []
+
+
+def test_open_without_creating(tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+    text_db = tmp_path / '.mhi' / 'text.db'
+    assert open_index('INBOX', create=False) is None
+    assert not text_db.exists()
+    open_index('INBOX').sync(FakeSession({3: b'Subject: lunch\r\n\r\ntacos\r\n'}))
+    assert open_index('Archive', create=False) is None
+    assert open_index('INBOX', create=False).search([('BODY', 'tacos')]) == [1]
@@ -0,0 +1,53 @@
+from array import array
+
+from mhi import main as mhi
+from mhi.scancache import open_cache
+
+
+def test_seq_uid_map(tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+    m = open_cache('INBOX')
+    m.uidvalidity, m.uidnext, m.uids = 7, 31, array('I', [10, 11, 12, 20, 21, 30])
+    assert m.uids_for('2:3,6') == [11, 12, 30]
+    assert m.uids_for('5:*') == [21, 30]
+    assert (m.uid(4), m.uid(7), m.seq(20), m.seq(13)) == (20, None, 4, None)
+    # what a server says expunging 11 and 20: the second number is after the first is gone
+    m.expunged([2, 3])
+    assert list(m.uids) == [10, 12, 21, 30]
+    assert list(open_cache('INBOX').uids) == [10, 12, 21, 30]
+
+
+def test_cur_follows_uid(tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+    mhi.init_config()
+    m = open_cache('INBOX')
+    m.uidvalidity, m.uids = 7, array('I', [10, 11, 12, 20])
+    mhi._set_cur('INBOX', 4, 20, 7)
+    m.expunged([1])
+    mhi._follow_cur('INBOX', m)
+    assert mhi.state['INBOX.cur'] == '3'
+    # a different UIDVALIDITY means the UID can't be trusted
+    m.uidvalidity = 8
+    m.expunged([1])
+    mhi._follow_cur('INBOX', m)
+    assert mhi.state['INBOX.cur'] == '3'
+
+
+def test_cur_moves_on_when_its_message_goes(tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+    mhi.init_config()
+    m = open_cache('INBOX')
+    m.uidvalidity, m.uids = 7, array('I', [10, 11, 12, 20])
+    mhi._set_cur('INBOX', 2, 11, 7)
+    m.expunged([2])
+    mhi._follow_cur('INBOX', m)
+    # to the next message, as in MH
+    assert (mhi.state['INBOX.cur'], mhi.state['INBOX.curuid']) == ('2', '7:12')
+    mhi._set_cur('INBOX', 3, 20, 7)
+    m.expunged([3])
+    mhi._follow_cur('INBOX', m)
+    # or the last, if it was the last
+    assert (mhi.state['INBOX.cur'], mhi.state['INBOX.curuid']) == ('2', '7:12')
+    m.expunged([2, 1])
+    mhi._follow_cur('INBOX', m)
+    assert 'INBOX.cur' not in mhi.state and 'INBOX.curuid' not in mhi.state
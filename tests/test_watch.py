@@ -0,0 +1,61 @@
+import imaplib
+import socket
+import threading
+
+from mhi import imapext
+from mhi import watch
+
+
+class PairedIMAP4(imaplib.IMAP4):
+    '''an IMAP4 session talking to the other end of a socketpair'''
+
+    def __init__(self, sock):
+        self.paired = sock
+        super().__init__()
+
+    def open(self, host='', port=imaplib.IMAP4_PORT, timeout=None):
+        self.host, self.port = host, port
+        self.sock = self.paired
+        self.file = self.sock.makefile('rb')
+
+
+def _server(sock, script):
+    '''answer one command per script entry, each a list of lines to send'''
+    lines = sock.makefile('rb')
+    sock.sendall(b'* OK ready\r\n')
+    for replies in script:
+        command = lines.readline().decode()
+        tag = command.split()[0]
+        for line in replies:
+            if line == 'DONE?':
+                assert lines.readline() == b'DONE\r\n'
+            else:
+                sock.sendall(line.format(tag=tag).encode() + b'\r\n')
+
+
+def test_idle():
+    ours, theirs = socket.socketpair()
+    script = [
+        ['* CAPABILITY IMAP4rev1 IDLE', '{tag} OK done'],
+        ['+ idling', '* 4 EXISTS', '* 2 EXPUNGE', 'DONE?', '* 1 RECENT', '{tag} OK IDLE done'],
+    ]
+    server = threading.Thread(target=_server, args=(theirs, script))
+    server.start()
+    session = PairedIMAP4(ours)
+    session.state = 'SELECTED'
+    seen = list(imapext.idle(session, 0.2))
+    server.join()
+    assert seen == [('EXISTS', [b'4']), ('EXPUNGE', [b'2']), ('RECENT', [b'1'])]
+
+
+def test_watch_events(home):
+    counts = {'INBOX': 3}
+    lines = watch._watch_events('INBOX', 'EXISTS', [b'5'], counts)
+    assert [line.split(' ', 1)[1] for line in lines] == ['INBOX: 2 new messages, 5 in all']
+    lines = watch._watch_events('INBOX', 'EXPUNGE', [b'1', b'1'], counts)
+    assert [line.split(' ', 1)[1] for line in lines] == ['INBOX: 2 removed, 3 left']
+    # the first STATUS of another folder (from NOTIFY SET STATUS) is just noted
+    assert watch._watch_events('INBOX', 'STATUS', [b'Lists (MESSAGES 10 UIDNEXT 11)'], counts) == []
+    lines = watch._watch_events('INBOX', 'STATUS', [b'Lists (MESSAGES 12 UIDNEXT 13)'], counts)
+    assert [line.split(' ', 1)[1] for line in lines] == ['Lists: 2 new, 12 in all']
+    assert counts == {'INBOX': 3, 'Lists': 12}